@@ -1,35 +1,102 @@
 import boto3
-import json
 import logging
-import re
+import os
+from botocore.config import Config
+
+from app.bedrock_hedge import CircuitBreaker, HedgedInvoker
+from app.bedrock_invoker import BedrockInvoker
+from app.email_utils import normalize_email
+from app.history_store import make_history_store
+from app.intents import IntentEngine
+from app.metrics import metrics
+from app.prompt_builder import PromptBuilder
+from app.reply_cache import ReplyCache, cacheable
+from app.reply_templates import TemplateFastPath
 
 # -----------------------------------------------------------
 # GLOBALS
 # -----------------------------------------------------------
 
-bedrock = boto3.client("bedrock-runtime", region_name="us-east-1")
-
-# In-memory conversation tracking
-conversation_history = {}
-
-# -----------------------------------------------------------
-# EMAIL NORMALIZATION
-# -----------------------------------------------------------
-
-def normalize_email(raw_email):
-    """Extract and clean email (Gmail format safe)."""
-    if not raw_email:
-        return None
-
-    # Extract <email> if present
-    match = re.search(r"<(.+?)>", raw_email)
-    email_clean = match.group(1) if match else raw_email
-
-    # Trim + lowercase
-    email_clean = email_clean.strip().lower()
-
-    return email_clean if "@" in email_clean else None
-
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+BEDROCK_REGION = os.getenv("BEDROCK_REGION", "us-east-1")
+
+# Optional second route for hedging / failover: same model in another
+# region and/or another model. Unset = single route, no hedging.
+FALLBACK_REGION = os.getenv("BEDROCK_FALLBACK_REGION")
+FALLBACK_MODEL_ID = os.getenv("BEDROCK_FALLBACK_MODEL_ID")
+
+
+def _bedrock_client(region):
+    # Retries are handled by the invoker (throttle-aware), not botocore
+    return boto3.client(
+        "bedrock-runtime",
+        region_name=region,
+        config=Config(
+            retries={"total_max_attempts": 1},
+            connect_timeout=float(os.getenv("BEDROCK_CONNECT_TIMEOUT", 5)),
+            read_timeout=float(os.getenv("BEDROCK_READ_TIMEOUT", 60)),
+        ),
+    )
+
+
+def _invoker(client):
+    # Rate-limited, adaptive-concurrency wrapper around invoke_model
+    return BedrockInvoker(
+        client,
+        rpm=int(os.getenv("BEDROCK_RPM", 60)),
+        tpm=int(os.getenv("BEDROCK_TPM", 100_000)),
+        max_concurrency=int(os.getenv("BEDROCK_MAX_CONCURRENCY", 8)),
+        deadline=float(os.getenv("BEDROCK_DEADLINE", 60)),
+    )
+
+
+bedrock = _bedrock_client(BEDROCK_REGION)
+bedrock_invoker = _invoker(bedrock)
+
+# Hedge to the fallback route once the primary passes its p95 latency,
+# and fail over while the primary's error rate trips the breaker
+hedged_invoker = None
+if FALLBACK_REGION or FALLBACK_MODEL_ID:
+    hedged_invoker = HedgedInvoker(
+        bedrock_invoker,
+        _invoker(_bedrock_client(FALLBACK_REGION or BEDROCK_REGION)),
+        fallback_model=FALLBACK_MODEL_ID,
+        percentile=float(os.getenv("BEDROCK_HEDGE_PERCENTILE", 0.95)),
+        initial_hedge_after=float(os.getenv("BEDROCK_HEDGE_AFTER", 5)),
+        breaker=CircuitBreaker(
+            error_rate=float(os.getenv("BEDROCK_BREAKER_ERROR_RATE", 0.5)),
+            cooldown=float(os.getenv("BEDROCK_BREAKER_COOLDOWN", 30)),
+        ),
+    )
+
+# Short-term conversation memory (HISTORY_BACKEND=sqlite to persist it)
+history_store = make_history_store(
+    backend=os.getenv("HISTORY_BACKEND", "memory"),
+    path=os.getenv("HISTORY_DB_PATH") or os.path.join(os.getenv("STATE_DIR", "state"), "history.db"),
+    max_senders=int(os.getenv("HISTORY_MAX_SENDERS", 10_000)),
+    ttl=int(os.getenv("HISTORY_TTL", 7 * 24 * 3600)),
+)
+
+# Cache of model replies (temperature 0 → same prompt, same answer)
+reply_cache = ReplyCache(
+    max_entries=int(os.getenv("REPLY_CACHE_MAX_ENTRIES", 5000)),
+    ttl=int(os.getenv("REPLY_CACHE_TTL", 3600)),
+    max_bytes=int(os.getenv("REPLY_CACHE_MAX_MB", 32)) * 1024 * 1024,
+    path=os.getenv("REPLY_CACHE_PATH") or None,
+)
+
+# Keyword intents compiled from config (INTENTS_CONFIG overrides the default file)
+intent_engine = IntentEngine.from_config(os.getenv("INTENTS_CONFIG") or None)
+
+# Static system prompt + compact, budgeted user prompt
+prompt_builder = PromptBuilder(token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", 1200)))
+
+# Local template answers for purely structured intents
+fast_path = TemplateFastPath(max_words=int(os.getenv("FAST_PATH_MAX_WORDS", 40)))
+
+bedrock_seconds = metrics.histogram("bedrock_seconds", "Bedrock call latency incl. throttling and retries")
+bedrock_tokens = metrics.counter("bedrock_tokens_total", "Bedrock tokens used, by direction")
+replies_total = metrics.counter("replies_total", "Replies composed, by source")
 
 # -----------------------------------------------------------
 # CONVERSATION MEMORY HANDLERS
@@ -37,18 +104,12 @@ def normalize_email(raw_email):
 
 def get_history(email):
     """Return last 3 user+assistant messages."""
-    hist = conversation_history.get(email, [])
-    return hist[-6:]   # last 3 pairs (6 messages)
+    return history_store.get(normalize_email(email) or email)
 
 
 def add_to_history(email, role, message):
     """Store message for short-term memory."""
-    conversation_history.setdefault(email, [])
-    conversation_history[email].append({"role": role, "text": message})
-
-    # Prevent memory from growing too large
-    if len(conversation_history[email]) > 12:
-        conversation_history[email] = conversation_history[email][-12:]
+    history_store.add(normalize_email(email) or email, role, message)
 
 
 # -----------------------------------------------------------
@@ -56,206 +117,144 @@ def add_to_history(email, role, message):
 # -----------------------------------------------------------
 
 def detect_intents(message):
-    message = message.lower()
-    intents = []
-
-    if any(k in message for k in ["emi", "due date", "next emi"]):
-        intents.append("emi_due_date")
-
-    if any(k in message for k in ["emi amount", "how much", "monthly amount"]):
-        intents.append("emi_amount")
-
-    if any(k in message for k in ["status", "paid", "payment status"]):
-        intents.append("emi_status")
-
-    if any(k in message for k in ["fee", "charges", "late fee", "penalty"]):
-        intents.append("fee_details")
-
-    if "statement" in message:
-        intents.append("loan_statement")
-
-    if not intents:
-        intents.append("general_query")
-
-    return intents
+    return intent_engine.classify(message)
 
 
 # -----------------------------------------------------------
 # CUSTOMER VALIDATION
 # -----------------------------------------------------------
 
-def find_customer_by_email(raw_email, customers_df):
+def find_customer_by_email(raw_email, customer_index):
     """Match customer email ignoring <>, spaces, and case differences."""
-    clean_email = normalize_email(raw_email)
-    if not clean_email:
-        return None
-
-    df = customers_df.copy()
-    df["email_clean"] = df["email"].astype(str).str.strip().str.lower()
-
-    match = df[df["email_clean"] == clean_email]
-
-    if match.empty:
-        return None
-
-    return match.iloc[0].to_dict()
+    return customer_index.lookup(raw_email)
 
 
 # -----------------------------------------------------------
 # LOAN LOOKUP
 # -----------------------------------------------------------
 
-def find_loan_details(customer_id, fees_df, loans_df):
-    loan_row = loans_df[loans_df["customer_id"] == customer_id]
-    if loan_row.empty:
-        return None
-
-    loan_row = loan_row.iloc[0].to_dict()
-
-    fee_row = fees_df[fees_df["loan_id"] == loan_row["loan_id"]]
-    loan_row["fees"] = fee_row.iloc[0].to_dict() if not fee_row.empty else {}
-
-    return loan_row
+def find_loan_details(customer_id, loan_store):
+    """Return all loans (with fees attached) for a customer, or None."""
+    loans = loan_store.lookup(customer_id)
+    return list(loans) if loans else None
 
 
 # -----------------------------------------------------------
 # PROMPT BUILDER
 # -----------------------------------------------------------
 
-def build_prompt(customer, loan_info, user_message, intents, history):
-    fee_text = json.dumps(loan_info.get("fees", {}), indent=2)
-
-    # Build conversation transcript
-    history_text = ""
-    for h in history:
-        history_text += f"{h['role'].upper()}: {h['text']}\n"
-
-    prompt = f"""
-You are a professional banking support AI. Your replies must be factual, courteous, and based only on the loan data provided below.
-
----------------------------------
-CONVERSATION HISTORY
----------------------------------
-{history_text if history_text else "None"}
-
----------------------------------
-CUSTOMER DETAILS
----------------------------------
-Name: {customer['name']}
-Email: {customer['email']}
-
----------------------------------
-LOAN DETAILS
----------------------------------
-Loan ID: {loan_info['loan_id']}
-EMI Due Date: {loan_info['emi_due_date']}
-EMI Amount: {loan_info['emi_amount']}
-EMI Status: {loan_info['emi_status']}
-Last Payment Date: {loan_info['last_payment_date']}
-
----------------------------------
-FEE DETAILS
----------------------------------
-{fee_text}
-
----------------------------------
-DETECTED INTENTS
----------------------------------
-{", ".join(intents)}
-
----------------------------------
-CUSTOMER MESSAGE
----------------------------------
-\"\"\"{user_message}\"\"\"
-
-
----------------------------------
-REPLY INSTRUCTIONS
----------------------------------
-- Answer in banking tone.
-- Address every detected intent clearly.
-- Use bullet points if multiple intents.
-- Do NOT invent any data.
-- Maintain conversation continuity using history.
-- Keep reply concise.
-- End with:
-
-Regards,
-Bank Support Team
-
-Return ONLY the email body.
-"""
-
-    return prompt
+def build_prompt(customer, loans, user_message, intents, history):
+    """Compact (system, user) prompt within the input-token budget."""
+    return prompt_builder.build(customer, loans, user_message, intents, history)
 
 
 # -----------------------------------------------------------
 # CALL BEDROCK
 # -----------------------------------------------------------
 
-def call_bedrock(prompt):
-    try:
-        response = bedrock.invoke_model(
-            modelId="anthropic.claude-3-haiku-20240307-v1:0",
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 450,
-                "temperature": 0,
-                "messages": [{"role": "user", "content": prompt}]
-            })
-        )
+def call_bedrock(prompt, system=None):
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 450,
+        "temperature": 0,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    if system:
+        body["system"] = system
 
-        out = json.loads(response["body"].read())
+    try:
+        with bedrock_seconds.time():
+            out = (hedged_invoker or bedrock_invoker).invoke(MODEL_ID, body)
+        usage = out.get("usage") or {}
+        bedrock_tokens.inc(usage.get("input_tokens", 0), direction="input")
+        bedrock_tokens.inc(usage.get("output_tokens", 0), direction="output")
         return out["content"][0]["text"]
 
     except Exception as e:
+        # no apology reply: the message is left unanswered and its UID is
+        # fetched again (IncrementalFetcher retry path)
         logging.error(f"BEDROCK ERROR: {e}")
-        return (
-            "We are unable to process your request at the moment.\n\n"
-            "Regards,\nBank Support Team"
-        )
+        raise
 
 
 # -----------------------------------------------------------
 # MAIN ENTRY POINT
 # -----------------------------------------------------------
 
-def generate_reply(from_email, user_message, customers, fees, loans):
-    logging.info(f"Processing email from {from_email}")
+def lookup_customer(from_email, customer_index, loan_store):
+    """
+    Resolve sender → customer → loans.
 
+    Returns (customer, loans, None) on success, or
+    (customer_or_None, None, fallback_reply) when no reply generation
+    is possible.
+    """
     # 1️⃣ Customer lookup
-    customer = find_customer_by_email(from_email, customers)
+    customer = find_customer_by_email(from_email, customer_index)
     if not customer:
-        return (
+        return None, None, (
             "Your email ID is not registered with our bank. "
             "Please contact support to update your records.\n\nRegards,\nBank Support Team"
         )
 
     # 2️⃣ Loan details
-    loan_info = find_loan_details(customer["customer_id"], fees, loans)
-    if not loan_info:
-        return (
+    loans = find_loan_details(customer["customer_id"], loan_store)
+    if not loans:
+        return customer, None, (
             f"Dear {customer['name']},\n\n"
             "We could not find any active loan linked to your account.\n\n"
             "Regards,\nBank Support Team"
         )
 
-    # 3️⃣ Intent detection
-    intents = detect_intents(user_message)
+    return customer, loans, None
 
-    # 4️⃣ Conversation history
+
+def compose_reply(from_email, user_message, customer, loans, intents=None):
+    """Build the prompt for a known customer and get the model reply."""
+    # 3️⃣ Intent detection (skipped when the caller already classified)
+    if intents is None:
+        intents = detect_intents(user_message)
+
+    # 4️⃣ Template fast path (structured intents only)
+    reply = fast_path.render(customer, loans, user_message, intents)
+    source = "template" if reply is not None else None
+
+    # 5️⃣ Conversation history
     history = get_history(from_email)
 
-    # 5️⃣ Build prompt
-    prompt = build_prompt(customer, loan_info, user_message, intents, history)
+    cache_key = None
+    if reply is None and cacheable(intents):
+        # Reply cache (temperature 0: same question + same loan data → same reply)
+        cache_key, data_hash = reply_cache.make_key(customer, user_message, intents, loans)
+        reply = reply_cache.get(cache_key)
+        source = source or ("cache" if reply is not None else None)
+
+    if reply is None:
+        # 6️⃣ Build prompt + get LLM reply
+        prompt = build_prompt(customer, loans, user_message, intents, history)
+        logging.info(
+            f"Prompt for {from_email}: ~{prompt.est_tokens} input tokens "
+            f"(history {prompt.history_used} kept / {prompt.history_dropped} dropped)"
+        )
+        reply = call_bedrock(prompt.user, system=prompt.system)
+        if cache_key:
+            reply_cache.put(cache_key, reply, customer["customer_id"], data_hash)
+        source = "bedrock"
 
-    # 6️⃣ Get LLM reply
-    reply = call_bedrock(prompt)
+    replies_total.inc(source=source)
 
     # 7️⃣ Update memory
     add_to_history(from_email, "user", user_message)
     add_to_history(from_email, "assistant", reply)
 
-    return reply
\ No newline at end of file
+    return reply
+
+
+def generate_reply(from_email, user_message, customer_index, loan_store):
+    logging.info(f"Processing email from {from_email}")
+
+    customer, loans, fallback = lookup_customer(from_email, customer_index, loan_store)
+    if fallback:
+        return fallback
+
+    return compose_reply(from_email, user_message, customer, loans)
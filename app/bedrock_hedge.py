@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app.bedrock_invoker import BedrockUnavailable
+from app.metrics import metrics
+
+# Hedge once the primary is slower than this percentile of recent calls
+HEDGE_PERCENTILE = 0.95
+HEDGE_WINDOW = 200            # recent primary latencies kept
+HEDGE_MIN_SAMPLES = 20        # until then, hedge after `initial_hedge_after`
+HEDGE_FLOOR = 0.25            # never hedge earlier than this (seconds)
+
+# Circuit breaker on the primary route
+BREAKER_WINDOW = 50           # recent primary outcomes kept
+BREAKER_MIN_CALLS = 10
+BREAKER_ERROR_RATE = 0.5
+BREAKER_COOLDOWN = 30.0
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+hedged_calls = metrics.counter("bedrock_hedged_total", "Hedged Bedrock calls, by winning route")
+route_calls = metrics.counter("bedrock_route_calls_total", "Bedrock calls started, by route")
+breaker_transitions = metrics.counter("bedrock_breaker_transitions_total", "Circuit breaker state changes")
+
+
+# -----------------------------------------------------------
+# CIRCUIT BREAKER
+# -----------------------------------------------------------
+
+class CircuitBreaker:
+    """
+    Error-rate breaker over the last `window` outcomes.
+
+    CLOSED → OPEN when the error rate reaches `error_rate` (with at least
+    `min_calls` outcomes); after `cooldown` one probe call is let through
+    (HALF_OPEN) and its result closes or re-opens the breaker.
+    """
+
+    def __init__(self, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, cooldown=BREAKER_COOLDOWN):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.opens = 0
+        self._outcomes = deque(maxlen=window)
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set(self, state):
+        if state != self.state:
+            logging.warning(f"Bedrock circuit breaker {self.state} → {state}")
+            breaker_transitions.inc(to=state)
+            self.state = state
+
+    def allow(self):
+        """True if the primary route may be called now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self._set(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok):
+        """ok: outcome of a primary call; None = no verdict (the request was bad)."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if ok is None:
+                    return   # the next allow() sends another probe
+                self._outcomes.clear()
+                if ok:
+                    self._set(CLOSED)
+                else:
+                    self._open()
+                return
+
+            if ok is None:
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if (
+                self.state == CLOSED
+                and len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.error_rate
+            ):
+                self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self.opens += 1
+        self._set(OPEN)
+
+    def stats(self):
+        with self._lock:
+            n = len(self._outcomes)
+            return {
+                "state": self.state,
+                "opens": self.opens,
+                "error_rate": round(self._outcomes.count(False) / n, 3) if n else 0.0,
+            }
+
+
+# -----------------------------------------------------------
+# HEDGED INVOKER
+# -----------------------------------------------------------
+
+def is_route_failure(exc):
+    """Throttling, 5xx or timeout; a rejected request (validation, access) is not."""
+    return not isinstance(exc, BedrockUnavailable) or exc.route_failure
+
+
+class HedgedInvoker:
+    """
+    Primary / fallback Bedrock routing for tail latency.
+
+    Both routes are BedrockInvokers (each with its own quota), e.g. the
+    same model in another region or a different model. A call goes to
+    the primary; if it has not answered by the hedge deadline (the
+    `percentile` of recent primary latencies) the same request is sent
+    to the fallback and whichever succeeds first wins. A primary error
+    also falls through to the fallback, unless the request itself was
+    rejected (validation, access denied): that error is raised as-is and
+    doesn't count against the breaker. While the circuit breaker is
+    open, calls go straight to the fallback.
+
+    Each route has its own thread pool, so primary calls hung until
+    their deadline can't hold up the fallback. The losing request is
+    not cancelled (boto3 can't), its result is dropped but its latency
+    still feeds the percentile.
+    """
+
+    def __init__(self, primary, fallback, fallback_model=None, percentile=HEDGE_PERCENTILE,
+                 initial_hedge_after=5.0, breaker=None, window=HEDGE_WINDOW, max_workers=16):
+        self.primary = primary
+        self.fallback = fallback
+        self.fallback_model = fallback_model
+        self.percentile = percentile
+        self.initial_hedge_after = initial_hedge_after
+        self.breaker = breaker or CircuitBreaker()
+
+        self._latencies = deque(maxlen=window)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bedrock-primary")
+        self._fallback_executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="bedrock-fallback"
+        )
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0, "hedged": 0, "fallback_wins": 0, "breaker_fallbacks": 0, "rejected": 0,
+            "failed": 0,
+        }
+
+    # -------------------------------------------------------
+    # Hedge deadline
+    # -------------------------------------------------------
+
+    def hedge_after(self):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return self.initial_hedge_after
+        rank = min(len(samples) - 1, int(self.percentile * len(samples)))
+        return max(HEDGE_FLOOR, samples[rank])
+
+    # -------------------------------------------------------
+    # Routes
+    # -------------------------------------------------------
+
+    def _call_primary(self, model_id, body, deadline):
+        route_calls.inc(route="primary")
+        started = time.monotonic()
+        try:
+            out = self.primary.invoke(model_id, body, deadline=deadline)
+        except Exception as e:
+            self.breaker.record(False if is_route_failure(e) else None)
+            raise
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+        self.breaker.record(True)
+        return out
+
+    def _call_fallback(self, model_id, body, deadline):
+        route_calls.inc(route="fallback")
+        return self.fallback.invoke(self.fallback_model or model_id, body, deadline=deadline)
+
+    # -------------------------------------------------------
+    # Invoke
+    # -------------------------------------------------------
+
+    def invoke(self, model_id, body, deadline=None):
+        """Same contract as BedrockInvoker.invoke: decoded JSON or BedrockUnavailable."""
+        with self._lock:
+            self._stats["calls"] += 1
+
+        if not self.breaker.allow():
+            with self._lock:
+                self._stats["breaker_fallbacks"] += 1
+            return self._call_fallback(model_id, body, deadline)
+
+        primary = self._executor.submit(self._call_primary, model_id, body, deadline)
+        done, _ = wait([primary], timeout=self.hedge_after())
+        if done:
+            if not primary.exception():
+                return primary.result()
+            self._check_rejected(primary.exception())
+
+        # slow or failed primary: race the fallback against it
+        with self._lock:
+            self._stats["hedged"] += 1
+        fallback = self._fallback_executor.submit(self._call_fallback, model_id, body, deadline)
+        pending = {primary, fallback}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception():
+                    last_error = future.exception()
+                    if future is primary:
+                        self._check_rejected(last_error)
+                    continue
+                winner = "primary" if future is primary else "fallback"
+                hedged_calls.inc(winner=winner)
+                if winner == "fallback":
+                    with self._lock:
+                        self._stats["fallback_wins"] += 1
+                return future.result()
+
+        with self._lock:
+            self._stats["failed"] += 1
+        raise BedrockUnavailable(
+            f"Both Bedrock routes failed: {last_error}", code=getattr(last_error, "code", None)
+        )
+
+    def _check_rejected(self, error):
+        """A request the primary rejected is re-raised as-is, without hedging."""
+        if not is_route_failure(error):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise error
+
+    # -------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        out["hedge_after_seconds"] = round(self.hedge_after(), 3)
+        out["breaker"] = self.breaker.stats()
+        return out
@@ -0,0 +1,282 @@
+import json
+import logging
+import random
+import threading
+import time
+
+# Error codes that mean "slow down", not "this request is bad"
+THROTTLE_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+}
+# Transient server-side errors that are also worth retrying
+RETRYABLE_CODES = THROTTLE_CODES | {
+    "ModelNotReadyException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelTimeoutException",
+}
+# Failures that say a route is unhealthy rather than the request bad:
+# throttling, 5xx and timeouts (botocore raises those without a response)
+ROUTE_FAILURE_CODES = RETRYABLE_CODES | {
+    "ReadTimeoutError",
+    "ConnectTimeoutError",
+    "EndpointConnectionError",
+    "ConnectionClosedError",
+}
+
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+
+# Rough chars-per-token ratio for budgeting before we know real usage
+CHARS_PER_TOKEN = 4
+
+
+class BedrockUnavailable(Exception):
+    """
+    Raised when no successful invocation fits inside the deadline.
+    code is the error code of the last attempt (None if none was made).
+    """
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+    @property
+    def route_failure(self):
+        """True for throttling / 5xx / timeouts, False if the request itself was rejected."""
+        return self.code is None or self.code in ROUTE_FAILURE_CODES
+
+
+def error_code(exc):
+    """Best-effort AWS error code from a botocore ClientError (or stub)."""
+    # connection / read timeouts carry no response (or response=None)
+    code = (getattr(exc, "response", None) or {}).get("Error", {}).get("Code")
+    return code or type(exc).__name__
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+# -----------------------------------------------------------
+# TOKEN BUCKET (requests / tokens per minute)
+# -----------------------------------------------------------
+
+class TokenBucket:
+    """Refills per_minute units evenly over each minute."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, amount, deadline):
+        """Wait until amount is available; False if that would pass deadline."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return True
+                wait = (amount - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(min(wait, 1.0))
+
+    def adjust(self, delta):
+        """Charge (or refund) the difference between estimated and real usage."""
+        with self._lock:
+            self.tokens -= delta
+
+
+# -----------------------------------------------------------
+# AIMD CONCURRENCY LIMITER
+# -----------------------------------------------------------
+
+class AimdLimiter:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit.
+    Each success grows the limit by 1/limit; each throttle halves it.
+    """
+
+    def __init__(self, initial, min_limit=1, max_limit=32):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, deadline):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+# -----------------------------------------------------------
+# INVOKER
+# -----------------------------------------------------------
+
+class BedrockInvoker:
+    """
+    Throttle-aware wrapper around bedrock-runtime invoke_model.
+
+    - requests-per-minute and tokens-per-minute budgets (token buckets)
+    - AIMD concurrency that backs off on ThrottlingException
+    - retries with full jitter, all inside one per-call deadline
+    - queue depth / wait time / throttle counters via stats()
+
+    The client only needs invoke_model(**kwargs), so a local stub
+    that raises throttling errors can stand in for Bedrock.
+    """
+
+    def __init__(self, client, rpm=60, tpm=100_000, max_concurrency=8,
+                 deadline=60.0, max_attempts=6):
+        self.client = client
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.limiter = AimdLimiter(initial=max_concurrency, max_limit=max_concurrency)
+
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._stats = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "throttled": 0,
+            "retries": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    # -------------------------------------------------------
+    # Admission
+    # -------------------------------------------------------
+
+    def _admit(self, est_tokens, deadline):
+        started = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            ok = (
+                self.requests.take(1, deadline)
+                and self.tokens.take(est_tokens, deadline)
+                and self.limiter.acquire(deadline)
+            )
+        finally:
+            waited = time.monotonic() - started
+            with self._lock:
+                self._waiting -= 1
+                self._stats["wait_seconds_total"] += waited
+                self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+        return ok
+
+    # -------------------------------------------------------
+    # Invoke
+    # -------------------------------------------------------
+
+    def invoke(self, model_id, body, deadline=None):
+        """
+        Call invoke_model and return the decoded JSON response.
+        Raises BedrockUnavailable once the deadline or attempts run out.
+        """
+        deadline = time.monotonic() + (deadline or self.deadline)
+        payload = json.dumps(body)
+        est_tokens = estimate_tokens(payload) + body.get("max_tokens", 0)
+
+        with self._lock:
+            self._stats["calls"] += 1
+
+        last_error = None
+        for attempt in range(self.max_attempts):
+            if not self._admit(est_tokens, deadline):
+                break
+
+            throttled = False
+            try:
+                response = self.client.invoke_model(
+                    modelId=model_id,
+                    contentType="application/json",
+                    accept="application/json",
+                    body=payload,
+                )
+                out = json.loads(response["body"].read())
+                self._charge_actual(out, est_tokens)
+                with self._lock:
+                    self._stats["succeeded"] += 1
+                return out
+
+            except Exception as e:
+                last_error = e
+                code = error_code(e)
+                throttled = code in THROTTLE_CODES
+                if throttled:
+                    with self._lock:
+                        self._stats["throttled"] += 1
+                if code not in RETRYABLE_CODES:
+                    break
+
+            finally:
+                self.limiter.release(throttled=throttled)
+
+            # full jitter, never past the deadline
+            sleep = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            if time.monotonic() + sleep >= deadline:
+                break
+            with self._lock:
+                self._stats["retries"] += 1
+            logging.warning(f"Bedrock {error_code(last_error)}; retry {attempt + 1} in {sleep:.2f}s")
+            time.sleep(sleep)
+
+        with self._lock:
+            self._stats["failed"] += 1
+        raise BedrockUnavailable(
+            f"Bedrock invocation failed: {last_error or 'deadline exceeded'}",
+            code=error_code(last_error) if last_error else None,
+        ) from last_error
+
+    def _charge_actual(self, out, est_tokens):
+        usage = out.get("usage") or {}
+        actual = usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+        if actual:
+            self.tokens.adjust(actual - est_tokens)
+
+    # -------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out["queue_depth"] = self._waiting
+        out["in_flight"] = self.limiter.in_flight
+        out["concurrency_limit"] = round(self.limiter.limit, 2)
+        calls = out["calls"] or 1
+        out["wait_seconds_avg"] = round(out["wait_seconds_total"] / calls, 4)
+        return out
@@ -0,0 +1,194 @@
+import logging
+import sys
+import time
+
+import pandas as pd
+
+from app.email_utils import normalize_email
+
+# Optional sheet columns holding extra addresses for the same customer
+# (comma / semicolon separated).
+ALIAS_COLUMNS = ("alias_emails", "alt_email", "secondary_email")
+
+# Domains where dots in the local part are ignored by the provider.
+DOTLESS_DOMAINS = {"gmail.com", "googlemail.com"}
+
+# Providers known to deliver "user+tag@" to "user@". Elsewhere a "+" may
+# be part of a different mailbox, so it is kept.
+SUBADDRESS_DOMAINS = DOTLESS_DOMAINS | {
+    "outlook.com", "hotmail.com", "live.com", "msn.com",
+    "icloud.com", "me.com", "mac.com",
+    "fastmail.com", "protonmail.com", "proton.me",
+}
+
+
+# -----------------------------------------------------------
+# KEY HELPERS
+# -----------------------------------------------------------
+
+def canonical_email(clean_email):
+    """
+    Collapse provider aliases onto one mailbox:
+    - drop "+tag" sub-addressing on providers that support it
+    - drop dots in Gmail local parts
+    """
+    local, _, domain = clean_email.partition("@")
+    if domain in SUBADDRESS_DOMAINS:
+        local = local.split("+", 1)[0]
+
+    if domain in DOTLESS_DOMAINS:
+        local = local.replace(".", "")
+        domain = "gmail.com"
+
+    return f"{local}@{domain}"
+
+
+def _native(value):
+    """Convert numpy scalars to plain Python values (smaller, hashable)."""
+    if value is pd.NaT:   # missing date in a typed datetime column
+        return None
+    if hasattr(value, "item"):
+        try:
+            return value.item()
+        except (ValueError, AttributeError):
+            return value
+    return value
+
+
+# -----------------------------------------------------------
+# CUSTOMER INDEX
+# -----------------------------------------------------------
+
+class CustomerIndex:
+    """
+    Email → customer lookup built once from the customers sheet.
+
+    Records are stored as tuples sharing one column list; lookup()
+    materializes a dict so callers keep the row-dict interface.
+
+    Duplicate handling is deterministic:
+    - an exact (normalized) email always wins over an alias
+    - if several rows share a key, the first row in sheet order wins
+    - canonical aliases (+tag, Gmail dots) are only used when they
+      point to exactly one customer
+    """
+
+    def __init__(self, columns, records, exact, canonical, stats):
+        self._columns = columns
+        self._records = records
+        self._exact = exact
+        self._canonical = canonical
+        self._stats = stats
+
+    @classmethod
+    def from_dataframe(cls, customers_df):
+        started = time.perf_counter()
+
+        columns = tuple(customers_df.columns)
+        alias_cols = [c for c in ALIAS_COLUMNS if c in customers_df.columns]
+
+        records = []
+        exact = {}
+        alias_exact = {}
+        canonical = {}
+        duplicates = 0
+
+        for row in customers_df.itertuples(index=False, name=None):
+            record = tuple(_native(v) for v in row)
+            pos = len(records)
+            records.append(record)
+            row_map = dict(zip(columns, record))
+
+            primary = normalize_email(str(row_map.get("email", "")))
+            if primary:
+                if primary in exact:
+                    duplicates += 1
+                else:
+                    exact[primary] = pos
+
+            aliases = []
+            for col in alias_cols:
+                raw = row_map.get(col)
+                if raw is None or raw != raw:   # None / NaN
+                    continue
+                for part in str(raw).replace(";", ",").split(","):
+                    alias = normalize_email(part)
+                    if alias:
+                        aliases.append(alias)
+
+            for alias in aliases:
+                alias_exact.setdefault(alias, pos)
+
+            for addr in [primary, *aliases]:
+                if not addr:
+                    continue
+                canonical.setdefault(canonical_email(addr), set()).add(pos)
+
+        # Aliases never shadow another customer's primary address
+        for alias, pos in alias_exact.items():
+            exact.setdefault(alias, pos)
+
+        # Keep only unambiguous canonical keys
+        canonical = {k: next(iter(v)) for k, v in canonical.items() if len(v) == 1}
+
+        build_seconds = time.perf_counter() - started
+
+        stats = {
+            "rows": len(records),
+            "exact_keys": len(exact),
+            "canonical_keys": len(canonical),
+            "duplicate_emails": duplicates,
+            "build_seconds": round(build_seconds, 4),
+        }
+
+        index = cls(columns, records, exact, canonical, stats)
+        index._stats["approx_bytes"] = index._approx_bytes()
+
+        if duplicates:
+            logging.warning(
+                f"CustomerIndex: {duplicates} duplicate email(s) found; first row kept."
+            )
+        logging.info(f"CustomerIndex built: {index.stats()}")
+
+        return index
+
+    # -------------------------------------------------------
+    # Lookups
+    # -------------------------------------------------------
+
+    def lookup(self, raw_email):
+        """Return the customer row as a dict, or None."""
+        clean_email = normalize_email(raw_email)
+        if not clean_email:
+            return None
+
+        pos = self._exact.get(clean_email)
+        if pos is None:
+            pos = self._canonical.get(canonical_email(clean_email))
+        if pos is None:
+            return None
+
+        return dict(zip(self._columns, self._records[pos]))
+
+    def __len__(self):
+        return len(self._records)
+
+    # -------------------------------------------------------
+    # Stats
+    # -------------------------------------------------------
+
+    def _approx_bytes(self):
+        size = sys.getsizeof(self._records)
+        size += sys.getsizeof(self._exact) + sys.getsizeof(self._canonical)
+        for record in self._records:
+            size += sys.getsizeof(record)
+            size += sum(sys.getsizeof(v) for v in record)
+        for key in self._exact:
+            size += sys.getsizeof(key)
+        for key in self._canonical:
+            size += sys.getsizeof(key)
+        return size
+
+    def stats(self):
+        """Build time, key counts and approximate memory footprint."""
+        return dict(self._stats)
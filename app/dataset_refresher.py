@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+
+from app.customer_index import CustomerIndex
+from app.loan_store import LoanStore
+from app.metrics import metrics
+from app.s3_loader import DATASET_KEYS, SnapshotCache, default_source, load_datasets
+
+DEFAULT_INTERVAL = 300
+
+reload_seconds = metrics.histogram("dataset_reload_seconds", "Dataset snapshot reload time, load to swap")
+reload_failures = metrics.counter("dataset_reload_failures_total", "Dataset refreshes that failed")
+
+
+# -----------------------------------------------------------
+# IMMUTABLE SNAPSHOT
+# -----------------------------------------------------------
+
+@dataclass(frozen=True)
+class DatasetSnapshot:
+    """Everything derived from one set of dataset versions."""
+
+    customer_index: CustomerIndex
+    loan_store: LoanStore
+    etags: dict = field(default_factory=dict)
+    version: int = 0
+    loaded_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def build(cls, frames, etags, version):
+        return cls(
+            customer_index=CustomerIndex.from_dataframe(frames["customers"]),
+            loan_store=LoanStore.from_dataframes(frames["loans"], frames["fees"]),
+            etags=dict(etags),
+            version=version,
+        )
+
+
+# -----------------------------------------------------------
+# BACKGROUND REFRESHER
+# -----------------------------------------------------------
+
+class DatasetRefresher:
+    """
+    Polls dataset ETags and hot-swaps a freshly built snapshot.
+
+    Readers call .current once per message and keep that object, so an
+    in-flight message sees one consistent customer/loan view even if a
+    reload lands mid-way. The swap is a single attribute assignment.
+
+    build(frames, etags, version) turns loaded frames into the published
+    object (a DatasetSnapshot by default).
+    """
+
+    def __init__(self, source=None, cache=None, interval=DEFAULT_INTERVAL, build=None):
+        self.source = source or default_source()
+        self.cache = cache or SnapshotCache()
+        self.interval = interval
+        self.build = build or DatasetSnapshot.build
+
+        self._current = None
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._reload_lock = threading.Lock()
+
+        self.reloads = 0
+        self.failures = 0
+        self.last_reload_seconds = None
+        self.last_check_at = None
+
+    @property
+    def current(self):
+        return self._current
+
+    def add_listener(self, fn):
+        """fn(old_snapshot, new_snapshot) runs after every swap."""
+        self._listeners.append(fn)
+
+    # -------------------------------------------------------
+    # Loading
+    # -------------------------------------------------------
+
+    def load_initial(self):
+        self._reload()
+        return self._current
+
+    def _reload(self):
+        with self._reload_lock:
+            started = time.perf_counter()
+            frames, etags = load_datasets(self.source, self.cache)
+            version = self._current.version + 1 if self._current else 1
+            snapshot = self.build(frames, etags, version)
+            del frames
+
+            old, self._current = self._current, snapshot
+            elapsed = time.perf_counter() - started
+            self.last_reload_seconds = round(elapsed, 3)
+            reload_seconds.observe(elapsed)
+            self.reloads += 1
+
+        logging.info(
+            f"Dataset snapshot v{snapshot.version} live "
+            f"(reload {self.last_reload_seconds}s, etags={snapshot.etags})"
+        )
+        if old is not None:
+            for fn in self._listeners:
+                try:
+                    fn(old, snapshot)
+                except Exception as e:
+                    logging.error(f"Snapshot listener error: {e}")
+
+    def refresh_now(self):
+        """Reload if any dataset ETag changed. Returns True on swap."""
+        self.last_check_at = time.time()
+        current = self._current
+        try:
+            etags = {name: self.source.head(key) for name, key in DATASET_KEYS.items()}
+            if current is not None and etags == current.etags:
+                return False
+            self._reload()
+            return True
+        except Exception as e:
+            self.failures += 1
+            reload_failures.inc()
+            logging.error(f"DATASET REFRESH ERROR: {e}")
+            return False
+
+    # -------------------------------------------------------
+    # Background thread
+    # -------------------------------------------------------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="dataset-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.refresh_now()
+
+    # -------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------
+
+    def stats(self):
+        current = self._current
+        return {
+            "version": current.version if current else 0,
+            "snapshot_age_seconds": round(time.time() - current.loaded_at, 1) if current else None,
+            "last_reload_seconds": self.last_reload_seconds,
+            "reloads": self.reloads,
+            "failures": self.failures,
+        }
@@ -1,52 +1,252 @@
-import email
-from bs4 import BeautifulSoup
+import html
+import os
+import re
+import threading
+import time
 
-def extract_email_body(msg):
+NO_BODY = "No message body."
+
+# Longest body handed to the pipeline (characters, after cleaning)
+MAX_BODY_CHARS = 4000
+
+# -----------------------------------------------------------
+# PATTERNS
+# -----------------------------------------------------------
+
+# HTML: everything after these markers is the quoted thread
+_HTML_QUOTE_START = re.compile(
+    r'<div[^>]+class="?gmail_quote|<div[^>]+id="?(?:appendonsend|divRplyFwdMsg)|'
+    r'<hr[^>]+id="?stopSpelling|<div[^>]+class="?moz-cite-prefix',
+    re.I,
+)
+_HTML_DROP = re.compile(r"<(script|style|head|title|blockquote)\b.*?</\1\s*>", re.I | re.S)
+_HTML_COMMENT = re.compile(r"<!--.*?-->", re.S)
+_HTML_BREAK = re.compile(r"<(?:br|/p|/div|/li|/tr|/h[1-6]|hr)\b[^>]*>", re.I)
+_HTML_TAG = re.compile(r"<[^>]+>")
+
+# Plain text: first line of a quoted reply / forwarded block
+_QUOTE_HEADERS = re.compile(
+    r"^[ \t]*(?:"
+    r"On\b[^\n]{0,200}(?:\n[^\n]{0,200}){0,2}?\bwrote:[ \t]*$"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|-{2,}\s*Forwarded message\s*-{2,}"
+    r"|_{10,}[ \t]*$"
+    r"|From:[^\n]*\n(?:[^\n]*\n)?[ \t]*(?:Sent|Date):"
+    r")",
+    re.I | re.M,
+)
+_QUOTED_LINE = re.compile(r"^[ \t]*>.*\n?", re.M)
+
+# Signatures and legal footers
+_SIGNATURE = re.compile(
+    r"^(?:-- ?$|Sent from my \w+|Get Outlook for \w+)", re.I | re.M
+)
+_SIGN_OFF = re.compile(
+    r"^[ \t]*(?:(?:best |kind |warm )?regards|thanks(?: and regards)?|thank you|"
+    r"sincerely|cheers)[ \t]*,?[ \t]*$",
+    re.I | re.M,
+)
+SIGN_OFF_MAX_LINES = 6
+SIGN_OFF_MAX_LINE_CHARS = 60
+_DISCLAIMER = re.compile(
+    r"^[ \t]*(?:disclaimer\b|confidentiality notice|this (?:e-?mail|message)"
+    r"(?: and any (?:files|attachments))?[^\n]{0,40}\b(?:confidential|intended (?:solely|only))"
+    r")",
+    re.I | re.M,
+)
+
+_BLANK_LINES = re.compile(r"\n[ \t]*\n(?:[ \t]*\n)+")
+_SPACES = re.compile(r"[ \t\xa0]+")
+
+
+# -----------------------------------------------------------
+# ADDRESSES
+# -----------------------------------------------------------
+
+def normalize_email(raw_email):
+    """Extract and clean email (Gmail format safe)."""
+    if not raw_email:
+        return None
+
+    # Extract <email> if present
+    match = re.search(r"<(.+?)>", raw_email)
+    email_clean = match.group(1) if match else raw_email
+
+    # Trim + lowercase
+    email_clean = email_clean.strip().lower()
+
+    return email_clean if "@" in email_clean else None
+
+
+# -----------------------------------------------------------
+# DECODING
+# -----------------------------------------------------------
+
+def decode_part(part):
+    """Decoded payload text using the declared charset; None if empty."""
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return None
+    charset = part.get_content_charset() or "utf-8"
+    try:
+        return payload.decode(charset, errors="replace")
+    except LookupError:   # unknown charset name
+        return payload.decode("utf-8", errors="replace")
+
+
+def html_to_text(markup):
+    """Cheap HTML → text: drop quoted thread, scripts and tags, keep line breaks."""
+    match = _HTML_QUOTE_START.search(markup)
+    if match:
+        markup = markup[:match.start()]
+    markup = _HTML_COMMENT.sub("", markup)
+    markup = _HTML_DROP.sub("", markup)
+    markup = _HTML_BREAK.sub("\n", markup)
+    markup = _HTML_TAG.sub("", markup)
+    return html.unescape(markup)
+
+
+def _pick_part(msg):
+    """(text, is_html) from the first inline text/plain, else text/html."""
+    if not msg.is_multipart():
+        text = decode_part(msg)
+        return text, msg.get_content_subtype() == "html"
+
+    html_part = None
+    for part in msg.walk():
+        if part.is_multipart() or "attachment" in str(part.get("Content-Disposition")):
+            continue
+        ctype = part.get_content_type()
+        if ctype == "text/plain":
+            text = decode_part(part)
+            if text and text.strip():
+                return text, False
+        elif ctype == "text/html" and html_part is None:
+            html_part = part
+
+    if html_part is not None:
+        return decode_part(html_part), True
+    return None, False
+
+
+# -----------------------------------------------------------
+# CLEANING
+# -----------------------------------------------------------
+
+def strip_quoted(text):
+    """Drop the quoted thread below the reply and inline '>' lines."""
+    match = _QUOTE_HEADERS.search(text)
+    if match:
+        text = text[:match.start()]
+    return _QUOTED_LINE.sub("", text)
+
+
+def strip_signature(text):
+    """Drop '-- ' signatures, mobile footers, legal disclaimers and a short sign-off block."""
+    for pattern in (_DISCLAIMER, _SIGNATURE):
+        match = pattern.search(text)
+        if match:
+            text = text[:match.start()]
+
+    # "Regards,\nName\nTitle" at the very end — only below the message
+    # and when what follows looks like a name block, not more questions
+    for match in reversed(list(_SIGN_OFF.finditer(text))):
+        if text[:match.start()].strip() and _is_name_block(text[match.end():]):
+            text = text[:match.start()]
+        break
+    return text
+
+
+def _is_prose(line):
+    """A question or sentence, as opposed to a name / title / phone line."""
+    words = len(line.split())
+    return "?" in line or words >= 8 or (words >= 3 and line[-1] in ".!")
+
+
+def _is_name_block(tail):
+    lines = [line.strip() for line in tail.strip().split("\n") if line.strip()]
+    return len(lines) < SIGN_OFF_MAX_LINES and all(
+        len(line) <= SIGN_OFF_MAX_LINE_CHARS and not _is_prose(line) for line in lines
+    )
+
+
+def _tidy(text):
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = _SPACES.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+# -----------------------------------------------------------
+# EXTRACTOR
+# -----------------------------------------------------------
+
+class BodyExtractor:
     """
-    Extracts the email body safely.
-    Returns plain text or 'no body' if nothing found.
+    Single body extraction path for incoming mail.
+
+    Prefers text/plain, falls back to HTML, then strips quoted history,
+    signatures and disclaimers and caps the length, so a reply deep in a
+    thread only sends the customer's new text to the model.
     """
 
-    body = None
-
-    # ---- 1. If multipart, find text/plain ----
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            content_disposition = str(part.get("Content-Disposition"))
-
-            # skip attachments
-            if "attachment" in content_disposition:
-                continue
-
-            # use text/plain if available
-            if content_type == "text/plain":
-                try:
-                    body = part.get_payload(decode=True).decode(errors="ignore")
-                except:
-                    body = None
-                break
-
-        # ---- 2. If no text/plain, fallback to HTML ----
-        if body is None:
-            for part in msg.walk():
-                if part.get_content_type() == "text/html":
-                    try:
-                        html = part.get_payload(decode=True).decode(errors="ignore")
-                        body = BeautifulSoup(html, "html.parser").get_text(separator=" ", strip=True)
-                    except:
-                        body = None
-                    break
-
-    else:
-        # ---- 3. Not multipart: decode directly ----
+    def __init__(self, max_chars=MAX_BODY_CHARS):
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._stats = {
+            "messages": 0,
+            "html": 0,
+            "empty": 0,
+            "truncated": 0,
+            "raw_bytes": 0,
+            "clean_bytes": 0,
+            "seconds_total": 0.0,
+        }
+
+    def extract(self, msg):
+        started = time.perf_counter()
         try:
-            body = msg.get_payload(decode=True).decode(errors="ignore")
-        except:
-            body = None
+            raw, is_html = _pick_part(msg)
+        except Exception:
+            raw, is_html = None, False
+
+        text = raw or ""
+        if is_html:
+            text = html_to_text(text)
+        text = _tidy(strip_signature(strip_quoted(_tidy(text))))
+
+        # a reply that is *only* quote/signature: keep the tidied original
+        if not text and raw:
+            text = _tidy(html_to_text(raw) if is_html else raw)
+
+        truncated = len(text) > self.max_chars
+        if truncated:
+            text = text[:self.max_chars].rstrip() + " …"
 
-    # ---- 4. Final fallback ----
-    if not body or body.strip() == "":
-        return "no body"
+        with self._lock:
+            s = self._stats
+            s["messages"] += 1
+            s["html"] += int(is_html)
+            s["empty"] += int(not text)
+            s["truncated"] += int(truncated)
+            s["raw_bytes"] += len((raw or "").encode())
+            s["clean_bytes"] += len(text.encode())
+            s["seconds_total"] += time.perf_counter() - started
 
-    return body.strip()
+        return text or NO_BODY
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        out["bytes_saved"] = out["raw_bytes"] - out["clean_bytes"]
+        out["saved_ratio"] = round(out["bytes_saved"] / out["raw_bytes"], 3) if out["raw_bytes"] else 0.0
+        out["avg_ms"] = round(out.pop("seconds_total") * 1000 / (out["messages"] or 1), 3)
+        return out
+
+
+body_extractor = BodyExtractor(max_chars=int(os.getenv("MAX_BODY_CHARS", MAX_BODY_CHARS)))
+
+
+def extract_email_body(msg):
+    """Clean body text of an email.message.Message."""
+    return body_extractor.extract(msg)
@@ -1,10 +1,31 @@
 import requests
 import logging
 import json
+import os
+import threading
+import time
+from requests.adapters import HTTPAdapter
 
-GLPI_API_URL = "http://40.192.14.7/glpi/apirest.php/"
-APP_TOKEN = "TyeRo8qYIYCF7hCrWYP9exCiyx1SSyyH07vcXop1"
-USER_TOKEN = "RYMmbRwOPtH8aYHyITlLtshjk0PL8i7Hv94GRvkg"
+from app.metrics import metrics
+
+GLPI_API_URL = os.getenv("GLPI_API_URL", "http://40.192.14.7/glpi/apirest.php/")
+APP_TOKEN = os.getenv("GLPI_APP_TOKEN", "TyeRo8qYIYCF7hCrWYP9exCiyx1SSyyH07vcXop1")
+USER_TOKEN = os.getenv("GLPI_USER_TOKEN", "RYMmbRwOPtH8aYHyITlLtshjk0PL8i7Hv94GRvkg")
+
+# (connect, read) timeouts in seconds
+GLPI_TIMEOUT = (
+    float(os.getenv("GLPI_CONNECT_TIMEOUT", 5)),
+    float(os.getenv("GLPI_READ_TIMEOUT", 30)),
+)
+# Refresh the session token before GLPI's own inactivity timeout kicks in
+SESSION_MAX_AGE = int(os.getenv("GLPI_SESSION_MAX_AGE", 1800))
+POOL_SIZE = int(os.getenv("GLPI_POOL_SIZE", 10))
+
+# GLPI search option ids for Ticket columns
+SEARCH_FIELDS = {"id": 2, "name": 1, "status": 12, "date_mod": 19}
+
+glpi_seconds = metrics.histogram("glpi_request_seconds", "GLPI REST call latency")
+glpi_errors = metrics.counter("glpi_errors_total", "Failed GLPI REST calls, by status")
 
 # ---------------------------------------------------
 # Ticket Logger (writes to logs/ticket.log)
@@ -17,138 +38,258 @@ ticket_logger.setLevel(logging.INFO)
 
 
 # ---------------------------------------------------
-# 1. START GLPI SESSION
+# GLPI CLIENT
 # ---------------------------------------------------
-def glpi_start_session():
-    try:
-        headers = {
-            "App-Token": APP_TOKEN,
-            "Authorization": f"user_token {USER_TOKEN}",
-        }
+class GlpiClient:
+    """
+    GLPI REST client with a pooled HTTP session and a cached session token.
 
-        resp = requests.get(GLPI_API_URL + "initSession", headers=headers)
+    - one keep-alive connection pool shared by all calls
+    - initSession runs once; the token is refreshed only on 401 or
+      after SESSION_MAX_AGE seconds
+    - every request has a (connect, read) timeout
+    - thread-safe, so asyncio code can call it via run_in_executor /
+      asyncio.to_thread
+    """
 
-        if resp.status_code != 200:
-            ticket_logger.error(f"GLPI initSession failed: {resp.text}")
-            return None
+    def __init__(self, api_url=GLPI_API_URL, app_token=APP_TOKEN, user_token=USER_TOKEN,
+                 timeout=GLPI_TIMEOUT, pool_size=POOL_SIZE, session_max_age=SESSION_MAX_AGE):
+        self.api_url = api_url
+        self.app_token = app_token
+        self.user_token = user_token
+        self.timeout = timeout
+        self.session_max_age = session_max_age
 
-        session_token = resp.json().get("session_token")
-        ticket_logger.info("GLPI session started successfully.")
-        return session_token
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._http.mount("http://", adapter)
+        self._http.mount("https://", adapter)
 
-    except Exception as e:
-        ticket_logger.error(f"GLPI Session Error: {e}")
-        return None
+        self._token = None
+        self._token_at = 0.0
+        self._token_lock = threading.Lock()
 
+    # -----------------------------------------------
+    # Session token
+    # -----------------------------------------------
+    def start_session(self, force=False):
+        """Return a valid session token, calling initSession only when needed."""
+        with self._token_lock:
+            fresh = time.monotonic() - self._token_at < self.session_max_age
+            if self._token and fresh and not force:
+                return self._token
 
-# ---------------------------------------------------
-# 2. CREATE TICKET
-# ---------------------------------------------------
-def glpi_create_ticket(session_token, title, description):
-    try:
-        headers = {
-            "App-Token": APP_TOKEN,
-            "Session-Token": session_token,
-            "Content-Type": "application/json",
-        }
+            try:
+                headers = {
+                    "App-Token": self.app_token,
+                    "Authorization": f"user_token {self.user_token}",
+                }
+
+                resp = self._http.get(
+                    self.api_url + "initSession", headers=headers, timeout=self.timeout
+                )
 
-        payload = {
-            "input": {
-                "name": title,
-                "content": description,
-                "status": 1,           # 1 = New / Open
-                "requesttypes_id": 2,  # Email request
+                if resp.status_code != 200:
+                    ticket_logger.error(f"GLPI initSession failed: {resp.text}")
+                    self._token = None
+                    return None
+
+                self._token = resp.json().get("session_token")
+                self._token_at = time.monotonic()
+                ticket_logger.info("GLPI session started successfully.")
+                return self._token
+
+            except Exception as e:
+                ticket_logger.error(f"GLPI Session Error: {e}")
+                self._token = None
+                return None
+
+    def kill_session(self):
+        with self._token_lock:
+            if not self._token:
+                return
+            try:
+                self._http.get(
+                    self.api_url + "killSession",
+                    headers={"App-Token": self.app_token, "Session-Token": self._token},
+                    timeout=self.timeout,
+                )
+            except Exception:
+                pass
+            self._token = None
+
+    def _request(self, method, path, payload=None, params=None, headers=None):
+        """
+        Send an authenticated request; on 401 refresh the token and retry once.
+        Returns the response, or None if no session could be started.
+        """
+        for attempt in range(2):
+            token = self.start_session(force=attempt > 0)
+            if not token:
+                return None
+
+            all_headers = {
+                "App-Token": self.app_token,
+                "Session-Token": token,
+                "Content-Type": "application/json",
             }
-        }
+            all_headers.update(headers or {})
 
-        resp = requests.post(
-            GLPI_API_URL + "Ticket",
-            headers=headers,
-            data=json.dumps(payload)
-        )
+            started = time.perf_counter()
+            try:
+                resp = self._http.request(
+                    method,
+                    self.api_url + path,
+                    headers=all_headers,
+                    data=json.dumps(payload) if payload is not None else None,
+                    params=params,
+                    timeout=self.timeout,
+                )
+            except Exception:
+                glpi_errors.inc(status="exception")
+                raise
+            finally:
+                glpi_seconds.observe(time.perf_counter() - started, method=method)
 
-        if resp.status_code != 201:
-            ticket_logger.error(f"Failed to create ticket: {resp.text}")
-            return None
+            if resp.status_code >= 400:
+                glpi_errors.inc(status=resp.status_code)
 
-        ticket_id = resp.json().get("id")
-        ticket_logger.info(f"Ticket Created Successfully: {ticket_id}")
-        return ticket_id
+            if resp.status_code != 401:
+                return resp
+            ticket_logger.info("GLPI session token rejected; refreshing.")
 
-    except Exception as e:
-        ticket_logger.error(f"GLPI Ticket Creation Error: {e}")
-        return None
+        return resp
 
+    # -----------------------------------------------
+    # CREATE TICKET
+    # -----------------------------------------------
+    def create_ticket(self, title, description):
+        try:
+            payload = {
+                "input": {
+                    "name": title,
+                    "content": description,
+                    "status": 1,           # 1 = New / Open
+                    "requesttypes_id": 2,  # Email request
+                }
+            }
 
-# ---------------------------------------------------
-# 3. ADD FOLLOW-UP NOTE (AI Reply)
-# ---------------------------------------------------
-def glpi_add_followup(session_token, ticket_id, message):
-    try:
-        headers = {
-            "App-Token": APP_TOKEN,
-            "Session-Token": session_token,
-            "Content-Type": "application/json",
-        }
+            resp = self._request("POST", "Ticket", payload)
+            if resp is None:
+                return None
+
+            if resp.status_code != 201:
+                ticket_logger.error(f"Failed to create ticket: {resp.text}")
+                return None
+
+            ticket_id = resp.json().get("id")
+            ticket_logger.info(f"Ticket Created Successfully: {ticket_id}")
+            return ticket_id
+
+        except Exception as e:
+            ticket_logger.error(f"GLPI Ticket Creation Error: {e}")
+            return None
 
-        payload = {
-            "input": {
-                "itemtype": "Ticket",
-                "items_id": ticket_id,
-                "content": message,
+    # -----------------------------------------------
+    # ADD FOLLOW-UP NOTE (AI Reply)
+    # -----------------------------------------------
+    def add_followup(self, ticket_id, message):
+        try:
+            payload = {
+                "input": {
+                    "itemtype": "Ticket",
+                    "items_id": ticket_id,
+                    "content": message,
+                }
             }
-        }
 
-        resp = requests.post(
-            GLPI_API_URL + f"Ticket/{ticket_id}/ITILFollowup",
-            headers=headers,
-            data=json.dumps(payload)
-        )
+            resp = self._request("POST", f"Ticket/{ticket_id}/ITILFollowup", payload)
+            if resp is None:
+                return False
+
+            if resp.status_code != 201:
+                ticket_logger.error(f"Failed to add follow-up: {resp.text}")
+                return False
 
-        if resp.status_code != 201:
-            ticket_logger.error(f"Failed to add follow-up: {resp.text}")
+            ticket_logger.info(f"Follow-up added to Ticket {ticket_id}")
+            return True
+
+        except Exception as e:
+            ticket_logger.error(f"GLPI Follow-up Error: {e}")
             return False
 
-        ticket_logger.info(f"Follow-up added to Ticket {ticket_id}")
-        return True
+    # -----------------------------------------------
+    # CLOSE TICKET (status = 6)
+    # -----------------------------------------------
+    def close_ticket(self, ticket_id):
+        """Close GLPI ticket (6 = Solved/Closed)."""
+        try:
+            payload = {
+                "input": {
+                    "id": ticket_id,
+                    "status": 6,  # Closed
+                }
+            }
 
-    except Exception as e:
-        ticket_logger.error(f"GLPI Follow-up Error: {e}")
-        return False
+            resp = self._request("PUT", f"Ticket/{ticket_id}", payload)
+            if resp is None:
+                return False
 
+            if resp.status_code not in (200, 201):
+                ticket_logger.error(f"Failed to close ticket {ticket_id}: {resp.text}")
+                return False
 
-# ---------------------------------------------------
-# 4. CLOSE TICKET (status = 6)
-# ---------------------------------------------------
-def glpi_close_ticket(session_token, ticket_id):
-    """Close GLPI ticket (6 = Solved/Closed)."""
-    try:
-        headers = {
-            "App-Token": APP_TOKEN,
-            "Session-Token": session_token,
-            "Content-Type": "application/json",
-        }
+            ticket_logger.info(f"Ticket {ticket_id} closed successfully.")
+            return True
 
-        payload = {
-            "input": {
-                "id": ticket_id,
-                "status": 6,  # Closed
-            }
+        except Exception as e:
+            ticket_logger.error(f"GLPI Close Ticket Error: {e}")
+            return False
+
+    # -----------------------------------------------
+    # SEARCH OPEN TICKETS (paged)
+    # -----------------------------------------------
+    def search_open_tickets(self, title_prefix, start=0, limit=100):
+        """
+        One page of not-yet-solved tickets whose title contains title_prefix.
+        Returns (rows, totalcount); rows are dicts with id, name, status,
+        date_mod. Returns (None, 0) on error.
+        """
+        params = {
+            "criteria[0][field]": SEARCH_FIELDS["name"],
+            "criteria[0][searchtype]": "contains",
+            "criteria[0][value]": title_prefix,
+            "criteria[1][link]": "AND",
+            "criteria[1][field]": SEARCH_FIELDS["status"],
+            "criteria[1][searchtype]": "equals",
+            "criteria[1][value]": "notold",
+            "sort": SEARCH_FIELDS["id"],
+            "order": "ASC",
+            "range": f"{start}-{start + limit - 1}",
         }
+        for i, field in enumerate(SEARCH_FIELDS.values()):
+            params[f"forcedisplay[{i}]"] = field
 
-        resp = requests.put(
-            GLPI_API_URL + f"Ticket/{ticket_id}",
-            headers=headers,
-            data=json.dumps(payload)
-        )
+        try:
+            resp = self._request("GET", "search/Ticket", params=params)
+            if resp is None:
+                return None, 0
 
-        if resp.status_code not in (200, 201):
-            ticket_logger.error(f"Failed to close ticket {ticket_id}: {resp.text}")
-            return False
+            if resp.status_code not in (200, 206):
+                ticket_logger.error(f"Ticket search failed: {resp.text}")
+                return None, 0
+
+            body = resp.json()
+            rows = [
+                {name: row.get(str(field)) for name, field in SEARCH_FIELDS.items()}
+                for row in body.get("data") or []
+            ]
+            return rows, int(body.get("totalcount", 0))
+
+        except Exception as e:
+            ticket_logger.error(f"GLPI Ticket Search Error: {e}")
+            return None, 0
 
-        ticket_logger.info(f"Ticket {ticket_id} closed successfully.")
-        return True
 
-    except Exception as e:
-        ticket_logger.error(f"GLPI Close Ticket Error: {e}")
-        return False
+# Shared client used by the ticket handler
+glpi = GlpiClient()
@@ -1,10 +1,7 @@
 import logging
-from app.glpi_client import (
-    glpi_start_session,
-    glpi_create_ticket,
-    glpi_add_followup,
-    glpi_close_ticket
-)
+import os
+from app.ticket_queue import TicketQueue
+from app.ticket_state import TicketStateStore, title_for
 
 # ------------------------------------------
 # Ticket Logger (separate log file)
@@ -15,8 +12,17 @@ handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
 ticket_logger.addHandler(handler)
 ticket_logger.setLevel(logging.INFO)
 
-# Map user → last ticket ID (POC only)
-_last_ticket_map = {}
+# Write-behind queue for GLPI operations (flusher started by main)
+ticket_queue = TicketQueue(
+    os.path.join(os.getenv("STATE_DIR", "state"), "ticket_queue.db")
+)
+
+# sender → open/closed ticket, persisted across restarts.
+# A reference is a GLPI ticket id, or a provisional "P-…" ref until
+# the write-behind queue has created the ticket.
+ticket_states = TicketStateStore(
+    os.path.join(os.getenv("STATE_DIR", "state"), "ticket_state.db")
+)
 
 
 # ----------------------------------------------------------
@@ -45,11 +51,16 @@ def customer_wants_close(message):
 # Helper: Get/Set last ticket
 # ----------------------------------------------------------
 def get_last_ticket_id_for_user(email):
-    return _last_ticket_map.get(email)
+    """The user's open ticket ref; closed tickets are not returned."""
+    return ticket_states.open_ticket(email)
 
 
 def set_last_ticket_user(email, ticket_id):
-    _last_ticket_map[email] = ticket_id
+    ticket_states.set_open(email, ticket_id)
+
+
+# Swap a provisional ref for the real GLPI id once it is known
+ticket_queue.add_listener(ticket_states.resolve_ref)
 
 
 # ----------------------------------------------------------------
@@ -62,6 +73,8 @@ def process_ticketing(from_email, user_message, ai_reply, intents):
     - New ticket creation
     - Follow-up on existing ticket
     - Inject ticket ID into AI reply
+
+    GLPI calls are queued (write-behind), so this never waits on GLPI.
     """
     user_email = from_email.strip().lower()
 
@@ -71,22 +84,18 @@ def process_ticketing(from_email, user_message, ai_reply, intents):
     if customer_wants_close(user_message):
         ticket_logger.info(f"[AUTO-CLOSE REQUEST] From: {user_email}")
 
-        session = glpi_start_session()
-        if not session:
-            ticket_logger.error("Auto-close failed: cannot start session.")
-            return None, "Your ticket is resolved. (But auto-close failed.)"
-
         last_ticket = get_last_ticket_id_for_user(user_email)
         if not last_ticket:
             ticket_logger.error(f"No ticket found to close for {user_email}")
             return None, "Your issue is marked as resolved."
 
-        # Close ticket
-        glpi_close_ticket(session, last_ticket)
-        ticket_logger.info(f"[AUTO-CLOSED] Ticket #{last_ticket} for {user_email}")
+        # Close ticket; no more follow-ups go to it
+        ticket_queue.enqueue_close(last_ticket)
+        ticket_states.mark_closed(user_email)
+        ticket_logger.info(f"[AUTO-CLOSE QUEUED] Ticket {last_ticket} for {user_email}")
 
         reply = (
-            f"Your ticket #{last_ticket} has been closed.\n\n"
+            f"Your ticket {ticket_queue.display_ref(last_ticket)} has been closed.\n\n"
             "If you need anything else, feel free to contact us again.\n\n"
             "Regards,\nBank Support Team"
         )
@@ -99,33 +108,34 @@ def process_ticketing(from_email, user_message, ai_reply, intents):
     existing_ticket = get_last_ticket_id_for_user(user_email)
 
     if existing_ticket:
-        session = glpi_start_session()
-        if session:
-            glpi_add_followup(session, existing_ticket, f"Customer reply:\n{user_message}")
-            glpi_add_followup(session, existing_ticket, f"AI reply:\n{ai_reply}")
+        # customer + AI text go to GLPI as one follow-up
+        ticket_queue.enqueue_followup(
+            existing_ticket,
+            f"Customer reply:\n{user_message}\n\nAI reply:\n{ai_reply}",
+        )
+        ticket_states.touch(user_email)
 
-            ticket_logger.info(
-                f"[FOLLOW-UP] Added follow-up to Ticket #{existing_ticket} for {user_email}"
-            )
+        ticket_logger.info(
+            f"[FOLLOW-UP QUEUED] Ticket {existing_ticket} for {user_email}"
+        )
 
-            final_reply = (
-                ai_reply
-                + f"\n\nTicket Reference ID: #{existing_ticket}\n(Your message has been added as a follow-up)"
-            )
+        final_reply = (
+            ai_reply
+            + f"\n\nTicket Reference ID: {ticket_queue.display_ref(existing_ticket)}"
+            + "\n(Your message has been added as a follow-up)"
+        )
 
-            return existing_ticket, final_reply
+        return existing_ticket, final_reply
 
     # ---------------------------------------
     # 3️⃣ CREATE NEW TICKET
     # ---------------------------------------
-    session = glpi_start_session()
-    if not session:
-        ticket_logger.error("GLPI session startup failed.")
-        return None, ai_reply + "\n\n(Note: Ticketing system unavailable.)"
-
-    title = f"Loan Support Request - {user_email}"
+    title = title_for(user_email)
+    ref = ticket_queue.new_ref()
 
+    # the customer is given the provisional ref, so support staff must be able to find it
     description = f"""
+Reference: {ref}
 Customer Email: {user_email}
 
 Message:
@@ -137,24 +147,19 @@ AI Reply:
 {ai_reply}
 """
 
-    ticket_id = glpi_create_ticket(session, title, description)
-
-    if not ticket_id:
-        ticket_logger.error(f"Failed to create ticket for {user_email}")
-        return None, ai_reply + "\n\n(Note: Could not create ticket.)"
-
-    # Save mapping for POC
-    set_last_ticket_user(user_email, ticket_id)
+    # Remember the new open ticket for this user
+    set_last_ticket_user(user_email, ref)
 
-    # Add AI reply as follow-up
-    glpi_add_followup(session, ticket_id, f"AI Response:\n{ai_reply}")
+    # AI reply is added as follow-up right after the ticket is created
+    ticket_queue.enqueue_create(ref, title, description, followup=f"AI Response:\n{ai_reply}")
 
-    ticket_logger.info(f"[CREATED] Ticket #{ticket_id} for {user_email}")
+    ticket_logger.info(f"[CREATE QUEUED] {ref} for {user_email}")
 
-    # Inject Ticket ID into customer email
+    # Inject Ticket reference into customer email
     final_reply = (
         ai_reply
-        + f"\n\nTicket Reference ID: #{ticket_id}\n(Use this ID for any follow-up queries)"
+        + f"\n\nTicket Reference ID: {ticket_queue.display_ref(ref)}"
+        + "\n(Use this ID for any follow-up queries)"
     )
 
-    return ticket_id, final_reply
+    return ref, final_reply
@@ -0,0 +1,282 @@
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Messages kept per sender, and how many of them go back into a prompt
+MAX_MESSAGES = 12
+CONTEXT_MESSAGES = 6   # last 3 user+assistant pairs
+
+DEFAULT_MAX_SENDERS = 10_000
+DEFAULT_TTL = 7 * 24 * 3600
+
+# SQLite write batching
+FLUSH_BATCH = 50
+FLUSH_INTERVAL = 2.0
+
+_ENTRY_OVERHEAD = 120   # tuple + deque slot, roughly
+
+
+def _entry_size(role, text):
+    return sys.getsizeof(role) + sys.getsizeof(text) + _ENTRY_OVERHEAD
+
+
+# -----------------------------------------------------------
+# IN-MEMORY STORE
+# -----------------------------------------------------------
+
+class MemoryHistoryStore:
+    """
+    Per-sender ring buffers (deque with maxlen) under a global sender cap.
+
+    Senders are kept in LRU order; the least recently active sender is
+    dropped once max_senders is exceeded, and senders idle for longer
+    than ttl are forgotten.
+    """
+
+    def __init__(self, max_messages=MAX_MESSAGES, max_senders=DEFAULT_MAX_SENDERS,
+                 ttl=DEFAULT_TTL):
+        self.max_messages = max_messages
+        self.max_senders = max_senders
+        self.ttl = ttl
+
+        # sender → [deque of (role, text, size), last_active, bytes]
+        self._senders = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.evictions = 0
+        self.expirations = 0
+
+    # -------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------
+
+    def get(self, sender, limit=CONTEXT_MESSAGES):
+        """Return the last `limit` messages as [{"role", "text"}]."""
+        with self._lock:
+            entry = self._touch(sender)
+            if entry is None:
+                entry = self._load_locked(sender)
+            if entry is None:
+                return []
+            items = list(entry[0])[-limit:]
+        return [{"role": role, "text": text} for role, text, _ in items]
+
+    def add(self, sender, role, text):
+        text = text or ""
+        size = _entry_size(role, text)
+        with self._lock:
+            entry = self._touch(sender) or self._load_locked(sender)
+            if entry is None:
+                entry = [deque(maxlen=self.max_messages), time.time(), 0]
+                self._senders[sender] = entry
+
+            ring = entry[0]
+            if len(ring) == ring.maxlen:
+                dropped = ring[0][2]
+                entry[2] -= dropped
+                self._bytes -= dropped
+            ring.append((role, text, size))
+            entry[2] += size
+            self._bytes += size
+
+            self._evict()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    # -------------------------------------------------------
+    # LRU / TTL bookkeeping (caller holds the lock)
+    # -------------------------------------------------------
+
+    def _touch(self, sender):
+        entry = self._senders.get(sender)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry[1] > self.ttl:
+            self._drop(sender)
+            self.expirations += 1
+            return None
+        entry[1] = now
+        self._senders.move_to_end(sender)
+        return entry
+
+    def _load_locked(self, sender):
+        """Hook for persistent backends; memory-only has nothing to load."""
+        return None
+
+    def _drop(self, sender):
+        entry = self._senders.pop(sender)
+        self._bytes -= entry[2]
+
+    def _evict(self):
+        now = time.time()
+        while self._senders:
+            oldest, entry = next(iter(self._senders.items()))
+            if now - entry[1] > self.ttl:
+                self._drop(oldest)
+                self.expirations += 1
+            elif len(self._senders) > self.max_senders:
+                self._drop(oldest)
+                self.evictions += 1
+            else:
+                break
+
+    # -------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "senders": len(self._senders),
+                "messages": sum(len(e[0]) for e in self._senders.values()),
+                "approx_bytes": self._bytes + sys.getsizeof(self._senders),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# -----------------------------------------------------------
+# SQLITE-BACKED STORE
+# -----------------------------------------------------------
+
+class SqliteHistoryStore(MemoryHistoryStore):
+    """
+    Memory store in front of a SQLite (WAL) table.
+
+    Writes are queued and flushed in batches (every FLUSH_BATCH messages
+    or FLUSH_INTERVAL seconds), so history survives restarts without a
+    disk write per message. Senders evicted from memory are reloaded
+    from disk on their next message.
+    """
+
+    def __init__(self, path, batch_size=FLUSH_BATCH, flush_interval=FLUSH_INTERVAL, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._pending = []
+        self._timer = None
+        self._db_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender TEXT NOT NULL,
+                role TEXT NOT NULL,
+                text TEXT NOT NULL,
+                ts REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender, id);
+            """
+        )
+        self._db.commit()
+
+        self.flushes = 0
+
+    def add(self, sender, role, text):
+        super().add(sender, role, text)
+        with self._lock:
+            self._pending.append((sender, role, text or "", time.time()))
+            flush_now = len(self._pending) >= self.batch_size
+            if not flush_now and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush_now:
+            self.flush()
+
+    def _load_locked(self, sender):
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT role, text, ts FROM messages WHERE sender = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (sender, self.max_messages),
+            ).fetchall()
+
+        # queued writes not yet on disk
+        rows = [(r, t, ts) for r, t, ts in reversed(rows)]
+        rows += [(r, t, ts) for s, r, t, ts in self._pending if s == sender]
+        if not rows or time.time() - rows[-1][2] > self.ttl:
+            return None
+
+        ring = deque(
+            ((r, t, _entry_size(r, t)) for r, t, _ in rows), maxlen=self.max_messages
+        )
+        entry = [ring, time.time(), sum(e[2] for e in ring)]
+        self._senders[sender] = entry
+        self._bytes += entry[2]
+        self._evict()
+        return entry
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not batch:
+            return
+
+        senders = {row[0] for row in batch}
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT INTO messages (sender, role, text, ts) VALUES (?, ?, ?, ?)", batch
+                )
+                # keep only the ring-buffer tail per sender, and nothing past TTL
+                for sender in senders:
+                    self._db.execute(
+                        "DELETE FROM messages WHERE sender = ? AND id NOT IN "
+                        "(SELECT id FROM messages WHERE sender = ? ORDER BY id DESC LIMIT ?)",
+                        (sender, sender, self.max_messages),
+                    )
+                self._db.execute("DELETE FROM messages WHERE ts < ?", (time.time() - self.ttl,))
+                self._db.commit()
+            self.flushes += 1
+        except Exception as e:
+            logging.error(f"History flush failed ({len(batch)} messages): {e}")
+            with self._lock:
+                self._pending[:0] = batch
+
+    def close(self):
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def stats(self):
+        out = super().stats()
+        with self._lock:
+            pending = len(self._pending)
+        with self._db_lock:
+            stored = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        out.update({
+            "backend": "sqlite",
+            "pending_writes": pending,
+            "stored_messages": stored,
+            "flushes": self.flushes,
+        })
+        return out
+
+
+def make_history_store(backend="memory", path=None, **kwargs):
+    """HISTORY_BACKEND=sqlite persists to path; anything else stays in memory."""
+    if backend == "sqlite":
+        return SqliteHistoryStore(path, **kwargs)
+    return MemoryHistoryStore(**kwargs)
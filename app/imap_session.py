@@ -0,0 +1,184 @@
+import imaplib
+import logging
+import random
+import select
+import ssl
+import time
+
+# Re-issue IDLE well inside the 29-minute limit from RFC 2177
+IDLE_TIMEOUT = 300
+# Reconnect backoff (seconds)
+BACKOFF_START = 1
+BACKOFF_MAX = 60
+
+# Errors that mean the connection is gone and must be rebuilt
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+# -------------------------------------------------------
+# LONG-LIVED IMAP SESSION
+# -------------------------------------------------------
+class ImapSession:
+    """
+    One authenticated IMAP connection kept open across poll cycles.
+
+    - connects lazily, reconnects with exponential backoff + jitter
+    - keeps the mailbox SELECTed, so searches need no extra round trip
+    - wait_for_mail() blocks on IMAP IDLE (push) when the server
+      supports it, otherwise falls back to NOOP polling
+    - IDLE is re-issued every idle_timeout seconds as a keepalive
+    """
+
+    def __init__(self, server, account, password, mailbox="inbox",
+                 poll_interval=10, idle_timeout=IDLE_TIMEOUT, connect=imaplib.IMAP4_SSL):
+        self.server = server
+        self.account = account
+        self.password = password
+        self.mailbox = mailbox
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self._connect_fn = connect
+
+        self._conn = None
+        self._supports_idle = False
+        self.reconnects = 0
+
+    # ---------------------------------------------------
+    # Connection management
+    # ---------------------------------------------------
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._connect()
+        return self._conn
+
+    def _connect(self):
+        delay = BACKOFF_START
+        while True:
+            try:
+                conn = self._connect_fn(self.server)
+                conn.login(self.account, self.password)
+                conn.select(self.mailbox)
+                break
+            except (imaplib.IMAP4.error, *CONNECTION_ERRORS) as e:
+                wait = delay + random.uniform(0, delay / 2)
+                logging.error(f"IMAP connect failed ({e}); retrying in {wait:.1f}s")
+                time.sleep(wait)
+                delay = min(delay * 2, BACKOFF_MAX)
+
+        self._conn = conn
+        self._supports_idle = "IDLE" in conn.capabilities
+        logging.info(f"IMAP session ready (idle={self._supports_idle})")
+
+    def _reset(self):
+        """Drop a broken connection; the next access reconnects."""
+        if self._conn is not None:
+            try:
+                self._conn.shutdown()
+            except Exception:
+                pass
+        self._conn = None
+        self.reconnects += 1
+
+    def close(self):
+        if self._conn is None:
+            return
+        try:
+            self._conn.close()
+            self._conn.logout()
+        except Exception:
+            pass
+        self._conn = None
+
+    def call(self, fn, *args):
+        """Run fn(conn, *args), reconnecting and retrying once if the link dropped."""
+        try:
+            return fn(self.conn, *args)
+        except CONNECTION_ERRORS as e:
+            logging.warning(f"IMAP connection lost ({e}); reconnecting")
+            self._reset()
+            return fn(self.conn, *args)
+
+    # ---------------------------------------------------
+    # Waiting for new mail
+    # ---------------------------------------------------
+    def wait_for_mail(self, timeout=None):
+        """
+        Block until the server reports new mail or timeout expires.
+        Returns True when new mail was signalled (always True when polling).
+        """
+        timeout = timeout or self.idle_timeout
+        try:
+            conn = self.conn
+            if self._supports_idle:
+                return self._idle(conn, timeout)
+            time.sleep(self.poll_interval)
+            conn.noop()
+            return True
+        except CONNECTION_ERRORS as e:
+            logging.warning(f"IMAP wait interrupted ({e}); reconnecting")
+            self._reset()
+            return True
+
+    def _idle(self, conn, timeout):
+        tag = conn._new_tag()
+        conn.send(tag + b" IDLE\r\n")
+
+        line = conn.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.abort(f"IDLE rejected: {line!r}")
+
+        got_mail = False
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._readable(conn, remaining):
+                break
+            line = conn.readline()
+            if not line or line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort("server closed connection during IDLE")
+            if line.endswith(b"EXISTS\r\n") or line.endswith(b"RECENT\r\n"):
+                got_mail = True
+                break
+
+        conn.send(b"DONE\r\n")
+        while True:
+            line = conn.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed while ending IDLE")
+            if line.startswith(tag):
+                break
+
+        return got_mail
+
+    @staticmethod
+    def _readable(conn, timeout):
+        sock = conn.sock
+        if ImapSession._buffered(conn):
+            return True
+        if isinstance(sock, ssl.SSLSocket) and sock.pending():
+            return True
+        ready, _, _ = select.select([sock], [], [], timeout)
+        return bool(ready)
+
+    @staticmethod
+    def _buffered(conn):
+        """
+        Lines imaplib's reader already holds (e.g. "* n EXISTS" sent in the
+        same packet as "+ idling"): select() on the socket can't see them.
+        """
+        sock = conn.sock
+        saved = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            return bool(conn.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(saved)
@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import re
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), "intents.json")
+
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+# possessives and contractions: "emi's" → "emi", "what's" → "what"
+_CLITIC = re.compile(r"'(?:s|re|ve|ll|d|m)$")
+
+
+def tokenize(text):
+    text = (text or "").lower().replace("\u2019", "'")
+    return [_CLITIC.sub("", w) for w in _WORD.findall(text)]
+
+
+# -----------------------------------------------------------
+# INTENT ENGINE
+# -----------------------------------------------------------
+
+class IntentEngine:
+    """
+    Keyword intent classifier compiled into one word-level trie.
+
+    Every keyword phrase from the config is a path of whole words, so a
+    single pass over the message finds all (overlapping) phrase matches
+    with word boundaries respected ("emi" no longer matches "premium").
+    """
+
+    def __init__(self, intents, fallback="general_query"):
+        self.order = list(intents)
+        self.fallback = fallback
+        self.max_phrase = 1
+
+        # word → (children, intents ending here)
+        self._root = {}
+        for intent, phrases in intents.items():
+            for phrase in phrases:
+                words = tokenize(phrase)
+                if not words:
+                    continue
+                self.max_phrase = max(self.max_phrase, len(words))
+                node = self._root
+                for w in words[:-1]:
+                    node = node.setdefault(w, ({}, set()))[0]
+                node.setdefault(words[-1], ({}, set()))[1].add(intent)
+
+    @classmethod
+    def from_config(cls, path=None):
+        path = path or DEFAULT_CONFIG
+        with open(path) as f:
+            config = json.load(f)
+        engine = cls(config["intents"], config.get("fallback", "general_query"))
+        logging.info(f"Intent engine loaded {len(engine.order)} intents from {path}")
+        return engine
+
+    def classify(self, message):
+        words = tokenize(message)
+        found = set()
+
+        for start in range(len(words)):
+            node = self._root
+            for w in words[start:start + self.max_phrase]:
+                entry = node.get(w)
+                if entry is None:
+                    break
+                node, ends = entry
+                found.update(ends)
+
+        intents = [i for i in self.order if i in found]
+        return intents or [self.fallback]
+
+    def classify_batch(self, messages):
+        """Classify a whole inbox batch; identical bodies are classified once."""
+        seen = {}
+        out = []
+        for message in messages:
+            if message not in seen:
+                seen[message] = self.classify(message)
+            out.append(list(seen[message]))
+        return out
@@ -0,0 +1,128 @@
+import logging
+import time
+from types import MappingProxyType
+
+from app.customer_index import _native
+
+EMPTY_FEES = MappingProxyType({})
+
+
+# -----------------------------------------------------------
+# LOAN RECORD
+# -----------------------------------------------------------
+
+class LoanRecord:
+    """Immutable loan row with its fee row already attached."""
+
+    __slots__ = (
+        "loan_id",
+        "customer_id",
+        "emi_due_date",
+        "emi_amount",
+        "emi_status",
+        "last_payment_date",
+        "extra",
+        "fees",
+    )
+
+    FIELDS = __slots__[:6]
+
+    def __init__(self, loan_id, customer_id, emi_due_date, emi_amount,
+                 emi_status, last_payment_date, extra=EMPTY_FEES, fees=EMPTY_FEES):
+        set_ = object.__setattr__
+        set_(self, "loan_id", loan_id)
+        set_(self, "customer_id", customer_id)
+        set_(self, "emi_due_date", emi_due_date)
+        set_(self, "emi_amount", emi_amount)
+        set_(self, "emi_status", emi_status)
+        set_(self, "last_payment_date", last_payment_date)
+        set_(self, "extra", extra)
+        set_(self, "fees", fees)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("LoanRecord is immutable")
+
+    def __getitem__(self, key):
+        """Allow loan["emi_amount"] like the old row dicts."""
+        if key in self.FIELDS or key == "fees":
+            return getattr(self, key)
+        return self.extra[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        row = dict(self.extra)
+        row.update({f: getattr(self, f) for f in self.FIELDS})
+        row["fees"] = dict(self.fees)
+        return row
+
+    def __repr__(self):
+        return f"LoanRecord(loan_id={self.loan_id!r}, customer_id={self.customer_id!r})"
+
+
+# -----------------------------------------------------------
+# LOAN STORE
+# -----------------------------------------------------------
+
+class LoanStore:
+    """
+    customer_id → tuple of LoanRecord, joined with fees once at load time.
+
+    Loans keep their sheet order, so the first entry is the same loan the
+    old filter-and-iloc[0] path returned.
+    """
+
+    def __init__(self, by_customer, stats):
+        self._by_customer = MappingProxyType(by_customer)
+        self._stats = stats
+
+    @classmethod
+    def from_dataframes(cls, loans_df, fees_df):
+        started = time.perf_counter()
+
+        # fees: loan_id → first fee row (same choice as the old lookup)
+        fee_cols = tuple(fees_df.columns)
+        fees_by_loan = {}
+        for row in fees_df.itertuples(index=False, name=None):
+            fee_row = {c: _native(v) for c, v in zip(fee_cols, row)}
+            fees_by_loan.setdefault(fee_row.get("loan_id"), MappingProxyType(fee_row))
+
+        loan_cols = tuple(loans_df.columns)
+        by_customer = {}
+        for row in loans_df.itertuples(index=False, name=None):
+            loan_row = {c: _native(v) for c, v in zip(loan_cols, row)}
+            extra = {k: v for k, v in loan_row.items() if k not in LoanRecord.FIELDS}
+
+            record = LoanRecord(
+                *(loan_row.get(f) for f in LoanRecord.FIELDS),
+                extra=MappingProxyType(extra),
+                fees=fees_by_loan.get(loan_row.get("loan_id"), EMPTY_FEES),
+            )
+            by_customer.setdefault(record.customer_id, []).append(record)
+
+        by_customer = {k: tuple(v) for k, v in by_customer.items()}
+
+        stats = {
+            "customers": len(by_customer),
+            "loans": len(loans_df),
+            "fee_rows": len(fees_by_loan),
+            "multi_loan_customers": sum(1 for v in by_customer.values() if len(v) > 1),
+            "build_seconds": round(time.perf_counter() - started, 4),
+        }
+        logging.info(f"LoanStore built: {stats}")
+
+        return cls(by_customer, stats)
+
+    def lookup(self, customer_id):
+        """Return every loan for the customer (empty tuple if none)."""
+        return self._by_customer.get(_native(customer_id), ())
+
+    def __len__(self):
+        return len(self._by_customer)
+
+    def stats(self):
+        return dict(self._stats)
@@ -0,0 +1,320 @@
+import email
+import json
+import logging
+import os
+import re
+import time
+
+# Max UIDs per pipelined FETCH command
+FETCH_BATCH_SIZE = 50
+# Times a failed message is fetched again before it is left for manual
+# follow-up, and the first retry delay (doubles per attempt, seconds)
+FETCH_RETRIES = 5
+FETCH_RETRY_DELAY = 30
+
+
+# -------------------------------------------------------
+# UID HIGH-WATER MARK (persisted)
+# -------------------------------------------------------
+class UidState:
+    """
+    Highest fetched UID for one UIDVALIDITY, plus the UIDs at or below it
+    that failed and wait for another attempt ({uid: [attempts, due_at]}).
+    Stored as JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.uidvalidity = None
+        self.last_uid = 0
+        self.retry = {}
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self.uidvalidity = data.get("uidvalidity")
+            self.last_uid = int(data.get("last_uid", 0))
+            self.retry = {int(uid): list(v) for uid, v in (data.get("retry") or {}).items()}
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            logging.error(f"UID state unreadable ({e}); starting from UNSEEN")
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "uidvalidity": self.uidvalidity,
+                "last_uid": self.last_uid,
+                "retry": {str(uid): v for uid, v in self.retry.items()},
+            }, f)
+        os.replace(tmp, self.path)
+
+
+# -------------------------------------------------------
+# FETCH RESPONSE PARSER
+# -------------------------------------------------------
+_TOKEN = re.compile(
+    rb'\s*(?:'
+    rb'(?P<open>\()|(?P<close>\))'
+    rb'|"(?P<quoted>(?:[^"\\]|\\.)*)"'
+    rb'|\{(?P<literal>\d+)\}\s*$'
+    rb'|(?P<atom>[^\s()"\[]+(?:\[[^\]]*\](?:<\d+>)?)?)'
+    rb')'
+)
+
+
+def _tokens(data):
+    """Yield tokens from imaplib fetch data (bytes and (prefix, literal) tuples)."""
+    for entry in data:
+        if entry is None:
+            continue
+        text, literal = (entry[0], entry[1]) if isinstance(entry, tuple) else (entry, None)
+
+        pos = 0
+        while pos < len(text):
+            m = _TOKEN.match(text, pos)
+            if not m or m.end() == pos:
+                break
+            pos = m.end()
+            if m.group("open"):
+                yield "("
+            elif m.group("close"):
+                yield ")"
+            elif m.group("quoted") is not None:
+                yield re.sub(rb"\\(.)", rb"\1", m.group("quoted"))
+            elif m.group("literal") is not None:
+                yield literal
+            else:
+                atom = m.group("atom")
+                yield None if atom.upper() == b"NIL" else atom
+
+
+def _parse_list(tokens):
+    out = []
+    for tok in tokens:
+        if tok == "(":
+            out.append(_parse_list(tokens))
+        elif tok == ")":
+            return out
+        else:
+            out.append(tok)
+    return out
+
+
+def parse_fetch(data):
+    """Return {uid: {item_name: value}} for a (UID) FETCH response."""
+    tokens = _tokens(data)
+    result = {}
+    for tok in tokens:
+        if tok != "(":
+            continue   # message sequence number
+        items = _parse_list(tokens)
+        pairs = dict(zip(
+            (k.decode().upper() if isinstance(k, bytes) else k for k in items[0::2]),
+            items[1::2],
+        ))
+        if "UID" in pairs:
+            result[int(pairs["UID"])] = pairs
+    return result
+
+
+# -------------------------------------------------------
+# BODYSTRUCTURE → text part sections
+# -------------------------------------------------------
+def _lower(value):
+    return value.decode(errors="ignore").lower() if isinstance(value, bytes) else ""
+
+
+def _text_parts(structure, prefix=""):
+    """Yield (section, subtype) for inline text/* leaves in a BODYSTRUCTURE."""
+    if structure and isinstance(structure[0], list):
+        # multipart: children first, then subtype + extensions
+        for i, child in enumerate(c for c in structure if isinstance(c, list) and c):
+            yield from _text_parts(child, f"{prefix}{i + 1}.")
+        return
+
+    maintype = _lower(structure[0])
+    subtype = _lower(structure[1]) if len(structure) > 1 else ""
+    if maintype != "text":
+        return
+
+    # text/*: fields 0-7 fixed, md5 at 8, disposition at 9
+    disposition = structure[9] if len(structure) > 9 else None
+    if isinstance(disposition, list) and _lower(disposition[0]) == "attachment":
+        return
+
+    yield prefix.rstrip(".") or "TEXT", subtype
+
+
+def choose_sections(structure):
+    """
+    Pick the single text part the body extractor would use:
+    first text/plain, else first text/html.
+    """
+    parts = list(_text_parts(structure))
+    for wanted in ("plain", "html"):
+        for section, subtype in parts:
+            if subtype == wanted:
+                return section
+    return None
+
+
+# -------------------------------------------------------
+# INCREMENTAL FETCHER
+# -------------------------------------------------------
+class IncrementalFetcher:
+    """
+    Fetches only mail newer than the persisted UID high-water mark.
+
+    Per batch there are two pipelined commands:
+      1. UID FETCH <set> (BODYSTRUCTURE)
+      2. UID FETCH <set> (BODY.PEEK[HEADER] BODY.PEEK[n.MIME] BODY.PEEK[n])
+    so attachments are never downloaded. BODY.PEEK leaves \\Seen alone;
+    complete() flags handled messages and advances the mark. Messages
+    that failed are fetched again with a later batch, with exponential
+    backoff, up to `retries` times.
+    """
+
+    def __init__(self, state_path, batch_size=FETCH_BATCH_SIZE, retries=FETCH_RETRIES,
+                 retry_delay=FETCH_RETRY_DELAY):
+        self.state = UidState(state_path)
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    # ---------------------------------------------------
+    # Search
+    # ---------------------------------------------------
+    def _uidvalidity(self, conn):
+        _, data = conn.response("UIDVALIDITY")
+        if data and data[0]:
+            return int(data[0])
+        _, data = conn.status("inbox", "(UIDVALIDITY)")
+        m = re.search(rb"UIDVALIDITY (\d+)", data[0] or b"")
+        return int(m.group(1)) if m else None
+
+    def new_uids(self, conn):
+        """UIDs of unseen messages above the high-water mark, plus failed ones due a retry."""
+        validity = self._uidvalidity(conn)
+        if validity is not None and validity != self.state.uidvalidity:
+            if self.state.uidvalidity is not None:
+                logging.warning("UIDVALIDITY changed; resetting UID high-water mark")
+            self.state.uidvalidity = validity
+            self.state.last_uid = 0
+            self.state.retry = {}
+            self.state.save()
+
+        last = self.state.last_uid
+        retry = self.state.retry
+        if last:
+            uid_set = ",".join([*map(str, sorted(retry)), f"{last + 1}:*"])
+            status, data = conn.uid("SEARCH", None, f"UNSEEN UID {uid_set}")
+        else:
+            status, data = conn.uid("SEARCH", None, "UNSEEN")
+        if status != "OK":
+            return []
+        found = set(map(int, data[0].split())) if data and data[0] else set()
+
+        # failed messages that were read or deleted elsewhere need no retry
+        gone = [uid for uid in retry if uid not in found]
+        if gone:
+            for uid in gone:
+                del retry[uid]
+            self.state.save()
+
+        # "n:*" always matches the highest UID, even when it is <= last
+        now = time.time()
+        return sorted(u for u in found if u > last or (u in retry and retry[u][1] <= now))
+
+    # ---------------------------------------------------
+    # Fetch
+    # ---------------------------------------------------
+    def fetch(self, conn, uids):
+        """Return [(uid, email.message.Message)] in UID order."""
+        messages = []
+        for i in range(0, len(uids), self.batch_size):
+            messages.extend(self._fetch_batch(conn, uids[i:i + self.batch_size]))
+        return messages
+
+    def _fetch_batch(self, conn, uids):
+        uid_set = ",".join(map(str, uids))
+        status, data = conn.uid("FETCH", uid_set, "(BODYSTRUCTURE)")
+        if status != "OK":
+            logging.error(f"BODYSTRUCTURE fetch failed for {uid_set}")
+            return []
+
+        # group UIDs by the section they need, one FETCH per group
+        groups = {}
+        for uid, items in parse_fetch(data).items():
+            structure = items.get("BODYSTRUCTURE") or []
+            multipart = bool(structure) and isinstance(structure[0], list)
+            section = choose_sections(structure) if multipart else "TEXT"
+            groups.setdefault(section, []).append(uid)
+
+        messages = []
+        for section, group in groups.items():
+            if section is None or section == "TEXT":
+                spec = "(BODY.PEEK[HEADER] BODY.PEEK[TEXT])" if section else "(BODY.PEEK[HEADER])"
+            else:
+                spec = f"(BODY.PEEK[HEADER] BODY.PEEK[{section}.MIME] BODY.PEEK[{section}])"
+
+            status, data = conn.uid("FETCH", ",".join(map(str, group)), spec)
+            if status != "OK":
+                logging.error(f"Section fetch failed for {group}")
+                continue
+
+            for uid, items in parse_fetch(data).items():
+                messages.append((uid, self._build_message(items, section)))
+
+        return sorted(messages, key=lambda m: m[0])
+
+    @staticmethod
+    def _build_message(items, section):
+        header = items.get("BODY[HEADER]") or b""
+        if section == "TEXT":
+            return email.message_from_bytes(header + (items.get("BODY[TEXT]") or b""))
+
+        msg = email.message_from_bytes(header)
+        if section is None:
+            msg.set_payload([])
+            return msg
+
+        mime = items.get(f"BODY[{section}.MIME]") or b""
+        body = items.get(f"BODY[{section}]") or b""
+        msg.set_payload([email.message_from_bytes(mime + body)])
+        return msg
+
+    # ---------------------------------------------------
+    # Completion
+    # ---------------------------------------------------
+    def complete(self, conn, handled_uids, batch_uids):
+        """
+        Flag handled messages \\Seen and advance the high-water mark past
+        the whole batch. Failed messages are kept for retry; after
+        `retries` attempts they stay UNSEEN for manual follow-up.
+        """
+        if handled_uids:
+            conn.uid("STORE", ",".join(map(str, handled_uids)), "+FLAGS", "(\\Seen)")
+        if not batch_uids:
+            return
+
+        retry = self.state.retry
+        for uid in handled_uids:
+            retry.pop(uid, None)
+        for uid in set(batch_uids) - set(handled_uids):
+            attempts = retry.get(uid, [0, 0])[0] + 1
+            if attempts > self.retries:
+                retry.pop(uid, None)
+                logging.error(f"UID {uid} failed {attempts} times; leaving it UNSEEN for manual follow-up")
+            else:
+                retry[uid] = [attempts, time.time() + self.retry_delay * 2 ** (attempts - 1)]
+
+        self.state.last_uid = max(self.state.last_uid, max(batch_uids))
+        self.state.save()
+
+
+def message_key(msg, uidvalidity, uid):
+    """Stable dedupe key: Message-ID header, else the UID."""
+    mid = (msg.get("Message-ID") or "").strip()
+    return mid or f"<uid-{uidvalidity}-{uid}>"
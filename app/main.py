@@ -1,18 +1,22 @@
 import time
-import imaplib
-import email
-import smtplib
-from email.mime.text import MIMEText
 from dotenv import load_dotenv
 import os
 import logging
 
-from app.s3_loader import load_all_datasets
-from app.bedrock_gen import generate_reply, detect_intents
-
-# GLPI handler functions (separate clean module)
-from app.glpi_handler import (
-    process_ticketing
+from app.dataset_refresher import DatasetRefresher
+from app.s3_loader import SnapshotCache
+from app.sharding import ShardDispatcher, SnapshotFiles, migrate_state
+from app.bedrock_gen import bedrock_invoker, hedged_invoker, history_store, reply_cache
+from app.pipeline import MailPipeline
+from app.email_utils import extract_email_body
+from app.imap_session import ImapSession
+from app.mail_fetcher import IncrementalFetcher, message_key
+from app.message_journal import MessageJournal
+from app.smtp_sender import SmtpSender
+from app.glpi_handler import ticket_queue, ticket_states
+from app.glpi_client import glpi
+from app.metrics import (
+    SlowMessageProfiler, metrics, stage_seconds, start_http_server, start_stats_dump,
 )
 
 load_dotenv()
@@ -25,56 +29,77 @@ APP_PASSWORD = os.getenv("APP_PASSWORD")
 IMAP_SERVER = os.getenv("IMAP_SERVER", "imap.gmail.com")
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
 POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", 10))
+IDLE_TIMEOUT = int(os.getenv("IDLE_TIMEOUT", 300))
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", 50))
+STATE_DIR = os.getenv("STATE_DIR", "state")
+DATASET_REFRESH_INTERVAL = int(os.getenv("DATASET_REFRESH_INTERVAL", 300))
+
+# Prometheus /metrics port (0 = off), JSON stats dump to the log (0 = off),
+# and the message duration above which a sampled profile is logged (0 = off)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+METRICS_DUMP_INTERVAL = int(os.getenv("METRICS_DUMP_INTERVAL", 300))
+PROFILE_SLOW_MESSAGES = float(os.getenv("PROFILE_SLOW_MESSAGES", 0))
+
+# Per-stage concurrency for the mail pipeline
+PIPELINE_CONCURRENCY = {
+    "parse": int(os.getenv("PARSE_WORKERS", 4)),
+    "lookup": int(os.getenv("LOOKUP_WORKERS", 4)),
+    "generate": int(os.getenv("GENERATE_WORKERS", 4)),   # bounded by Bedrock quota
+    "ticket": int(os.getenv("TICKET_WORKERS", 2)),       # bounded by GLPI capacity
+    "send": int(os.getenv("SEND_WORKERS", 2)),
+}
+
+# Merge a sender's messages dated within this many seconds into one
+# request/reply (0 = off), at most COALESCE_MAX_MESSAGES per request
+COALESCE_WINDOW = int(os.getenv("COALESCE_WINDOW", 120))
+COALESCE_MAX_MESSAGES = int(os.getenv("COALESCE_MAX_MESSAGES", 5))
+
+# Scheduler: messages processed at once, queue size that triggers
+# "we've received your request" acknowledgements (0 = off)
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 16))
+OVERLOAD_THRESHOLD = int(os.getenv("OVERLOAD_THRESHOLD", 100))
+
+# Worker processes, sharded by sender (0/1 = everything in this process)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", 0))
 
 
 # -------------------------------------------------------
-# SAFE EMAIL BODY EXTRACTOR 
-# (prevents crash when mail has no body)
-# -------------------------------------------------------
-def extract_body(msg):
-    """Safely extract email body from single-part or multi-part emails."""
-    if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_type() == "text/plain" and "attachment" not in str(part.get("Content-Disposition")):
-                try:
-                    return part.get_payload(decode=True).decode(errors="ignore")
-                except:
-                    return "No message body."
-        return "No message body."
-    else:
-        try:
-            return msg.get_payload(decode=True).decode(errors="ignore")
-        except:
-            return "No message body."
-
-
-# -------------------------------------------------------
-# EMAIL / IMAP HELPERS
+# METRICS
 # -------------------------------------------------------
-def connect_imap():
-    mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-    mail.login(EMAIL_ACCOUNT, APP_PASSWORD)
-    return mail
-
-
-def fetch_unread_emails(mail):
-    mail.select("inbox")
-    status, data = mail.search(None, "UNSEEN")
-    return data[0].split()
-
-
-def send_email(to_addr, body):
-    msg = MIMEText(body)
-    msg["Subject"] = "Re: Your Query"
-    msg["From"] = EMAIL_ACCOUNT
-    msg["To"] = to_addr
-
-    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-    server.starttls()
-    server.login(EMAIL_ACCOUNT, APP_PASSWORD)
-    server.sendmail(EMAIL_ACCOUNT, [to_addr], msg.as_string())
-    server.quit()
+def register_gauges(datasets, smtp_sender):
+    """Queue depths and state sizes, read at scrape / dump time."""
+    metrics.gauge("ticket_queue_pending", ticket_queue.pending, "GLPI operations not yet applied")
+    metrics.gauge("smtp_retry_queue", smtp_sender.pending_retries, "Replies waiting for an SMTP retry")
+    metrics.gauge(
+        "bedrock_requests",
+        lambda: {k: bedrock_invoker.stats()[k] for k in ("queue_depth", "in_flight")},
+        "Bedrock calls waiting for admission / in flight", label="state",
+    )
+    metrics.gauge(
+        "bedrock_concurrency_limit", lambda: bedrock_invoker.stats()["concurrency_limit"],
+        "Current AIMD concurrency limit",
+    )
+    if hedged_invoker:
+        metrics.gauge(
+            "bedrock_hedge_after_seconds", lambda: hedged_invoker.stats()["hedge_after_seconds"],
+            "Primary latency after which a hedged request goes to the fallback route",
+        )
+        metrics.gauge(
+            "bedrock_breaker_open", lambda: int(hedged_invoker.breaker.state != "closed"),
+            "1 while the primary Bedrock route is bypassed",
+        )
+    metrics.gauge(
+        "reply_cache_lookups", lambda: {"hit": reply_cache.hits, "miss": reply_cache.misses},
+        "Reply cache lookups since start", label="result",
+    )
+    metrics.gauge("reply_cache_entries", lambda: reply_cache.stats()["entries"])
+    metrics.gauge("history_senders", lambda: history_store.stats()["senders"])
+    metrics.gauge(
+        "dataset_snapshot_age_seconds", lambda: datasets.stats()["snapshot_age_seconds"],
+        "Age of the live customer/loan snapshot",
+    )
 
 
 # -------------------------------------------------------
@@ -84,64 +109,159 @@ def main():
     logging.info("Starting Banking AI Bot…")
     print("Starting Banking AI Bot…")
 
+    # Per-sender state follows the worker count (STATE_DIR or STATE_DIR/shard-<n>)
+    migrate_state(STATE_DIR, SHARD_WORKERS, root_queue=ticket_queue, root_states=ticket_states)
+
+    if SHARD_WORKERS > 1:
+        run_sharded()
+        return
+
     logging.info("Loading datasets from S3…")
-    customers, fees, loans = load_all_datasets()
+    datasets = DatasetRefresher(interval=DATASET_REFRESH_INTERVAL)
+    datasets.load_initial()
     logging.info("Datasets loaded successfully.")
 
-    logging.info("Waiting for emails…")
-
-    while True:
-        try:
-            mail = connect_imap()
-            unread = fetch_unread_emails(mail)
+    # Hot-reload in the background; drop cached replies whose data changed
+    datasets.add_listener(lambda old, new: reply_cache.invalidate_stale(new.loan_store))
+    datasets.start()
+
+    os.makedirs(STATE_DIR, exist_ok=True)
+    journal = MessageJournal(os.path.join(STATE_DIR, "answered_message_ids.log"))
+
+    # Pooled SMTP sessions, one per concurrent send worker; replies that
+    # can't be sent now wait in a persistent outbox
+    smtp_sender = SmtpSender(**smtp_settings(), outbox_path=os.path.join(STATE_DIR, "smtp_outbox.db"))
+
+    profiler = None
+    if PROFILE_SLOW_MESSAGES > 0:
+        profiler = SlowMessageProfiler(threshold=PROFILE_SLOW_MESSAGES)
+        profiler.start()
+
+    pipeline = MailPipeline(
+        datasets,
+        send=smtp_sender.send,
+        extract_body=extract_email_body,
+        concurrency=PIPELINE_CONCURRENCY,
+        journal=journal,
+        profiler=profiler,
+        coalesce_window=COALESCE_WINDOW,
+        coalesce_max=COALESCE_MAX_MESSAGES,
+        max_in_flight=MAX_IN_FLIGHT,
+        overload_threshold=OVERLOAD_THRESHOLD,
+    )
+
+    register_gauges(datasets, smtp_sender)
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    if METRICS_DUMP_INTERVAL:
+        start_stats_dump(METRICS_DUMP_INTERVAL)
+
+    # Cold start: recover open tickets so customers keep their ticket
+    if not len(ticket_states):
+        ticket_states.rebuild_from_glpi(glpi)
+
+    # Apply queued GLPI operations in the background
+    ticket_queue.start()
+
+    poll_mailbox(pipeline.process_batch)
+
+
+def run_sharded():
+    """
+    Dispatcher mode: this process fetches mail and keeps the Feather
+    snapshots fresh; SHARD_WORKERS spawned processes answer it, each
+    owning the senders that hash to it (see app.sharding).
+    """
+    logging.info(f"Sharded mode with {SHARD_WORKERS} workers")
+
+    cache = SnapshotCache()
+    datasets = DatasetRefresher(
+        cache=cache, interval=DATASET_REFRESH_INTERVAL, build=SnapshotFiles.builder(cache)
+    )
+    datasets.load_initial()
+
+    dispatcher = ShardDispatcher(
+        SHARD_WORKERS,
+        STATE_DIR,
+        smtp=smtp_settings(),
+        concurrency=PIPELINE_CONCURRENCY,
+        coalesce_window=COALESCE_WINDOW,
+        coalesce_max=COALESCE_MAX_MESSAGES,
+        scheduler={
+            "max_in_flight": MAX_IN_FLIGHT,
+            "overload_threshold": OVERLOAD_THRESHOLD,
+        },
+        metrics_port=METRICS_PORT,
+    )
+    dispatcher.start(datasets.current)
+    datasets.add_listener(dispatcher.update_datasets)
+    datasets.start()
+
+    metrics.gauge("shard_workers_alive", lambda: dispatcher.stats()["alive"])
+    metrics.gauge(
+        "shard_messages_routed", lambda: dict(enumerate(dispatcher.stats()["routed"])),
+        "Messages routed to each shard worker", label="shard",
+    )
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    if METRICS_DUMP_INTERVAL:
+        start_stats_dump(METRICS_DUMP_INTERVAL)
+
+    try:
+        poll_mailbox(dispatcher.process_batch)
+    finally:
+        dispatcher.stop()
+
+
+def smtp_settings():
+    return {
+        "host": SMTP_SERVER,
+        "port": SMTP_PORT,
+        "username": EMAIL_ACCOUNT,
+        "password": APP_PASSWORD,
+        "starttls": SMTP_STARTTLS,
+        "pool_size": PIPELINE_CONCURRENCY["send"],
+    }
+
+
+def poll_mailbox(process_batch):
+    """Fetch unseen mail forever; process_batch answers one fetched batch."""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    fetcher = IncrementalFetcher(
+        os.path.join(STATE_DIR, "imap_uid.json"), batch_size=FETCH_BATCH_SIZE
+    )
 
-            if not unread:
-                time.sleep(POLL_INTERVAL)
-                continue
+    logging.info("Waiting for emails…")
 
-            for eid in unread:
-                status, data = mail.fetch(eid, "(RFC822)")
-                if status != "OK":
+    with ImapSession(
+        IMAP_SERVER,
+        EMAIL_ACCOUNT,
+        APP_PASSWORD,
+        poll_interval=POLL_INTERVAL,
+        idle_timeout=IDLE_TIMEOUT,
+    ) as session:
+        while True:
+            try:
+                uids = session.call(fetcher.new_uids)
+
+                if not uids:
+                    # IDLE push (or NOOP poll) until new mail arrives
+                    session.wait_for_mail()
                     continue
 
-                msg = email.message_from_bytes(data[0][1])
-
-                from_addr = email.utils.parseaddr(msg["From"])[1]
-                subject = msg.get("Subject", "")
-                body = extract_body(msg)
-
-                logging.info(f"Received email from {from_addr}")
+                with stage_seconds.time(stage="fetch"):
+                    fetched = session.call(fetcher.fetch, uids)
+                validity = fetcher.state.uidvalidity
+                results = process_batch([
+                    (uid, msg, message_key(msg, validity, uid)) for uid, msg in fetched
+                ])
 
-                # ------------------------------
-                # 1) Generate reply using Bedrock
-                # ------------------------------
-                ai_reply = generate_reply(from_addr, body, customers, fees, loans)
+                handled = [r.message_id for r in results if r.sent or r.skipped]
+                session.call(fetcher.complete, handled, uids)
 
-                # Detect intents for ticket logic
-                intents = detect_intents(body)
-
-                # ------------------------------
-                # 2) Process ticketing (create / update / auto-close)
-                # ------------------------------
-                ticket_id, final_reply = process_ticketing(
-                    from_email=from_addr,
-                    user_message=body,
-                    ai_reply=ai_reply,
-                    intents=intents
-                )
-
-                # ------------------------------
-                # 3) Send email to customer
-                # ------------------------------
-                send_email(from_addr, final_reply)
-                logging.info(f"Sent reply to {from_addr} (ticket={ticket_id})")
-
-            mail.logout()
-
-        except Exception as e:
-            logging.error(f"MAIN LOOP ERROR: {e}")
-
-        time.sleep(POLL_INTERVAL)
+            except Exception as e:
+                logging.error(f"MAIN LOOP ERROR: {e}")
+                time.sleep(POLL_INTERVAL)
 
 
 if __name__ == "__main__":
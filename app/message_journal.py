@@ -0,0 +1,56 @@
+import logging
+import threading
+
+# Keep the journal from growing forever; older IDs are compacted away
+MAX_ENTRIES = 50_000
+
+
+# -------------------------------------------------------
+# MESSAGE-ID JOURNAL
+# -------------------------------------------------------
+class MessageJournal:
+    """
+    Append-only file of Message-IDs that have already been answered.
+
+    Loaded into a set at startup, so a restart mid-batch never replies
+    to the same email twice.
+    """
+
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        entries = []
+        try:
+            with open(path) as f:
+                entries = [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            pass
+
+        if len(entries) > max_entries:
+            entries = entries[-max_entries:]
+            with open(path, "w") as f:
+                f.write("".join(e + "\n" for e in entries))
+            logging.info(f"Message journal compacted to {len(entries)} entries")
+
+        self._seen = set(entries)
+        self._file = open(path, "a")
+
+    def seen(self, key):
+        return key in self._seen
+
+    def record(self, key):
+        with self._lock:
+            if key in self._seen:
+                return
+            self._seen.add(key)
+            self._file.write(key.replace("\n", " ") + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __len__(self):
+        return len(self._seen)
@@ -0,0 +1,323 @@
+import bisect
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as _Tally, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "bankbot_"
+
+# Latency buckets in seconds (roughly ×2.5 steps, 1 ms → 2 min)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 120.0,
+)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _fmt_labels(key, extra=None):
+    pairs = list(key) + list(extra or [])
+    if not pairs:
+        return ""
+    inner = ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in pairs)
+    return "{" + inner + "}"
+
+
+# -----------------------------------------------------------
+# METRIC TYPES
+# -----------------------------------------------------------
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, v) for key, v in self._values.items()]
+
+    def snapshot(self):
+        with self._lock:
+            return {_fmt_labels(k) or "total": v for k, v in self._values.items()}
+
+
+class Gauge:
+    """Value pulled from a callback at scrape time (queue depths, ages)."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn, label=None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.label = label
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logging.warning(f"Gauge {self.name} failed: {e}")
+            return []
+        if isinstance(value, dict):
+            # {label value: number}, e.g. {"parse": 3, "send": 0}
+            return [(self.name, ((self.label, k),), v) for k, v in value.items()]
+        return [(self.name, (), value)]
+
+    def snapshot(self):
+        return {_fmt_labels(k) or "value": v for _, k, v in self.samples()}
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram: observe() is a bisect plus two adds under a
+    lock. Percentiles are interpolated inside the matching bucket.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}   # label key → [counts per bucket + overflow, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _quantile(self, counts, total, q):
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def samples(self):
+        out = []
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for key, (counts, total_sum, count) in series.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                out.append((f"{self.name}_bucket", key + (("le", bound),), cumulative))
+            out.append((f"{self.name}_bucket", key + (("le", "+Inf"),), count))
+            out.append((f"{self.name}_sum", key, round(total_sum, 6)))
+            out.append((f"{self.name}_count", key, count))
+        return out
+
+    def snapshot(self):
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        out = {}
+        for key, (counts, total_sum, count) in series.items():
+            if not count:
+                continue
+            out[_fmt_labels(key) or "all"] = {
+                "count": count,
+                "avg": round(total_sum / count, 4),
+                "p50": round(self._quantile(counts, count, 0.50), 4),
+                "p95": round(self._quantile(counts, count, 0.95), 4),
+                "p99": round(self._quantile(counts, count, 0.99), 4),
+            }
+        return out
+
+
+# -----------------------------------------------------------
+# REGISTRY
+# -----------------------------------------------------------
+
+class MetricsRegistry:
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, *args):
+        full = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(full)
+            if metric is None:
+                metric = self._metrics[full] = cls(full, help_text, *args)
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def gauge(self, name, fn, help_text="", label=None):
+        """Register (or replace) a callback gauge; fn may return {label value: n}."""
+        full = self.prefix + name
+        with self._lock:
+            self._metrics[full] = Gauge(full, help_text, fn, label)
+        return self._metrics[full]
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_fmt_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Plain dict of every metric, percentiles for histograms."""
+        with self._lock:
+            metrics = list(self._metrics.items())
+        return {name[len(self.prefix):]: m.snapshot() for name, m in metrics}
+
+
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    "stage_seconds", "Time spent in each pipeline stage (excluding queueing)"
+)
+
+
+# -----------------------------------------------------------
+# EXPORTERS
+# -----------------------------------------------------------
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = metrics
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def start_http_server(port, registry=metrics, host="0.0.0.0"):
+    """Serve /metrics in a daemon thread. Returns the server."""
+    handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Metrics endpoint on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def start_stats_dump(interval, registry=metrics):
+    """Log a JSON snapshot of every metric every `interval` seconds."""
+    def run():
+        while True:
+            time.sleep(interval)
+            logging.info("METRICS " + json.dumps(registry.snapshot(), default=str))
+
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+
+
+# -----------------------------------------------------------
+# SAMPLING PROFILER (slow messages)
+# -----------------------------------------------------------
+
+class SlowMessageProfiler:
+    """
+    Samples the stacks of worker threads every `interval` seconds while
+    enabled. When a message takes longer than `threshold`, report() logs
+    the hottest frames seen in worker threads during that message.
+    """
+
+    def __init__(self, threshold, interval=0.01, thread_prefix="pipeline",
+                 max_samples=50_000, top=15):
+        self.threshold = threshold
+        self.interval = interval
+        self.thread_prefix = thread_prefix
+        self.top = top
+        self._samples = deque(maxlen=max_samples)   # (ts, stack summary)
+        self._stop = threading.Event()
+        self._thread = None
+        self.reports = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="slow-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            now = time.monotonic()
+            for ident, frame in sys._current_frames().items():
+                if ident == own or not names.get(ident, "").startswith(self.thread_prefix):
+                    continue
+                stack = traceback.extract_stack(frame, limit=8)
+                # idle pool workers block inside _worker waiting for work
+                if stack and stack[-1].name != "_worker":
+                    self._samples.append((now, tuple(
+                        f"{f.filename.rsplit('/', 1)[-1]}:{f.lineno} {f.name}" for f in stack[-3:]
+                    )))
+
+    def report(self, label, started, elapsed):
+        """started is a time.monotonic() value; logs only above threshold."""
+        if elapsed < self.threshold:
+            return None
+        end = started + elapsed
+        tally = _Tally(s for ts, s in list(self._samples) if started <= ts <= end)
+        if not tally:
+            return None
+
+        total = sum(tally.values())
+        lines = [f"SLOW MESSAGE {label}: {elapsed:.2f}s, {total} samples"]
+        for stack, n in tally.most_common(self.top):
+            lines.append(f"  {100 * n / total:5.1f}%  " + " <- ".join(reversed(stack)))
+        logging.warning("\n".join(lines))
+        self.reports += 1
+        return lines
@@ -0,0 +1,383 @@
+import asyncio
+import email.utils
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from app.bedrock_gen import lookup_customer, compose_reply, intent_engine
+from app.email_utils import normalize_email
+from app.glpi_handler import customer_wants_close, process_ticketing
+from app.metrics import metrics, stage_seconds
+from app.scheduler import (
+    ACK_REPLY, PRIORITY_GENERAL, PriorityScheduler, classify_priority,
+    overload_acks_total,
+)
+
+# parse → lookup → generate → ticket → send
+# (fetching happens before the pipeline, as one batched UID FETCH)
+STAGES = ("parse", "lookup", "generate", "ticket", "send")
+
+message_seconds = metrics.histogram("message_seconds", "End-to-end time per message, lookup to send")
+messages_total = metrics.counter("messages_total", "Messages processed, by result")
+coalesced_total = metrics.counter(
+    "coalesced_messages_total", "Messages folded into an earlier request from the same sender"
+)
+
+DEFAULT_CONCURRENCY = {
+    "parse": 4,
+    "lookup": 4,
+    "generate": 4,
+    "ticket": 2,
+    "send": 2,
+}
+
+# Coalescing: same-sender messages dated within the window become one request
+DEFAULT_COALESCE_MAX = 5
+
+# Messages (per batch) allowed past the scheduler at once
+DEFAULT_MAX_IN_FLIGHT = 16
+
+
+# -------------------------------------------------------
+# MESSAGE STATE
+# -------------------------------------------------------
+@dataclass
+class PipelineMessage:
+    seq: int
+    message_id: object
+    msg: object = None
+    dedupe_key: str = None
+    from_addr: str = ""
+    subject: str = ""
+    date: float = None
+    body: str = ""
+    intents: list = None
+    ai_reply: str = None
+    ticket_id: object = None
+    final_reply: str = None
+    sent: bool = False
+    deferred: bool = False    # reply handed to the SMTP retry outbox, not delivered yet
+    skipped: bool = False
+    error: str = None
+    merged: list = None       # earlier messages folded into this one
+    priority: int = PRIORITY_GENERAL
+    queued_at: float = None
+    acked: bool = False
+
+    @property
+    def sender_key(self):
+        return normalize_email(self.from_addr) or self.from_addr.strip().lower()
+
+
+# -------------------------------------------------------
+# PIPELINE
+# -------------------------------------------------------
+class MailPipeline:
+    """
+    Staged, concurrent processing of one batch of unread emails.
+
+    Every stage has its own concurrency limit. Blocking calls (Bedrock,
+    GLPI, SMTP) run in a shared thread pool sized to the sum of limits.
+
+    Messages from different senders run in parallel; messages from the
+    same sender go through lookup → send strictly in arrival order, so
+    conversation history and ticket state stay consistent.
+
+    datasets.current must return the live DatasetSnapshot; each message
+    pins one snapshot for its whole run.
+
+    With coalesce_window > 0, a burst of messages from one sender (Date
+    headers within the window) is merged into a single request: one
+    model call, one ticket update and one reply to the newest message.
+    Every source message is still marked sent and journaled.
+
+    A PriorityScheduler admits at most max_in_flight messages at a time:
+    close confirmations first, then structured lookups, then free-form
+    questions, in arrival order within a class. When more than
+    overload_threshold messages are queued (0 = off), the ones ranked
+    past the threshold get an immediate acknowledgement and their full
+    answer follows when a slot frees up.
+
+    Stage timings, per-stage queue depth and per-message results go to
+    app.metrics; an optional SlowMessageProfiler reports slow messages.
+    """
+
+    def __init__(self, datasets, send, extract_body, concurrency=None, journal=None,
+                 profiler=None, coalesce_window=0, coalesce_max=DEFAULT_COALESCE_MAX,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, overload_threshold=0):
+        self.datasets = datasets
+        self.send = send
+        self.extract_body = extract_body
+        self.journal = journal
+        self.profiler = profiler
+        self.coalesce_window = coalesce_window
+        self.coalesce_max = max(1, coalesce_max)
+        self.max_in_flight = max_in_flight
+        self.overload_threshold = overload_threshold
+
+        self.concurrency = dict(DEFAULT_CONCURRENCY)
+        self.concurrency.update(concurrency or {})
+        for stage in STAGES:
+            self.concurrency[stage] = max(1, int(self.concurrency[stage]))
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=sum(self.concurrency.values()),
+            thread_name_prefix="pipeline",
+        )
+        self._limits = {}
+        self._waiting = {stage: 0 for stage in STAGES}
+        metrics.gauge("stage_waiting", lambda: dict(self._waiting),
+                      "Messages waiting for a stage slot", label="stage")
+
+        self._scheduler = PriorityScheduler(max_in_flight)
+        metrics.gauge(
+            "scheduler_queue",
+            lambda: {"waiting": self._scheduler.waiting(), "in_flight": self._scheduler.in_flight},
+            "Messages waiting for / holding a scheduler slot", label="state",
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    # ---------------------------------------------------
+    # Public entry point (sync)
+    # ---------------------------------------------------
+    def process_batch(self, messages):
+        """
+        Run one fetched batch through every stage.
+
+        messages: [(message_id, email.message.Message, dedupe_key)].
+        Messages whose dedupe_key is already in the journal are skipped.
+        Returns the list of PipelineMessage objects in arrival order.
+        """
+        if not messages:
+            return []
+        return asyncio.run(self._run_batch(list(messages)))
+
+    # ---------------------------------------------------
+    # Internals
+    # ---------------------------------------------------
+    async def _run_stage(self, stage, fn, *args):
+        self._waiting[stage] += 1
+        try:
+            await self._limits[stage].acquire()
+        finally:
+            self._waiting[stage] -= 1
+        try:
+            with stage_seconds.time(stage=stage):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._limits[stage].release()
+
+    async def _run_batch(self, messages):
+        self._limits = {s: asyncio.Semaphore(n) for s, n in self.concurrency.items()}
+
+        items = [
+            PipelineMessage(seq=i, message_id=mid, msg=msg, dedupe_key=key)
+            for i, (mid, msg, key) in enumerate(messages)
+        ]
+
+        # parsing is order-independent
+        await asyncio.gather(*(self._parse_stage(item) for item in items))
+
+        # classify the whole batch once; intents travel with the message
+        parsed = [i for i in items if not (i.error or i.skipped)]
+        for item, intents in zip(parsed, intent_engine.classify_batch([i.body for i in parsed])):
+            item.intents = intents
+
+        # group by sender, keeping arrival order inside each group
+        by_sender = {}
+        for item in items:
+            if item.error or item.skipped:
+                continue
+            by_sender.setdefault(item.sender_key, []).append(item)
+
+        if self.coalesce_window > 0:
+            by_sender = {k: self._coalesce(g) for k, g in by_sender.items()}
+
+        self._scheduler = PriorityScheduler(self.max_in_flight)
+        units = [item for group in by_sender.values() for item in group]
+        queued_at = time.monotonic()
+        for item in units:
+            item.priority = classify_priority(item.body, item.intents)
+            item.queued_at = queued_at
+
+        deferred = []
+        if self.overload_threshold and len(units) > self.overload_threshold:
+            ranked = sorted(units, key=lambda i: (i.priority, i.seq))
+            deferred = ranked[self.overload_threshold:]
+            logging.warning(
+                f"Overload: {len(units)} queued (threshold {self.overload_threshold}); "
+                f"acknowledging {len(deferred)} now"
+            )
+
+        await asyncio.gather(
+            self._acknowledge(deferred),
+            *(self._run_sender(group) for group in by_sender.values()),
+        )
+
+        return items
+
+    async def _parse_stage(self, item):
+        if self.journal and item.dedupe_key and self.journal.seen(item.dedupe_key):
+            item.skipped = True
+            messages_total.inc(result="skipped")
+            logging.info(f"Skipping already answered message {item.dedupe_key}")
+            return
+        try:
+            await self._run_stage("parse", self._parse, item)
+        except Exception as e:
+            item.error = str(e)
+            messages_total.inc(result="failed")
+            logging.error(f"PIPELINE parse error for {item.message_id}: {e}")
+
+    def _parse(self, item):
+        msg = item.msg
+        item.from_addr = email.utils.parseaddr(msg["From"])[1]
+        item.subject = msg.get("Subject", "")
+        item.body = self.extract_body(msg)
+        try:
+            item.date = email.utils.parsedate_to_datetime(msg["Date"]).timestamp()
+        except (TypeError, ValueError):
+            item.date = None
+
+    # ---------------------------------------------------
+    # Coalescing
+    # ---------------------------------------------------
+    def _coalesce(self, group):
+        """
+        Split one sender's messages (arrival order) into runs and merge
+        each run into its newest message. A close request always stands
+        alone, so "issue resolved" never closes a ticket a newer question
+        in the same burst still needs.
+        """
+        runs = []
+        run_start = None
+        open_run = False   # may the next message join runs[-1]?
+        for item in group:
+            closing = customer_wants_close(item.body)
+            # undated messages join the current run
+            date = item.date if item.date is not None else run_start
+            if (
+                open_run
+                and not closing
+                and len(runs[-1]) < self.coalesce_max
+                and (date is None or run_start is None or date - run_start <= self.coalesce_window)
+            ):
+                runs[-1].append(item)
+            else:
+                runs.append([item])
+                run_start = date
+            open_run = not closing
+        return [self._merge(run) if len(run) > 1 else run[0] for run in runs]
+
+    def _merge(self, run):
+        lead = run[-1]
+        lead.merged = run[:-1]
+        lead.body = "\n\n".join(
+            f"[Message {n} of {len(run)}" + (f": {m.subject}]" if m.subject else "]") + f"\n{m.body}"
+            for n, m in enumerate(run, 1)
+        )
+
+        intents = []
+        for m in run:
+            intents.extend(i for i in (m.intents or []) if i not in intents)
+        if len(intents) > 1 and intent_engine.fallback in intents:
+            intents.remove(intent_engine.fallback)
+        lead.intents = intents
+
+        coalesced_total.inc(len(lead.merged))
+        logging.info(f"Coalesced {len(run)} messages from {lead.from_addr} into one request")
+        return lead
+
+    # ---------------------------------------------------
+    # Overload acknowledgements
+    # ---------------------------------------------------
+    async def _acknowledge(self, deferred):
+        """One "we've received your request" mail per deferred sender."""
+        acked = set()
+        for item in deferred:
+            ack_key = f"{item.dedupe_key}:ack" if item.dedupe_key else None
+            if item.sender_key in acked or (self.journal and ack_key and self.journal.seen(ack_key)):
+                continue
+            acked.add(item.sender_key)
+            try:
+                await self._run_stage("send", self.send, item.from_addr, ACK_REPLY, item.msg)
+            except Exception as e:
+                logging.error(f"ACK SEND ERROR for {item.from_addr}: {e}")
+                continue
+            item.acked = True
+            overload_acks_total.inc()
+            if self.journal and ack_key:
+                self.journal.record(ack_key)
+
+    async def _run_sender(self, group):
+        for item in group:
+            await self._scheduler.admit(item.priority, item.queued_at)
+            started = time.monotonic()
+            try:
+                await self._process_message(item)
+                messages_total.inc(result="deferred" if item.deferred else "sent")
+                if item.merged:
+                    messages_total.inc(len(item.merged), result="coalesced")
+            except Exception as e:
+                item.error = str(e)
+                for m in item.merged or ():
+                    m.error = item.error
+                messages_total.inc(1 + len(item.merged or ()), result="failed")
+                logging.error(f"PIPELINE error for {item.from_addr}: {e}")
+            finally:
+                self._scheduler.release()
+
+            elapsed = time.monotonic() - started
+            message_seconds.observe(elapsed)
+            if self.profiler:
+                self.profiler.report(f"{item.message_id} from {item.from_addr}", started, elapsed)
+
+    async def _process_message(self, item):
+        logging.info(f"Received email from {item.from_addr}")
+
+        snapshot = self.datasets.current
+        customer, loans, fallback = await self._run_stage(
+            "lookup", lookup_customer, item.from_addr, snapshot.customer_index, snapshot.loan_store
+        )
+
+        if customer_wants_close(item.body):
+            # process_ticketing answers a close request itself: no model call
+            item.ai_reply = None
+        elif fallback:
+            item.ai_reply = fallback
+        else:
+            item.ai_reply = await self._run_stage(
+                "generate", compose_reply, item.from_addr, item.body, customer, loans, item.intents
+            )
+
+        item.ticket_id, item.final_reply = await self._run_stage("ticket", self._ticket, item)
+
+        delivered = await self._run_stage("send", self.send, item.from_addr, item.final_reply, item.msg)
+        # send() returns False once the reply is in the sender's persistent
+        # retry outbox: it is answered either way, so don't generate it twice
+        item.sent = True
+        item.deferred = delivered is False
+        for m in item.merged or ():
+            m.sent, m.deferred = True, item.deferred
+            m.ticket_id, m.final_reply = item.ticket_id, item.final_reply
+
+        if self.journal:
+            for m in [item, *(item.merged or ())]:
+                if m.dedupe_key:
+                    self.journal.record(m.dedupe_key)
+        if item.deferred:
+            logging.warning(f"Reply to {item.from_addr} deferred to the SMTP outbox (ticket={item.ticket_id})")
+        else:
+            logging.info(f"Sent reply to {item.from_addr} (ticket={item.ticket_id})")
+
+    def _ticket(self, item):
+        return process_ticketing(
+            from_email=item.from_addr,
+            user_message=item.body,
+            ai_reply=item.ai_reply,
+            intents=item.intents,
+        )
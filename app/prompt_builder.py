@@ -0,0 +1,166 @@
+import math
+import threading
+from dataclasses import dataclass
+
+from app.bedrock_invoker import estimate_tokens
+
+DEFAULT_TOKEN_BUDGET = 1200
+# Share of the budget a single customer message may use before truncation
+MESSAGE_SHARE = 0.5
+
+# Static instructions: identical on every call, sent as the system prompt
+SYSTEM_PROMPT = """You are a professional banking support AI. Replies must be factual, courteous, and based only on the loan data provided.
+
+Rules:
+- Answer in banking tone.
+- Address every detected intent clearly.
+- Use bullet points if multiple intents.
+- Do NOT invent any data.
+- Maintain conversation continuity using history.
+- Keep reply concise.
+- End with:
+
+Regards,
+Bank Support Team
+
+Return ONLY the email body."""
+
+# Fee columns that identify the row rather than describe a charge
+_FEE_ID_COLUMNS = {"loan_id", "customer_id"}
+
+
+@dataclass
+class BuiltPrompt:
+    system: str
+    user: str
+    est_tokens: int
+    history_used: int
+    history_dropped: int
+    message_truncated: bool
+
+
+# -----------------------------------------------------------
+# COMPACT ENCODERS
+# -----------------------------------------------------------
+
+def _value(v):
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return "n/a"
+    if hasattr(v, "strftime"):
+        return v.strftime("%Y-%m-%d")
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def encode_loans(loans):
+    """One line per loan plus one line of non-empty fees."""
+    lines = []
+    for loan in loans:
+        lines.append(
+            f"loan {_value(loan['loan_id'])}: due={_value(loan['emi_due_date'])}; "
+            f"emi={_value(loan['emi_amount'])}; status={_value(loan['emi_status'])}; "
+            f"last_paid={_value(loan['last_payment_date'])}"
+        )
+        fees = [
+            f"{k}={_value(v)}"
+            for k, v in (loan.get("fees") or {}).items()
+            if k not in _FEE_ID_COLUMNS
+        ]
+        lines.append("  fees: " + ("; ".join(fees) if fees else "none"))
+    return "\n".join(lines)
+
+
+def _truncate(text, max_tokens):
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text, False
+    return text[:max_chars].rstrip() + " …[truncated]", True
+
+
+# -----------------------------------------------------------
+# PROMPT BUILDER
+# -----------------------------------------------------------
+
+class PromptBuilder:
+    """
+    Builds (system, user) prompts under an input-token budget.
+
+    Fixed parts (system prompt, customer, loans, intents) always go in;
+    the customer message is capped at MESSAGE_SHARE of the budget and
+    history is added newest-first until the budget is spent.
+    """
+
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.system_tokens = estimate_tokens(SYSTEM_PROMPT)
+
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total_tokens = 0
+        self._max_tokens = 0
+        self._history_dropped = 0
+        self._messages_truncated = 0
+
+    def build(self, customer, loans, user_message, intents, history):
+        header = (
+            f"Customer: {customer['name']} <{customer['email']}>\n"
+            f"Loans:\n{encode_loans(loans)}\n"
+            f"Intents: {', '.join(intents)}\n"
+        )
+
+        used = self.system_tokens + estimate_tokens(header)
+
+        message, truncated = _truncate(
+            user_message or "", max(1, int(self.token_budget * MESSAGE_SHARE))
+        )
+        used += estimate_tokens(message)
+
+        # newest history first, as long as it fits
+        kept = []
+        for h in reversed(history):
+            line = f"{h['role'][0].upper()}: {h['text']}"
+            cost = estimate_tokens(line)
+            if used + cost > self.token_budget:
+                break
+            kept.append(line)
+            used += cost
+        kept.reverse()
+
+        user = header
+        if kept:
+            user += "History:\n" + "\n".join(kept) + "\n"
+        user += f'Message:\n"""{message}"""'
+
+        prompt = BuiltPrompt(
+            system=SYSTEM_PROMPT,
+            user=user,
+            est_tokens=self.system_tokens + estimate_tokens(user),
+            history_used=len(kept),
+            history_dropped=len(history) - len(kept),
+            message_truncated=truncated,
+        )
+        self._record(prompt)
+        return prompt
+
+    # -------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------
+
+    def _record(self, prompt):
+        with self._lock:
+            self._count += 1
+            self._total_tokens += prompt.est_tokens
+            self._max_tokens = max(self._max_tokens, prompt.est_tokens)
+            self._history_dropped += prompt.history_dropped
+            self._messages_truncated += int(prompt.message_truncated)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "prompts": self._count,
+                "est_input_tokens_avg": round(self._total_tokens / self._count, 1) if self._count else 0,
+                "est_input_tokens_max": self._max_tokens,
+                "history_entries_dropped": self._history_dropped,
+                "messages_truncated": self._messages_truncated,
+            }
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from app.reply_templates import STRUCTURED_INTENTS
+
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_TTL = 3600
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Write the on-disk copy after this many new entries
+SAVE_EVERY = 50
+
+# Fixed per-entry overhead estimate (tuple, floats, OrderedDict node)
+_ENTRY_OVERHEAD = 200
+
+
+# -----------------------------------------------------------
+# KEY HELPERS
+# -----------------------------------------------------------
+
+def _digest(obj):
+    raw = json.dumps(obj, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def normalize_message(message):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    text = re.sub(r"\s+", " ", (message or "").lower()).strip()
+    return text.rstrip(" ?!.")
+
+
+def loan_data_hash(loans):
+    """Fingerprint of every loan + fee value the prompt can see."""
+    return _digest([loan.to_dict() for loan in loans])
+
+
+def cacheable(intents):
+    """
+    Only purely structured requests are cached: their answer depends on
+    the loan data, not on the conversation. Anything else would need the
+    history in its key, and the history changes with every reply, so
+    those entries could never be hit again.
+    """
+    return bool(intents) and all(i in STRUCTURED_INTENTS for i in intents)
+
+
+# -----------------------------------------------------------
+# REPLY CACHE
+# -----------------------------------------------------------
+
+class ReplyCache:
+    """
+    LRU + TTL cache of Bedrock replies.
+
+    Holds cacheable() requests only. The key covers what shapes their
+    answer: customer, normalized message, intents and the loan/fee data
+    hash; the history is left out on purpose. Entries remember their
+    customer_id and data hash so a dataset reload can drop exactly the
+    entries whose loan data changed.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 max_bytes=DEFAULT_MAX_BYTES, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.path = path
+
+        # key → (reply, customer_id, data_hash, expires_at, size)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._unsaved = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        if path:
+            self._load()
+
+    @staticmethod
+    def make_key(customer, user_message, intents, loans):
+        """Return (key, data_hash)."""
+        data_hash = loan_data_hash(loans)
+        key = _digest([
+            customer.get("customer_id"),
+            customer.get("name"),
+            normalize_message(user_message),
+            sorted(intents),
+            data_hash,
+        ])
+        return key, data_hash
+
+    # -------------------------------------------------------
+    # Get / put
+    # -------------------------------------------------------
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[3] < time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, reply, customer_id, data_hash):
+        size = sys.getsizeof(reply) + sys.getsizeof(key) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (reply, customer_id, data_hash, time.time() + self.ttl, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+            self._unsaved += 1
+            save_now = self.path and self._unsaved >= SAVE_EVERY
+
+        if save_now:
+            self.save()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[4]
+
+    # -------------------------------------------------------
+    # Invalidation
+    # -------------------------------------------------------
+
+    def invalidate_stale(self, loan_store):
+        """Drop entries whose customer's loan/fee data no longer matches."""
+        with self._lock:
+            items = list(self._entries.items())
+
+        current = {}
+        stale = []
+        for key, (_, customer_id, data_hash, _, _) in items:
+            if customer_id not in current:
+                current[customer_id] = loan_data_hash(loan_store.lookup(customer_id))
+            if current[customer_id] != data_hash:
+                stale.append(key)
+
+        with self._lock:
+            for key in stale:
+                if key in self._entries:
+                    self._remove(key)
+            self.invalidations += len(stale)
+
+        if stale:
+            logging.info(f"ReplyCache: invalidated {len(stale)} stale entries")
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # -------------------------------------------------------
+    # Persistence
+    # -------------------------------------------------------
+
+    def save(self):
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            rows = [[k, *v[:4]] for k, v in self._entries.items() if v[3] > now]
+            self._unsaved = 0
+
+        tmp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(rows, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.error(f"ReplyCache save failed: {e}")
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                rows = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error(f"ReplyCache load failed: {e}")
+            return
+
+        now = time.time()
+        for key, reply, customer_id, data_hash, expires_at in rows:
+            if expires_at <= now:
+                continue
+            size = sys.getsizeof(reply) + sys.getsizeof(key) + _ENTRY_OVERHEAD
+            self._entries[key] = (reply, customer_id, data_hash, expires_at, size)
+            self._bytes += size
+
+        logging.info(f"ReplyCache: loaded {len(self._entries)} entries from disk")
+
+    # -------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
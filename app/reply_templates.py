@@ -0,0 +1,166 @@
+import math
+import re
+import threading
+
+from app.metrics import metrics
+
+# Intents answerable straight from the loan/fee record
+STRUCTURED_INTENTS = ("emi_due_date", "emi_amount", "emi_status", "fee_details")
+
+# Longer messages usually carry context the template would ignore
+MAX_WORDS = 40
+
+# Words that signal a dispute, request or nuance → let the model answer
+AMBIGUOUS_MARKERS = re.compile(
+    r"\b(why|wrong|incorrect|dispute|complain\w*|refund|waive\w*|reverse|"
+    r"mistake|error|not|never|didn'?t|haven'?t|but|however|change|update|"
+    r"reduce|extend|restructur\w*|foreclos\w*|close)\b"
+)
+
+# Fee columns that are identifiers, not charges
+FEE_ID_COLUMNS = {"loan_id", "customer_id"}
+
+SIGN_OFF = "Regards,\nBank Support Team"
+
+fast_path_total = metrics.counter("fast_path_total", "Fast-path decisions, by intent and result")
+
+
+# -----------------------------------------------------------
+# VALUE FORMATTING
+# -----------------------------------------------------------
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value)) or value == ""
+
+
+def _fmt(value):
+    if hasattr(value, "strftime"):
+        return value.strftime("%d %b %Y")
+    if isinstance(value, float) and value.is_integer():
+        return f"{int(value):,}"
+    if isinstance(value, (int, float)):
+        return f"{value:,}"
+    return str(value)
+
+
+def _label(column):
+    return column.replace("_", " ").strip().capitalize()
+
+
+# -----------------------------------------------------------
+# FAST PATH ENGINE
+# -----------------------------------------------------------
+
+class TemplateFastPath:
+    """
+    Answers purely structured intent combinations locally.
+
+    render() returns None whenever the confidence gate fails, and the
+    caller falls back to Bedrock. Counters track fast-path hits and
+    fallbacks per intent, exported as fast_path_total.
+    """
+
+    def __init__(self, max_words=MAX_WORDS):
+        self.max_words = max_words
+        self._lock = threading.Lock()
+        self.hits = {i: 0 for i in STRUCTURED_INTENTS}
+        self.fallbacks = {}
+
+    # -------------------------------------------------------
+    # Confidence gate
+    # -------------------------------------------------------
+
+    def _confident(self, loans, user_message, intents):
+        if not intents or any(i not in STRUCTURED_INTENTS for i in intents):
+            return False
+
+        text = (user_message or "").lower()
+        if len(text.split()) > self.max_words or AMBIGUOUS_MARKERS.search(text):
+            return False
+
+        fields = {
+            "emi_due_date": "emi_due_date",
+            "emi_amount": "emi_amount",
+            "emi_status": "emi_status",
+        }
+        for loan in loans:
+            for intent in intents:
+                if intent in fields and _missing(loan[fields[intent]]):
+                    return False
+                if intent == "fee_details" and not loan.get("fees"):
+                    return False
+        return True
+
+    # -------------------------------------------------------
+    # Rendering
+    # -------------------------------------------------------
+
+    def _loan_lines(self, loan, intents):
+        lines = []
+        if "emi_due_date" in intents:
+            lines.append(f"- Next EMI due date: {_fmt(loan['emi_due_date'])}")
+        if "emi_amount" in intents:
+            lines.append(f"- EMI amount: {_fmt(loan['emi_amount'])}")
+        if "emi_status" in intents:
+            status = f"- EMI status: {_fmt(loan['emi_status'])}"
+            if not _missing(loan["last_payment_date"]):
+                status += f" (last payment on {_fmt(loan['last_payment_date'])})"
+            lines.append(status)
+        if "fee_details" in intents:
+            fees = [
+                f"{_label(k)}: {_fmt(v)}"
+                for k, v in loan["fees"].items()
+                if k not in FEE_ID_COLUMNS and not _missing(v)
+            ]
+            lines.append("- Fees: " + ("; ".join(fees) if fees else "none applicable"))
+        return lines
+
+    def render(self, customer, loans, user_message, intents):
+        """Return a complete reply, or None to fall back to the model."""
+        if not self._confident(loans, user_message, intents):
+            self._count(self.fallbacks, intents, "fallback")
+            return None
+
+        parts = [f"Dear {customer['name']},", "", "Thank you for contacting us."]
+
+        if len(loans) == 1:
+            parts.append(f"Here are the details for your loan {loans[0]['loan_id']}:")
+            parts.append("")
+            parts.extend(self._loan_lines(loans[0], intents))
+        else:
+            parts.append("Here are the details for your loans:")
+            for loan in loans:
+                parts.append("")
+                parts.append(f"Loan {loan['loan_id']}:")
+                parts.extend(self._loan_lines(loan, intents))
+
+        parts += ["", "Please let us know if you need anything else.", "", SIGN_OFF]
+
+        self._count(self.hits, intents, "fast_path")
+        return "\n".join(parts)
+
+    # -------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------
+
+    def _count(self, counter, intents, result):
+        with self._lock:
+            for intent in intents:
+                counter[intent] = counter.get(intent, 0) + 1
+        for intent in intents:
+            fast_path_total.inc(intent=intent, result=result)
+
+    def stats(self):
+        """Per-intent fast-path hits, fallbacks and hit rate."""
+        with self._lock:
+            intents = set(self.hits) | set(self.fallbacks)
+            out = {}
+            for intent in sorted(intents):
+                hits = self.hits.get(intent, 0)
+                total = hits + self.fallbacks.get(intent, 0)
+                out[intent] = {
+                    "fast_path": hits,
+                    "fallback": self.fallbacks.get(intent, 0),
+                    "hit_rate": round(hits / total, 3) if total else 0.0,
+                }
+            return out
@@ -1,38 +1,349 @@
 import boto3
+import openpyxl
 import pandas as pd
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+import hashlib
+import json
 import logging
 import os
+import resource
+import threading
+import time
 
-# S3 bucket and file paths
+from app.customer_index import ALIAS_COLUMNS
+from app.loan_store import LoanRecord
+
+# S3 bucket and file paths (.xlsx, .csv or .parquet)
 BUCKET = "banking-ai-datasets"
-CUSTOMERS_KEY = "datasets/customers.xlsx"
-FEES_KEY = "datasets/fees.xlsx"
-LOANS_KEY = "datasets/loans.xlsx"
+CUSTOMERS_KEY = os.getenv("CUSTOMERS_KEY", "datasets/customers.xlsx")
+FEES_KEY = os.getenv("FEES_KEY", "datasets/fees.xlsx")
+LOANS_KEY = os.getenv("LOANS_KEY", "datasets/loans.xlsx")
+
+DATASET_KEYS = {
+    "customers": CUSTOMERS_KEY,
+    "fees": FEES_KEY,
+    "loans": LOANS_KEY,
+}
+
+# Local columnar snapshots (Feather / Arrow IPC), one per key + ETag
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.getenv("STATE_DIR", "state"), "snapshots"))
+# Read datasets from a local directory instead of S3 (tests / offline runs)
+DATASET_DIR = os.getenv("DATASET_DIR")
+
+# Columns the bot reads from each sheet, with a compact dtype per column.
+# Sheets listed in KEEP_ALL_COLUMNS keep their other columns too (every
+# fee column is shown to the model); elsewhere unlisted columns are dropped.
+DATASET_SCHEMAS = {
+    "customers": {
+        "customer_id": "id",
+        "name": "text",
+        "email": "text",
+        **{col: "text" for col in ALIAS_COLUMNS},
+    },
+    "loans": {
+        "loan_id": "id",
+        "customer_id": "id",
+        "emi_due_date": "date",
+        "emi_amount": "number",
+        "emi_status": "category",
+        "last_payment_date": "date",
+    },
+    "fees": {
+        "loan_id": "id",
+        "customer_id": "id",
+    },
+}
+KEEP_ALL_COLUMNS = {"fees"}
+XLSX_CHUNK_ROWS = 20_000
+
+# Bump when DATASET_SCHEMAS changes so old snapshots are not reused
+SCHEMA_VERSION = 2
+
+assert set(LoanRecord.FIELDS) <= set(DATASET_SCHEMAS["loans"])
+
+
+# -----------------------------------------------------------
+# DATASET SOURCES
+# -----------------------------------------------------------
+
+class S3Source:
+    """Datasets stored as objects in an S3 bucket."""
+
+    def __init__(self, bucket=BUCKET, client=None):
+        self.bucket = bucket
+        self.s3 = client or boto3.client("s3")
+
+    def head(self, key):
+        return self.s3.head_object(Bucket=self.bucket, Key=key)["ETag"].strip('"')
+
+    def fetch(self, key, if_none_match=None):
+        """
+        Conditional GET. Returns (etag, bytes), or (etag, None) when the
+        object still matches if_none_match.
+        """
+        kwargs = {"Bucket": self.bucket, "Key": key}
+        if if_none_match:
+            kwargs["IfNoneMatch"] = f'"{if_none_match}"'
+        try:
+            obj = self.s3.get_object(**kwargs)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            if code in ("304", "NotModified") or status == 304:
+                return if_none_match, None
+            raise
+        return obj["ETag"].strip('"'), obj["Body"].read()
+
+
+class LocalSource:
+    """Datasets stored as files under a directory (S3 keys map to paths)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def head(self, key):
+        st = os.stat(self._path(key))
+        return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+    def fetch(self, key, if_none_match=None):
+        etag = self.head(key)
+        if etag == if_none_match:
+            return etag, None
+        with open(self._path(key), "rb") as f:
+            return etag, f.read()
+
+
+def default_source():
+    return LocalSource(DATASET_DIR) if DATASET_DIR else S3Source(BUCKET)
+
+
+# -----------------------------------------------------------
+# SNAPSHOT CACHE
+# -----------------------------------------------------------
+
+class SnapshotCache:
+    """
+    Feather snapshots of parsed sheets, named by key and ETag.
+
+    index.json remembers the last ETag per key, so a warm start is one
+    conditional request per sheet plus a memory-mapped Feather read.
+    """
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(root, "index.json")
+        try:
+            with open(self._index_path) as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.index = {}
+
+    def path(self, key, etag):
+        name = key.replace("/", "_").rsplit(".", 1)[0]
+        digest = hashlib.sha1(f"{etag}:{SCHEMA_VERSION}".encode()).hexdigest()[:16]
+        return os.path.join(self.root, f"{name}-{digest}.feather")
+
+    def last_etag(self, key):
+        etag = self.index.get(key)
+        return etag if etag and os.path.exists(self.path(key, etag)) else None
+
+    def read(self, key, etag):
+        # uncompressed Arrow IPC → memory-mapped, near zero-copy read
+        return feather.read_table(self.path(key, etag), memory_map=True).to_pandas()
+
+    def write(self, key, etag, df):
+        path = self.path(key, etag)
+        tmp = path + ".tmp"
+        try:
+            df.reset_index(drop=True).to_feather(tmp, compression="uncompressed")
+            os.replace(tmp, path)
+        except Exception as e:
+            # odd mixed-type columns: keep working, just without a snapshot
+            logging.warning(f"Snapshot write skipped for {key}: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        with self._lock:
+            old = self.index.get(key)
+            self.index[key] = etag
+            self._save_index()
+        if old and old != etag and os.path.exists(self.path(key, old)):
+            os.remove(self.path(key, old))
+
+    def _save_index(self):
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self._index_path)
 
 
-def load_excel_from_s3(bucket, key):
-    """Load and return an Excel file from S3 as a pandas DataFrame."""
+# -----------------------------------------------------------
+# PARSERS
+# -----------------------------------------------------------
+
+def _wanted(name, columns):
+    schema = DATASET_SCHEMAS.get(name, {})
+    if name in KEEP_ALL_COLUMNS or not schema:
+        return [c for c in columns if c is not None]
+    return [c for c in columns if c in schema]
+
+
+def _read_xlsx(name, data):
+    """Stream the first sheet in read-only mode, keeping wanted columns only."""
+    wb = openpyxl.load_workbook(BytesIO(data), read_only=True, data_only=True)
     try:
-        s3 = boto3.client("s3")
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        data = obj["Body"].read()
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [str(c).strip() if c is not None else None for c in next(rows, ())]
+        wanted = set(_wanted(name, header))
+        keep = [(i, c) for i, c in enumerate(header) if c in wanted]
+
+        # build frames in chunks so Python row objects never pile up
+        chunks, pending = [], []
+        for row in rows:
+            values = tuple(row[i] if i < len(row) else None for i, _ in keep)
+            if all(v is None for v in values):
+                continue
+            pending.append(values)
+            if len(pending) >= XLSX_CHUNK_ROWS:
+                chunks.append(pd.DataFrame.from_records(pending, columns=[c for _, c in keep]))
+                pending = []
+        chunks.append(pd.DataFrame.from_records(pending, columns=[c for _, c in keep]))
+    finally:
+        wb.close()
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+
+def _read_csv(name, data):
+    header = pd.read_csv(BytesIO(data), nrows=0).columns
+    return pd.read_csv(BytesIO(data), usecols=_wanted(name, header))
+
+
+def _read_parquet(name, data):
+    names = pq.ParquetFile(BytesIO(data)).schema_arrow.names
+    return pd.read_parquet(BytesIO(data), columns=_wanted(name, names))
+
+
+READERS = {
+    ".xlsx": _read_xlsx,
+    ".xlsm": _read_xlsx,
+    ".csv": _read_csv,
+    ".parquet": _read_parquet,
+    ".pq": _read_parquet,
+}
+
+
+def _lossless(series, converted):
+    """True when conversion turned no existing value into NaN/NaT."""
+    return converted.notna().sum() == series.notna().sum()
+
+
+def _as_int(converted):
+    """int32 when every value is a whole number that fits, else unchanged."""
+    if converted.isna().any() or not (converted % 1 == 0).all():
+        return converted
+    if converted.empty or (converted.min() >= -2**31 and converted.max() < 2**31):
+        return converted.astype("int32")
+    return converted.astype("int64")
+
+
+def _coerce(series, kind):
+    """Compact dtype for one column; anything that doesn't convert cleanly stays as is."""
+    if kind in ("id", "number"):
+        converted = pd.to_numeric(series, errors="coerce")
+        return _as_int(converted) if _lossless(series, converted) else series
+    if kind == "date":
+        converted = pd.to_datetime(series, errors="coerce")
+        return converted if _lossless(series, converted) else series
+    if kind == "category":
+        return series.astype("category")
+    return series
 
-        return pd.read_excel(BytesIO(data))
+
+def parse_dataset(name, key, data):
+    """Bytes → DataFrame with only the used columns, in compact dtypes."""
+    ext = os.path.splitext(key)[1].lower()
+    reader = READERS.get(ext)
+    if reader is None:
+        raise ValueError(f"Unsupported dataset format: {key}")
+
+    df = reader(name, data)
+    for column, kind in DATASET_SCHEMAS.get(name, {}).items():
+        if column in df.columns:
+            df[column] = _coerce(df[column], kind)
+    return df
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+# -----------------------------------------------------------
+# LOADERS
+# -----------------------------------------------------------
+
+def load_dataset(source, key, cache, name=None):
+    """Return (DataFrame, etag), using the local snapshot when unchanged."""
+    try:
+        started = time.perf_counter()
+        etag, data = source.fetch(key, if_none_match=cache.last_etag(key))
+
+        if data is None:
+            df = cache.read(key, etag)
+            logging.info(f"{key}: snapshot hit ({time.perf_counter() - started:.3f}s)")
+            return df, etag
+
+        df = parse_dataset(name, key, data)
+        del data
+        cache.write(key, etag, df)
+        logging.info(f"{key}: parsed and snapshotted ({time.perf_counter() - started:.3f}s)")
+        return df, etag
 
     except Exception as e:
         logging.error(f"S3 LOAD ERROR for {key}: {e}")
         raise
 
 
-def load_all_datasets():
+def load_datasets(source=None, cache=None):
+    """Load every dataset. Returns ({name: DataFrame}, {name: etag})."""
+    source = source or default_source()
+    cache = cache or SnapshotCache()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(DATASET_KEYS)) as pool:
+        futures = {
+            name: pool.submit(load_dataset, source, key, cache, name)
+            for name, key in DATASET_KEYS.items()
+        }
+        results = {name: f.result() for name, f in futures.items()}
+
+    frames = {name: df for name, (df, _) in results.items()}
+    etags = {name: etag for name, (_, etag) in results.items()}
+
+    frame_mb = sum(df.memory_usage(deep=True).sum() for df in frames.values()) / 2**20
+    logging.info(
+        f"Datasets loaded in {time.perf_counter() - started:.3f}s "
+        f"(frames {frame_mb:.1f} MB, peak RSS {_peak_rss_mb()} MB)"
+    )
+    return frames, etags
+
+
+def load_all_datasets(source=None):
     """Load customers, fees, and loans from S3 bucket."""
     logging.info("Loading datasets from S3...")
 
-    customers = load_excel_from_s3(BUCKET, CUSTOMERS_KEY)
-    fees = load_excel_from_s3(BUCKET, FEES_KEY)
-    loans = load_excel_from_s3(BUCKET, LOANS_KEY)
+    frames, _ = load_datasets(source)
 
     logging.info("All datasets loaded successfully.")
 
-    return customers, fees, loans
+    return frames["customers"], frames["fees"], frames["loans"]
@@ -0,0 +1,84 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from app.glpi_handler import customer_wants_close
+from app.metrics import metrics
+from app.reply_templates import STRUCTURED_INTENTS
+
+# Priority classes (lower runs first)
+PRIORITY_CLOSE = 0        # close confirmations: no model call, frees a ticket
+PRIORITY_STRUCTURED = 1   # EMI / fee lookups the template fast path can answer
+PRIORITY_GENERAL = 2      # free-form questions that need Bedrock
+PRIORITY_NAMES = {PRIORITY_CLOSE: "close", PRIORITY_STRUCTURED: "structured", PRIORITY_GENERAL: "general"}
+
+ACK_REPLY = (
+    "Dear Customer,\n\n"
+    "We've received your request and are working on it. Because of high "
+    "volume, our full reply will follow shortly; there is no need to "
+    "write again.\n\n"
+    "Regards,\nBank Support Team"
+)
+
+schedule_wait_seconds = metrics.histogram(
+    "schedule_wait_seconds", "Time from fetch to admission, by priority"
+)
+admitted_total = metrics.counter("scheduler_admitted_total", "Messages admitted, by priority")
+overload_acks_total = metrics.counter(
+    "overload_acks_total", "Acknowledgements sent because the queue was over its threshold"
+)
+
+
+def classify_priority(body, intents):
+    if customer_wants_close(body or ""):
+        return PRIORITY_CLOSE
+    if intents and all(i in STRUCTURED_INTENTS for i in intents):
+        return PRIORITY_STRUCTURED
+    return PRIORITY_GENERAL
+
+
+# -----------------------------------------------------------
+# PRIORITY SCHEDULER
+# -----------------------------------------------------------
+
+class PriorityScheduler:
+    """
+    Bounded admission for one event loop: at most `max_in_flight`
+    messages are being processed; the rest wait in a heap ordered by
+    priority class, first come first served within a class. It lives
+    for one fetched batch, which bounds how long a low-priority message
+    can be passed over.
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.in_flight = 0
+        self._heap = []   # (priority, seq, future)
+        self._seq = itertools.count()
+
+    def waiting(self):
+        return len(self._heap)
+
+    async def admit(self, priority, queued_at=None):
+        """Wait for a slot. queued_at (time.monotonic() at fetch) feeds the wait metric."""
+        queued_at = queued_at if queued_at is not None else time.monotonic()
+        if self.in_flight < self.max_in_flight and not self._heap:
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._heap, (priority, next(self._seq), future))
+            await future   # release() hands over its slot
+
+        admitted_total.inc(priority=PRIORITY_NAMES.get(priority, priority))
+        schedule_wait_seconds.observe(
+            time.monotonic() - queued_at, priority=PRIORITY_NAMES.get(priority, priority)
+        )
+
+    def release(self):
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_result(None)   # slot passes straight to the waiter
+                return
+        self.in_flight -= 1
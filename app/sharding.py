@@ -0,0 +1,642 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import feather
+
+from app import bedrock_gen
+from app.bedrock_gen import history_store, reply_cache
+from app.customer_index import ALIAS_COLUMNS, canonical_email
+from app.dataset_refresher import DatasetSnapshot, reload_failures, reload_seconds
+from app.email_utils import extract_email_body, normalize_email
+from app.glpi_client import glpi
+from app.glpi_handler import ticket_queue, ticket_states
+from app.message_journal import MessageJournal
+from app.metrics import metrics, start_http_server
+from app.pipeline import MailPipeline
+from app.s3_loader import DATASET_KEYS, SNAPSHOT_DIR
+from app.smtp_sender import SmtpSender
+from app.ticket_queue import TicketQueue
+from app.ticket_state import TicketStateStore
+
+# How long the dispatcher waits for a worker to finish its part of a batch
+BATCH_TIMEOUT = 900
+
+# Result of one message as reported back by a worker
+ShardResult = namedtuple("ShardResult", "message_id sent skipped error")
+
+# Worker count the per-sender state under STATE_DIR is currently split for
+LAYOUT_FILE = "state_layout.json"
+# How long a layout change may spend applying queued GLPI operations
+DRAIN_TIMEOUT = 120
+
+
+# -----------------------------------------------------------
+# ROUTING
+# -----------------------------------------------------------
+
+def routing_key(sender):
+    """Canonical mailbox of a sender, so every alias lands on one shard."""
+    clean = normalize_email(sender) or (sender or "").strip().lower()
+    return canonical_email(clean)
+
+
+def shard_for(sender, count):
+    """Stable shard number (the same in every process, unlike hash())."""
+    digest = hashlib.blake2b(routing_key(sender).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+# -----------------------------------------------------------
+# STATE LAYOUT
+# -----------------------------------------------------------
+
+def state_dirs(state_dir, count):
+    """Per-sender state dirs for a worker count (one worker = STATE_DIR itself)."""
+    if count <= 1:
+        return [state_dir]
+    return [os.path.join(state_dir, f"shard-{n}") for n in range(count)]
+
+
+def _previous_layout(state_dir):
+    """(workers, dirs) of the last run; unrecorded = STATE_DIR plus any shard dirs."""
+    try:
+        with open(os.path.join(state_dir, LAYOUT_FILE)) as f:
+            workers = json.load(f)["workers"]
+        return workers, state_dirs(state_dir, workers)
+    except FileNotFoundError:
+        pass
+    shards = sorted(n for n in os.listdir(state_dir) if re.fullmatch(r"shard-\d+", n))
+    return None, [state_dir] + [os.path.join(state_dir, n) for n in shards]
+
+
+def _write_layout(state_dir, count):
+    with open(os.path.join(state_dir, LAYOUT_FILE), "w") as f:
+        json.dump({"workers": count}, f)
+
+
+def _move_rows(path, table, column, dest_for):
+    """Move rows of a SQLite table to the file dest_for(row[column]). Returns rows moved."""
+    if not os.path.exists(path):
+        return 0
+    src = sqlite3.connect(path)
+    try:
+        schema = src.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        if schema is None:
+            return 0
+        cols = [r[1] for r in src.execute(f"PRAGMA table_info({table})") if r[1] != "id"]
+        key = cols.index(column)
+
+        moves = {}
+        for row in src.execute(f"SELECT id, {', '.join(cols)} FROM {table} ORDER BY id"):
+            dest = dest_for(row[1 + key])
+            if dest != path:
+                moves.setdefault(dest, []).append(row)
+
+        for dest, rows in moves.items():
+            dst = sqlite3.connect(dest)
+            try:
+                exists = dst.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+                ).fetchone()
+                if not exists:
+                    dst.execute(schema[0])
+                dst.executemany(
+                    f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                    [row[1:] for row in rows],
+                )
+                dst.commit()
+            finally:
+                dst.close()
+            src.executemany(f"DELETE FROM {table} WHERE id = ?", [(row[0],) for row in rows])
+            src.commit()
+        return sum(len(rows) for rows in moves.values())
+    finally:
+        src.close()
+
+
+def migrate_state(state_dir, count, root_queue=None, root_states=None, client=glpi,
+                  drain_timeout=DRAIN_TIMEOUT):
+    """
+    Re-split per-sender state when the worker count changes.
+
+    Workers keep their state in STATE_DIR/shard-<n> and single-process
+    mode in STATE_DIR, so switching modes or changing SHARD_WORKERS
+    would strand the old files. Before anything starts:
+
+    - queued GLPI operations in dirs that senders leave are applied;
+      if some can't be, RuntimeError is raised and nothing is moved
+    - ticket state, SQLite history and the SMTP outbox follow each
+      sender (or recipient) to their new dir
+    - the answered-message journals are merged into every new dir
+
+    root_queue / root_states are the stores of STATE_DIR that this
+    process already has open (glpi_handler's module-level ones).
+    """
+    count = max(1, int(count))
+    os.makedirs(state_dir, exist_ok=True)
+    workers, old = _previous_layout(state_dir)
+    if workers == count:
+        return
+
+    new = state_dirs(state_dir, count)
+    old = [path for path in old if os.path.isdir(path)]
+    if set(old) == set(new):
+        # e.g. a first recorded run in the layout already on disk: nothing moves
+        _write_layout(state_dir, count)
+        return
+    for path in new:
+        os.makedirs(path, exist_ok=True)
+
+    def dest_for(key):
+        return new[shard_for(key, count)]
+
+    opened = {}
+
+    def stores(path):
+        if path == state_dir and root_queue is not None:
+            return root_queue, root_states
+        if path not in opened:
+            states = TicketStateStore(os.path.join(path, "ticket_state.db"))
+            ops = TicketQueue(os.path.join(path, "ticket_queue.db"), client=client)
+            ops.add_listener(states.resolve_ref)
+            opened[path] = (ops, states)
+        return opened[path]
+
+    try:
+        leaving = {
+            path: {sender for sender, _ in stores(path)[1].items() if dest_for(sender) != path}
+            for path in old
+        }
+        # GLPI ops can't follow a sender safely (refs, per-ticket order): apply
+        # them wherever senders leave; dirs that keep all theirs keep their queue
+        for path in old:
+            if not leaving[path]:
+                continue
+            left = stores(path)[0].drain(drain_timeout)
+            if left:
+                raise RuntimeError(
+                    f"{left} GLPI operation(s) still queued in {path}; not changing the "
+                    f"state layout to {count} worker(s) until they are applied"
+                )
+
+        moved = 0
+        for path in old:
+            if not leaving[path]:
+                continue
+            states = stores(path)[1]
+            # re-read: draining resolved pending P-refs to GLPI ids
+            for sender, state in states.items():
+                if sender in leaving[path]:
+                    stores(dest_for(sender))[1].merge(sender, state)
+            states.forget(leaving[path])
+            moved += len(leaving[path])
+    finally:
+        for ops, states in opened.values():
+            ops.close()
+            states.close()
+
+    history = sum(
+        _move_rows(os.path.join(path, "history.db"), "messages", "sender",
+                   lambda key: os.path.join(dest_for(key), "history.db"))
+        for path in old
+    )
+    outbox = sum(
+        _move_rows(os.path.join(path, "smtp_outbox.db"), "outbox", "to_addr",
+                   lambda key: os.path.join(dest_for(key), "smtp_outbox.db"))
+        for path in old
+    )
+
+    # Message-IDs don't say which sender they came from: every dir gets all of them
+    answered = []
+    for path in old:
+        try:
+            with open(os.path.join(path, "answered_message_ids.log")) as f:
+                answered += [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            pass
+    for path in new:
+        journal = MessageJournal(os.path.join(path, "answered_message_ids.log"))
+        for key in answered:
+            journal.record(key)
+        journal.close()
+
+    _write_layout(state_dir, count)
+    logging.info(
+        f"State layout {workers or 'unrecorded'} → {count} worker(s): moved {moved} ticket "
+        f"state(s), {history} history and {outbox} outbox row(s)"
+    )
+
+
+# -----------------------------------------------------------
+# SHARED DATASETS
+# -----------------------------------------------------------
+
+@dataclass(frozen=True)
+class SnapshotFiles:
+    """
+    Feather snapshot paths for one dataset version. The dispatcher
+    publishes this instead of a DatasetSnapshot; workers map the files.
+    """
+
+    paths: dict
+    etags: dict = field(default_factory=dict)
+    version: int = 0
+    loaded_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def builder(cls, cache):
+        """DatasetRefresher build hook: frames are already snapshotted by the loader."""
+        def build(frames, etags, version):
+            paths = {name: cache.path(DATASET_KEYS[name], etag) for name, etag in etags.items()}
+            missing = [p for p in paths.values() if not os.path.exists(p)]
+            if missing:
+                raise RuntimeError(f"Sharded mode needs Feather snapshots; missing {missing}")
+            return cls(paths=paths, etags=dict(etags), version=version)
+        return build
+
+
+def _is_in(table, column, values):
+    """Rows of table whose column is in values (unfiltered if types clash)."""
+    try:
+        return table.filter(pc.is_in(table[column], value_set=values.cast(table[column].type)))
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, KeyError) as e:
+        logging.warning(f"Shard filter on {column} skipped: {e}")
+        return table
+
+
+def load_shard_snapshot(files, shard, count):
+    """
+    DatasetSnapshot holding only this shard's customers and their loans.
+
+    Tables are memory-mapped, so every worker reads the same page-cache
+    pages; only the shard's rows are turned into Python index objects.
+    A customer is kept when any of their addresses routes to the shard.
+    """
+    started = time.perf_counter()
+    tables = {name: feather.read_table(path, memory_map=True) for name, path in files.paths.items()}
+
+    customers = tables["customers"]
+    address_cols = [c for c in ("email", *ALIAS_COLUMNS) if c in customers.column_names]
+    columns = [customers[c].to_pylist() for c in address_cols]
+    keep = []
+    for values in zip(*columns):
+        owned = False
+        for raw in values:
+            if raw is None or raw != raw:
+                continue
+            for part in str(raw).replace(";", ",").split(","):
+                if part.strip() and shard_for(part, count) == shard:
+                    owned = True
+                    break
+            if owned:
+                break
+        keep.append(owned)
+    del columns
+
+    customers = customers.filter(pa.array(keep, type=pa.bool_()))
+    loans = _is_in(tables["loans"], "customer_id", customers["customer_id"].combine_chunks())
+    fees = _is_in(tables["fees"], "loan_id", loans["loan_id"].combine_chunks())
+
+    snapshot = DatasetSnapshot.build(
+        {"customers": customers.to_pandas(), "loans": loans.to_pandas(), "fees": fees.to_pandas()},
+        files.etags,
+        files.version,
+    )
+    logging.info(
+        f"Shard {shard}/{count}: snapshot v{files.version} with {customers.num_rows} customers, "
+        f"{loans.num_rows} loans in {time.perf_counter() - started:.2f}s"
+    )
+    return snapshot
+
+
+class ShardDatasets:
+    """Worker-side stand-in for DatasetRefresher (.current, .stats())."""
+
+    def __init__(self, shard, count):
+        self.shard = shard
+        self.count = count
+        self._current = None
+        self.reloads = 0
+        self.failures = 0
+
+    @property
+    def current(self):
+        return self._current
+
+    def load(self, files):
+        started = time.perf_counter()
+        try:
+            snapshot = load_shard_snapshot(files, self.shard, self.count)
+        except Exception as e:
+            self.failures += 1
+            reload_failures.inc()
+            logging.error(f"SHARD {self.shard} DATASET LOAD ERROR: {e}")
+            return
+        reload_seconds.observe(time.perf_counter() - started)
+        old, self._current = self._current, snapshot
+        self.reloads += 1
+        if old is not None:
+            reply_cache.invalidate_stale(snapshot.loan_store)
+
+    def stats(self):
+        current = self._current
+        return {
+            "version": current.version if current else 0,
+            "customers": len(current.customer_index) if current else 0,
+            "snapshot_age_seconds": round(time.time() - current.loaded_at, 1) if current else None,
+            "reloads": self.reloads,
+            "failures": self.failures,
+        }
+
+
+# -----------------------------------------------------------
+# WORKER PROCESS
+# -----------------------------------------------------------
+
+def worker_main(shard, count, inbox, outbox, options):
+    """
+    Entry point of one worker process.
+
+    Module-level state (history, ticket state, journal, GLPI queue) was
+    created at import from the shard's own STATE_DIR, which the
+    dispatcher put in the environment before spawning.
+    """
+    initializer = options.get("initializer")
+    if initializer:
+        initializer(shard, *options.get("initargs", ()))
+
+    state_dir = os.getenv("STATE_DIR", "state")
+    os.makedirs(state_dir, exist_ok=True)
+
+    datasets = ShardDatasets(shard, count)
+    smtp_sender = SmtpSender(**options["smtp"], outbox_path=os.path.join(state_dir, "smtp_outbox.db"))
+    pipeline = MailPipeline(
+        datasets,
+        send=smtp_sender.send,
+        extract_body=extract_email_body,
+        concurrency=options.get("concurrency"),
+        journal=MessageJournal(os.path.join(state_dir, "answered_message_ids.log")),
+        coalesce_window=options.get("coalesce_window", 0),
+        coalesce_max=options.get("coalesce_max", 5),
+        **options.get("scheduler", {}),
+    )
+
+    if options.get("metrics_port"):
+        start_http_server(options["metrics_port"])
+    if not len(ticket_states):
+        ticket_states.rebuild_from_glpi(ticket_queue.client, owns=lambda sender: shard_for(sender, count) == shard)
+    ticket_queue.start()
+
+    logging.info(f"Shard worker {shard}/{count} started (pid {os.getpid()}, state {state_dir})")
+    outbox.put(("ready", shard, None, None))
+
+    while True:
+        kind, batch_id, payload = inbox.get()
+        if kind == "stop":
+            break
+
+        if kind == "datasets":
+            datasets.load(payload)
+
+        elif kind == "batch":
+            try:
+                results = pipeline.process_batch(payload)
+            except Exception as e:
+                logging.error(f"SHARD {shard} BATCH ERROR: {e}")
+                results = []
+            outbox.put(("done", shard, batch_id, [
+                ShardResult(r.message_id, r.sent, r.skipped, r.error) for r in results
+            ]))
+
+        elif kind == "stats":
+            outbox.put(("stats", shard, batch_id, {
+                "metrics": metrics.snapshot(),
+                "datasets": datasets.stats(),
+                "bedrock": bedrock_gen.bedrock_invoker.stats(),
+                "history": history_store.stats(),
+                "tickets": ticket_states.stats(),
+                "ticket_queue_pending": ticket_queue.pending(),
+            }))
+
+    ticket_queue.stop()
+    pipeline.close()
+    smtp_sender.close()
+    history_store.close()
+    logging.info(f"Shard worker {shard}/{count} stopped")
+
+
+@contextmanager
+def _environ(overrides):
+    """Temporarily set env vars; spawned children inherit them."""
+    saved = {k: os.environ.get(k) for k in overrides}
+    os.environ.update({k: str(v) for k, v in overrides.items()})
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+# -----------------------------------------------------------
+# DISPATCHER
+# -----------------------------------------------------------
+
+class ShardDispatcher:
+    """
+    Routes fetched mail to N worker processes by sender hash.
+
+    Each sender always maps to the same worker, so per-customer order
+    is kept by that worker's pipeline and each worker holds only its
+    shard of history, ticket state and customer/loan index. Workers
+    are spawned (not forked) with STATE_DIR=<state_dir>/shard-<n> and
+    the Bedrock quota split evenly between them.
+
+    process_batch() has the same contract as MailPipeline.process_batch:
+    it returns one result per message with .message_id/.sent/.skipped.
+    """
+
+    def __init__(self, workers, state_dir, smtp, concurrency=None, coalesce_window=0,
+                 coalesce_max=5, scheduler=None, metrics_port=0, batch_timeout=BATCH_TIMEOUT,
+                 initializer=None, initargs=()):
+        self.count = max(1, int(workers))
+        self.state_dir = state_dir
+        self.batch_timeout = batch_timeout
+        self.metrics_port = metrics_port
+        self.options = {
+            "smtp": smtp,
+            "concurrency": concurrency,
+            "coalesce_window": coalesce_window,
+            "coalesce_max": coalesce_max,
+            "scheduler": scheduler or {},
+            "initializer": initializer,
+            "initargs": initargs,
+        }
+
+        self._ctx = multiprocessing.get_context("spawn")
+        self._outbox = self._ctx.Queue()
+        self._inboxes = [None] * self.count
+        self._procs = [None] * self.count
+        self._files = None
+        self._batch_seq = 0
+        self.restarts = 0
+        self.routed = [0] * self.count
+
+    # ---------------------------------------------------
+    # Worker lifecycle
+    # ---------------------------------------------------
+    def _worker_env(self, shard):
+        n = self.count
+        invoker = bedrock_gen.bedrock_invoker
+        return {
+            "STATE_DIR": os.path.join(self.state_dir, f"shard-{shard}"),
+            "SNAPSHOT_DIR": SNAPSHOT_DIR,
+            "BEDROCK_RPM": max(1, int(invoker.requests.capacity) // n),
+            "BEDROCK_TPM": max(1, int(invoker.tokens.capacity) // n),
+            "BEDROCK_MAX_CONCURRENCY": max(1, invoker.limiter.max_limit // n),
+            "METRICS_PORT": self.metrics_port + 1 + shard if self.metrics_port else 0,
+        }
+
+    def _spawn(self, shard):
+        inbox = self._ctx.Queue()
+        options = dict(self.options, metrics_port=self._worker_env(shard)["METRICS_PORT"])
+        proc = self._ctx.Process(
+            target=worker_main,
+            args=(shard, self.count, inbox, self._outbox, options),
+            name=f"shard-{shard}",
+            daemon=True,
+        )
+        with _environ(self._worker_env(shard)):
+            proc.start()
+        self._inboxes[shard] = inbox
+        self._procs[shard] = proc
+        if self._files is not None:
+            inbox.put(("datasets", None, self._files))
+
+    def start(self, files):
+        """Spawn every worker and hand it the current snapshot files."""
+        self._files = files
+        for shard in range(self.count):
+            self._spawn(shard)
+
+        ready = 0
+        deadline = time.monotonic() + self.batch_timeout
+        while ready < self.count and time.monotonic() < deadline:
+            try:
+                kind, *_ = self._outbox.get(timeout=1)
+            except queue.Empty:
+                continue
+            ready += kind == "ready"
+        logging.info(f"Sharded mode: {ready}/{self.count} workers ready")
+
+    def update_datasets(self, old, new):
+        """DatasetRefresher listener: every worker re-maps the new files."""
+        self._files = new
+        for inbox in self._inboxes:
+            inbox.put(("datasets", None, new))
+
+    def _check_workers(self):
+        for shard, proc in enumerate(self._procs):
+            if not proc.is_alive():
+                logging.error(f"Shard worker {shard} died (exit {proc.exitcode}); restarting")
+                self.restarts += 1
+                self._spawn(shard)
+
+    def stop(self, timeout=30):
+        for inbox in self._inboxes:
+            inbox.put(("stop", None, None))
+        for proc in self._procs:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+
+    # ---------------------------------------------------
+    # Batches
+    # ---------------------------------------------------
+    def process_batch(self, messages):
+        """messages: [(message_id, email.message.Message, dedupe_key)]."""
+        if not messages:
+            return []
+        self._check_workers()
+
+        self._batch_seq += 1
+        batch_id = self._batch_seq
+        parts = {}
+        for item in messages:
+            sender = item[1].get("From", "")
+            parts.setdefault(shard_for(sender, self.count), []).append(item)
+
+        for shard, part in parts.items():
+            self.routed[shard] += len(part)
+            self._inboxes[shard].put(("batch", batch_id, part))
+
+        results = {}
+        waiting = set(parts)
+        deadline = time.monotonic() + self.batch_timeout
+        while waiting and time.monotonic() < deadline:
+            try:
+                kind, shard, got_id, payload = self._outbox.get(timeout=1)
+            except queue.Empty:
+                dead = {s for s in waiting if not self._procs[s].is_alive()}
+                if dead:
+                    logging.error(f"Shard worker(s) {sorted(dead)} died mid-batch")
+                    waiting -= dead
+                continue
+            if kind == "done" and got_id == batch_id:
+                waiting.discard(shard)
+                for r in payload:
+                    results[r.message_id] = r
+
+        if waiting:
+            logging.error(f"Batch {batch_id}: no answer from shard(s) {sorted(waiting)}")
+
+        # unanswered messages count as failed and stay UNSEEN
+        return [
+            results.get(mid) or ShardResult(mid, False, False, "no result from shard")
+            for mid, _, _ in messages
+        ]
+
+    # ---------------------------------------------------
+    # Metrics
+    # ---------------------------------------------------
+    def collect_stats(self, timeout=10):
+        """{shard: worker stats} from every live worker."""
+        self._batch_seq += 1
+        stats_id = self._batch_seq
+        for inbox in self._inboxes:
+            inbox.put(("stats", stats_id, None))
+
+        out = {}
+        deadline = time.monotonic() + timeout
+        while len(out) < self.count and time.monotonic() < deadline:
+            try:
+                kind, shard, got_id, payload = self._outbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if kind == "stats" and got_id == stats_id:
+                out[shard] = payload
+        return out
+
+    def stats(self):
+        return {
+            "workers": self.count,
+            "alive": sum(1 for p in self._procs if p is not None and p.is_alive()),
+            "restarts": self.restarts,
+            "routed": list(self.routed),
+        }
@@ -0,0 +1,366 @@
+import heapq
+import itertools
+import logging
+import os
+import queue
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+
+DEFAULT_SUBJECT = "Re: Your Query"
+
+# Close pooled sessions that sat idle longer than this (servers drop them anyway)
+MAX_IDLE_SECONDS = 60
+# Background retry schedule for replies that could not be sent inline
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 5
+
+
+# -------------------------------------------------------
+# OUTGOING MESSAGE
+# -------------------------------------------------------
+@dataclass
+class OutgoingEmail:
+    to_addr: str
+    body: str
+    subject: str = DEFAULT_SUBJECT
+    in_reply_to: str = None
+    references: str = None
+    attempts: int = 0
+    outbox_id: int = None    # row in the persistent outbox while deferred
+
+    @classmethod
+    def reply_to(cls, to_addr, body, original=None):
+        """Build a reply that threads under the original message."""
+        if original is None:
+            return cls(to_addr, body)
+
+        subject = (original.get("Subject") or "").strip()
+        if not subject:
+            subject = DEFAULT_SUBJECT
+        elif not subject.lower().startswith("re:"):
+            subject = f"Re: {subject}"
+
+        message_id = (original.get("Message-ID") or "").strip() or None
+        references = (original.get("References") or "").strip()
+        if message_id:
+            references = f"{references} {message_id}".strip()
+
+        return cls(to_addr, body, subject, message_id, references or None)
+
+    def to_mime(self, from_addr):
+        msg = MIMEText(self.body)
+        msg["Subject"] = self.subject
+        msg["From"] = from_addr
+        msg["To"] = self.to_addr
+        msg["Date"] = formatdate(localtime=True)
+        msg["Message-ID"] = make_msgid()
+        if self.in_reply_to:
+            msg["In-Reply-To"] = self.in_reply_to
+        if self.references:
+            msg["References"] = self.references
+        return msg
+
+
+# -------------------------------------------------------
+# POOLED SMTP SENDER
+# -------------------------------------------------------
+class SmtpSender:
+    """
+    Reuses authenticated SMTP sessions across replies.
+
+    - up to pool_size sessions are kept open (one per concurrent sender)
+    - a dropped session or 421 reply triggers one transparent reconnect
+    - replies that still fail go to a background retry queue, so the
+      caller is never blocked on a flaky SMTP server; with outbox_path
+      the queue is kept in SQLite and resumed after a restart
+    - a permanent (5xx) rejection only fails that one reply; it stays in
+      the outbox as failed instead of being dropped
+    - smtp_factory / starttls / credentials are injectable so a local
+      SMTP stand-in can be used in place of Gmail
+    """
+
+    def __init__(self, host, port, username=None, password=None, from_addr=None,
+                 starttls=True, pool_size=2, smtp_factory=smtplib.SMTP, timeout=30,
+                 outbox_path=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.from_addr = from_addr or username
+        self.starttls = starttls
+        self.pool_size = pool_size
+        self.smtp_factory = smtp_factory
+        self.timeout = timeout
+
+        self._idle = queue.LifoQueue()
+        self._retry = []   # heap of (due_at, seq, OutgoingEmail)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._retry_thread = None
+
+        self.stats = {"sent": 0, "reconnects": 0, "deferred": 0, "failed": 0}
+
+        self._db = self._open_outbox(outbox_path)
+        self._resume()
+
+    # ---------------------------------------------------
+    # Session pool
+    # ---------------------------------------------------
+    def _open(self):
+        server = self.smtp_factory(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.username:
+            server.login(self.username, self.password)
+        return server
+
+    def _acquire(self):
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+            if time.monotonic() - last_used < MAX_IDLE_SECONDS:
+                return server
+            self._discard(server)
+
+    def _release(self, server):
+        if self._idle.qsize() < self.pool_size:
+            self._idle.put((server, time.monotonic()))
+        else:
+            self._discard(server)
+
+    @staticmethod
+    def _discard(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _is_connection_error(e):
+        # SMTPException subclasses OSError; only socket-level errors count here
+        if isinstance(e, smtplib.SMTPServerDisconnected):
+            return True
+        if isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException):
+            return True
+        return isinstance(e, smtplib.SMTPResponseException) and e.smtp_code == 421
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(server)
+
+    # ---------------------------------------------------
+    # Sending
+    # ---------------------------------------------------
+    def send(self, to_addr, body, original=None):
+        """
+        Send one reply. Returns True when delivered now, False when it
+        was queued for background retry (or rejected permanently).
+        """
+        return self.send_many([OutgoingEmail.reply_to(to_addr, body, original)]) == 1
+
+    def send_many(self, messages):
+        """
+        Deliver several replies over one session.
+        Returns the number delivered now; the rest are queued for retry.
+        """
+        pending = list(messages)
+        delivered = 0
+        reconnected = False
+
+        server = None
+        try:
+            server = self._acquire()
+            while pending:
+                out = pending[0]
+                try:
+                    server.sendmail(self.from_addr, [out.to_addr], out.to_mime(self.from_addr).as_string())
+                except Exception as e:
+                    if not self._is_connection_error(e):
+                        # this reply's problem, not the session's: handle it alone
+                        pending.pop(0)
+                        if self._is_permanent_error(e):
+                            self._fail(out, e)
+                        else:
+                            logging.warning(f"SMTP deferred reply to {out.to_addr}: {e}")
+                            self._defer(out)
+                        continue
+                    if reconnected:
+                        raise
+                    # one transparent reconnect per batch
+                    logging.warning(f"SMTP session lost ({e}); reconnecting")
+                    self._discard(server)
+                    server = None
+                    reconnected = True
+                    self.stats["reconnects"] += 1
+                    server = self._open()
+                    continue
+
+                pending.pop(0)
+                delivered += 1
+                self._delivered(out)
+        except Exception as e:
+            logging.error(f"SMTP SEND ERROR: {e}")
+            if server is not None:
+                self._discard(server)
+                server = None
+            for out in pending:
+                self._defer(out)
+        finally:
+            if server is not None:
+                self._release(server)
+
+        self.stats["sent"] += delivered
+        return delivered
+
+    @staticmethod
+    def _is_permanent_error(e):
+        """5xx rejections (and anything that is not an SMTP reply) won't succeed on retry."""
+        if isinstance(e, smtplib.SMTPRecipientsRefused):
+            return all(code >= 500 for code, _ in e.recipients.values())
+        if isinstance(e, smtplib.SMTPResponseException):
+            return e.smtp_code >= 500
+        return not isinstance(e, smtplib.SMTPException)
+
+    # ---------------------------------------------------
+    # Persistent outbox
+    # ---------------------------------------------------
+    @staticmethod
+    def _open_outbox(path):
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                to_addr TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                in_reply_to TEXT,
+                refs TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                due_at REAL NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )
+            """
+        )
+        db.commit()
+        return db
+
+    def _resume(self):
+        """Queue replies deferred before a restart."""
+        with self._cond:
+            rows = self._db.execute(
+                "SELECT id, to_addr, subject, body, in_reply_to, refs, attempts, due_at "
+                "FROM outbox WHERE failed = 0"
+            ).fetchall()
+        for row_id, to_addr, subject, body, in_reply_to, refs, attempts, due_at in rows:
+            out = OutgoingEmail(to_addr, body, subject, in_reply_to, refs, attempts, row_id)
+            self._schedule(due_at, out)
+        if rows:
+            logging.info(f"SMTP resuming {len(rows)} deferred repl(y/ies) from the outbox")
+
+    def _save(self, out, due_at):
+        with self._cond:
+            if out.outbox_id is None:
+                cur = self._db.execute(
+                    "INSERT INTO outbox (to_addr, subject, body, in_reply_to, refs, attempts, due_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (out.to_addr, out.subject, out.body, out.in_reply_to, out.references,
+                     out.attempts, due_at),
+                )
+                out.outbox_id = cur.lastrowid
+            else:
+                self._db.execute(
+                    "UPDATE outbox SET attempts = ?, due_at = ? WHERE id = ?",
+                    (out.attempts, due_at, out.outbox_id),
+                )
+            self._db.commit()
+
+    def _delivered(self, out):
+        if out.outbox_id is None:
+            return
+        with self._cond:
+            self._db.execute("DELETE FROM outbox WHERE id = ?", (out.outbox_id,))
+            self._db.commit()
+
+    def _fail(self, out, error):
+        """Give up on one reply; it stays in the outbox marked failed for follow-up."""
+        logging.error(f"SMTP giving up on reply to {out.to_addr} after {out.attempts + 1} attempt(s): {error}")
+        self._save(out, 0)
+        with self._cond:
+            self._db.execute(
+                "UPDATE outbox SET failed = 1, error = ? WHERE id = ?", (str(error), out.outbox_id)
+            )
+            self._db.commit()
+        # counted once the row is marked, so stats never run ahead of failed_replies()
+        self.stats["failed"] += 1
+
+    def failed_replies(self):
+        """Replies that were given up on: [(to_addr, subject, error)]."""
+        with self._cond:
+            return self._db.execute(
+                "SELECT to_addr, subject, error FROM outbox WHERE failed = 1 ORDER BY id"
+            ).fetchall()
+
+    # ---------------------------------------------------
+    # Background retries (off the critical path)
+    # ---------------------------------------------------
+    def _defer(self, out):
+        if out.attempts >= RETRY_ATTEMPTS:
+            self._fail(out, f"still failing after {RETRY_ATTEMPTS} retries")
+            return
+        out.attempts += 1
+
+        self.stats["deferred"] += 1
+        delay = RETRY_BASE_DELAY * 2 ** (out.attempts - 1)
+        due_at = time.time() + delay + random.uniform(0, 1)
+        self._save(out, due_at)
+        self._schedule(due_at, out)
+
+    def _schedule(self, due_at, out):
+        with self._cond:
+            heapq.heappush(self._retry, (due_at, next(self._seq), out))
+            self._cond.notify()
+            if self._retry_thread is None or not self._retry_thread.is_alive():
+                self._retry_thread = threading.Thread(
+                    target=self._retry_loop, name="smtp-retry", daemon=True
+                )
+                self._retry_thread.start()
+
+    def _retry_loop(self):
+        while True:
+            with self._cond:
+                while not self._retry or self._retry[0][0] > time.time():
+                    timeout = self._retry[0][0] - time.time() if self._retry else None
+                    self._cond.wait(timeout)
+
+                # everything already due goes out on the same session
+                batch = []
+                now = time.time()
+                while self._retry and self._retry[0][0] <= now:
+                    batch.append(heapq.heappop(self._retry)[2])
+
+            logging.info(f"SMTP retrying {len(batch)} deferred repl(y/ies)")
+            self.send_many(batch)
+
+    def pending_retries(self):
+        with self._cond:
+            return len(self._retry)
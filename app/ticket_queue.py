@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from app.glpi_client import glpi
+
+ticket_logger = logging.getLogger("ticket_logger")
+
+# Retry schedule for failed GLPI operations (seconds)
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 600
+# How often the flusher wakes up when idle
+FLUSH_INTERVAL = 1.0
+
+PROVISIONAL_PREFIX = "P-"
+FOLLOWUP_SEPARATOR = "\n\n----------\n\n"
+
+
+# ----------------------------------------------------------
+# WRITE-BEHIND TICKET QUEUE
+# ----------------------------------------------------------
+class TicketQueue:
+    """
+    Durable local queue of GLPI operations (create / follow-up / close).
+
+    The customer reply only needs a ticket *reference*, so operations are
+    written to SQLite and applied by a background flusher:
+
+    - new tickets get a provisional reference ("P-1A2B3C4D") that
+      resolves to the GLPI id once the create call succeeds; pending
+      ops are then rewritten to the id, so each ticket is one FIFO
+    - consecutive follow-ups for the same ticket are merged into one call
+    - failed operations are retried with exponential backoff + jitter,
+      and survive restarts
+    """
+
+    def __init__(self, path, client=glpi):
+        self.client = client
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopping = False
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS ops (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ref TEXT NOT NULL,
+                op TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_at REAL NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS refs (
+                ref TEXT PRIMARY KEY,
+                ticket_id INTEGER
+            );
+            """
+        )
+        self._db.commit()
+
+    # ------------------------------------------------------
+    # References
+    # ------------------------------------------------------
+    @staticmethod
+    def new_ref():
+        return PROVISIONAL_PREFIX + uuid.uuid4().hex[:8].upper()
+
+    @staticmethod
+    def is_provisional(ref):
+        return isinstance(ref, str) and ref.startswith(PROVISIONAL_PREFIX)
+
+    def resolve(self, ref):
+        """GLPI ticket id for a reference, or None while still provisional."""
+        if not self.is_provisional(ref):
+            return int(ref)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT ticket_id FROM refs WHERE ref = ?", (ref,)
+            ).fetchone()
+        return row[0] if row and row[0] is not None else None
+
+    def display_ref(self, ref):
+        ticket_id = self.resolve(ref)
+        return f"#{ticket_id}" if ticket_id else f"#{ref} (provisional)"
+
+    def add_listener(self, fn):
+        """fn(ref, ticket_id) is called when a provisional ref resolves."""
+        self._listeners.append(fn)
+
+    # ------------------------------------------------------
+    # Enqueue
+    # ------------------------------------------------------
+    def _enqueue(self, ref, op, payload):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO ops (ref, op, payload) VALUES (?, ?, ?)",
+                (str(ref), op, json.dumps(payload)),
+            )
+            self._db.commit()
+        self._wakeup.set()
+
+    def enqueue_create(self, ref, title, description, followup=None):
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO refs (ref) VALUES (?)", (ref,))
+        self._enqueue(ref, "create", {
+            "title": title, "description": description, "followup": followup,
+        })
+
+    def enqueue_followup(self, ref, message):
+        self._enqueue(ref, "followup", {"message": message})
+
+    def enqueue_close(self, ref):
+        self._enqueue(ref, "close", {})
+
+    def pending(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM ops").fetchone()[0]
+
+    def drain(self, timeout):
+        """
+        Flush in the foreground until nothing is pending or timeout runs
+        out (backoff delays are skipped once). Returns the ops left.
+        """
+        with self._lock:
+            self._db.execute("UPDATE ops SET next_at = 0")
+            self._db.commit()
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            if not self.flush_once():
+                time.sleep(min(FLUSH_INTERVAL, max(0.0, deadline - time.monotonic())))
+        return self.pending()
+
+    # ------------------------------------------------------
+    # Flusher
+    # ------------------------------------------------------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="ticket-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                self.flush_once()
+            except Exception as e:
+                ticket_logger.error(f"Ticket flusher error: {e}")
+            self._wakeup.wait(FLUSH_INTERVAL)
+            self._wakeup.clear()
+
+    def flush_once(self):
+        """Apply every due operation once. Returns the number applied."""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, ref, op, payload, attempts, next_at FROM ops ORDER BY id"
+            ).fetchall()
+
+        # per-ticket FIFO: a ticket is blocked behind its oldest pending op,
+        # whether that op was queued under the provisional ref or the id
+        by_ticket = {}
+        for row in rows:
+            by_ticket.setdefault(self.resolve(row[1]) or row[1], []).append(row)
+
+        applied = 0
+        for ops in by_ticket.values():
+            if ops[0][5] > now:
+                continue
+            applied += self._flush_ticket(ops)
+        return applied
+
+    def _flush_ticket(self, ops):
+        applied = 0
+        i = 0
+        while i < len(ops):
+            op_id, ref, op, payload, attempts, _ = ops[i]
+            payload = json.loads(payload)
+
+            # merge directly following follow-ups into this call
+            batch = [op_id]
+            messages = [payload["followup"]] if op == "create" and payload.get("followup") else []
+            if op == "followup":
+                messages.append(payload["message"])
+            i += 1
+            if op in ("create", "followup"):
+                while i < len(ops) and ops[i][2] == "followup":
+                    batch.append(ops[i][0])
+                    messages.append(json.loads(ops[i][3])["message"])
+                    i += 1
+            followup = FOLLOWUP_SEPARATOR.join(messages)
+
+            if op == "create":
+                ok = self._apply_create(ref, payload)
+                if ok and followup and not self.client.add_followup(self.resolve(ref), followup):
+                    # the ticket exists now; the follow-up keeps this op's
+                    # place so later ops (e.g. the close) still wait behind it
+                    self._convert_to_followup(batch, followup)
+                    ok = False
+            elif op == "followup":
+                ok = self._apply(ref, lambda tid: self.client.add_followup(tid, followup))
+            else:
+                ok = self._apply(ref, self.client.close_ticket)
+
+            if not ok:
+                self._backoff(batch[0], attempts)
+                break
+
+            with self._lock:
+                self._db.executemany("DELETE FROM ops WHERE id = ?", [(b,) for b in batch])
+                self._db.commit()
+            applied += len(batch)
+
+        return applied
+
+    def _apply(self, ref, fn):
+        ticket_id = self.resolve(ref)
+        if ticket_id is None:
+            return False
+        return bool(fn(ticket_id))
+
+    def _apply_create(self, ref, payload):
+        if self.resolve(ref) is not None:
+            return True   # created on an earlier attempt
+
+        ticket_id = self.client.create_ticket(payload["title"], payload["description"])
+        if not ticket_id:
+            return False
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO refs (ref, ticket_id) VALUES (?, ?)", (ref, ticket_id)
+            )
+            # ops queued under the provisional ref now belong to the ticket id
+            self._db.execute("UPDATE ops SET ref = ? WHERE ref = ?", (str(ticket_id), ref))
+            self._db.commit()
+        ticket_logger.info(f"[RESOLVED] {ref} → Ticket #{ticket_id}")
+
+        for fn in self._listeners:
+            fn(ref, ticket_id)
+        return True
+
+    def _convert_to_followup(self, batch, followup):
+        """Turn an applied create (and its merged follow-ups) into one pending follow-up."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE ops SET op = 'followup', payload = ? WHERE id = ?",
+                (json.dumps({"message": followup}), batch[0]),
+            )
+            self._db.executemany("DELETE FROM ops WHERE id = ?", [(b,) for b in batch[1:]])
+            self._db.commit()
+
+    def _backoff(self, op_id, attempts):
+        delay = min(RETRY_BASE_DELAY * 2 ** attempts, RETRY_MAX_DELAY)
+        delay += random.uniform(0, delay / 4)
+        with self._lock:
+            self._db.execute(
+                "UPDATE ops SET attempts = attempts + 1, next_at = ? WHERE id = ?",
+                (time.time() + delay, op_id),
+            )
+            self._db.commit()
+        ticket_logger.warning(f"GLPI op {op_id} failed; retrying in {delay:.0f}s")
@@ -0,0 +1,224 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from app.ticket_queue import PROVISIONAL_PREFIX
+
+ticket_logger = logging.getLogger("ticket_logger")
+
+OPEN = "open"
+CLOSED = "closed"
+
+# Ticket titles are "Loan Support Request - <sender>"; rebuilds search on this
+TITLE_PREFIX = "Loan Support Request - "
+REBUILD_PAGE_SIZE = 100
+
+TicketState = namedtuple("TicketState", "ref status last_activity")
+
+
+def title_for(sender):
+    return TITLE_PREFIX + sender
+
+
+def _parse_glpi_time(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+# ----------------------------------------------------------
+# TICKET STATE STORE
+# ----------------------------------------------------------
+class TicketStateStore:
+    """
+    sender → (ticket ref, status, last activity), persisted in SQLite.
+
+    Every row is also held in a dict, so lookups are O(1) and never touch
+    disk; writes go through to SQLite (WAL) under one lock, so the store
+    can be shared by concurrent pipeline workers.
+
+    A ref is a GLPI ticket id (as text) or a provisional "P-…" ref from
+    the TicketQueue; resolve_ref() swaps one for the other.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tickets (
+                sender TEXT PRIMARY KEY,
+                ref TEXT NOT NULL,
+                status TEXT NOT NULL,
+                last_activity REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tickets_ref ON tickets (ref);
+            """
+        )
+        self._db.commit()
+
+        self._by_sender = {}
+        self._sender_by_ref = {}
+        for sender, ref, status, last_activity in self._db.execute(
+            "SELECT sender, ref, status, last_activity FROM tickets"
+        ):
+            self._by_sender[sender] = TicketState(ref, status, last_activity)
+            self._sender_by_ref[ref] = sender
+
+    # ------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------
+    def get(self, sender):
+        return self._by_sender.get(sender)
+
+    def open_ticket(self, sender):
+        """Ref of the sender's open ticket, or None (closed tickets don't count)."""
+        state = self._by_sender.get(sender)
+        return state.ref if state and state.status == OPEN else None
+
+    def __len__(self):
+        return len(self._by_sender)
+
+    # ------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------
+    def _write(self, sender, state):
+        old = self._by_sender.get(sender)
+        if old and self._sender_by_ref.get(old.ref) == sender:
+            del self._sender_by_ref[old.ref]
+        self._by_sender[sender] = state
+        self._sender_by_ref[state.ref] = sender
+        self._db.execute(
+            "INSERT OR REPLACE INTO tickets (sender, ref, status, last_activity) "
+            "VALUES (?, ?, ?, ?)",
+            (sender, state.ref, state.status, state.last_activity),
+        )
+
+    def set_open(self, sender, ref):
+        with self._lock:
+            self._write(sender, TicketState(str(ref), OPEN, time.time()))
+            self._db.commit()
+
+    def touch(self, sender):
+        with self._lock:
+            state = self._by_sender.get(sender)
+            if state:
+                self._write(sender, state._replace(last_activity=time.time()))
+                self._db.commit()
+
+    def mark_closed(self, sender):
+        with self._lock:
+            state = self._by_sender.get(sender)
+            if state:
+                self._write(sender, state._replace(status=CLOSED, last_activity=time.time()))
+                self._db.commit()
+
+    def resolve_ref(self, ref, ticket_id):
+        """TicketQueue listener: provisional ref → real GLPI id."""
+        with self._lock:
+            sender = self._sender_by_ref.get(ref)
+            if sender is None:
+                return
+            state = self._by_sender[sender]
+            self._write(sender, state._replace(ref=str(ticket_id)))
+            self._db.commit()
+
+    # ------------------------------------------------------
+    # Moving senders between stores (state layout changes)
+    # ------------------------------------------------------
+    def items(self):
+        with self._lock:
+            return list(self._by_sender.items())
+
+    def merge(self, sender, state):
+        """Adopt a sender's state from another store unless ours is newer."""
+        with self._lock:
+            existing = self._by_sender.get(sender)
+            if existing is None or existing.last_activity < state.last_activity:
+                self._write(sender, state)
+                self._db.commit()
+
+    def forget(self, senders):
+        with self._lock:
+            for sender in senders:
+                state = self._by_sender.pop(sender, None)
+                if state and self._sender_by_ref.get(state.ref) == sender:
+                    del self._sender_by_ref[state.ref]
+                self._db.execute("DELETE FROM tickets WHERE sender = ?", (sender,))
+            self._db.commit()
+
+    # ------------------------------------------------------
+    # Cold-start rebuild from GLPI
+    # ------------------------------------------------------
+    def rebuild_from_glpi(self, client, page_size=REBUILD_PAGE_SIZE, owns=None):
+        """
+        Load open bot tickets from GLPI search, page by page. The newest
+        ticket wins when a sender has several; owns(sender), if given,
+        limits the rebuild to one shard's senders. Returns the number of
+        senders restored, or None if GLPI could not be searched.
+        """
+        started = time.perf_counter()
+        found = {}
+        start = 0
+        while True:
+            rows, total = client.search_open_tickets(TITLE_PREFIX, start=start, limit=page_size)
+            if rows is None:
+                ticket_logger.error("Ticket state rebuild aborted: GLPI search failed")
+                return None
+
+            for row in rows:
+                name = row.get("name") or ""
+                if not name.startswith(TITLE_PREFIX) or row.get("id") is None:
+                    continue
+                sender = name[len(TITLE_PREFIX):].strip().lower()
+                if owns is not None and not owns(sender):
+                    continue
+                state = TicketState(
+                    str(row["id"]), OPEN, _parse_glpi_time(row.get("date_mod"))
+                )
+                current = found.get(sender)
+                if current is None or int(state.ref) > int(current.ref):
+                    found[sender] = state
+
+            start += len(rows)
+            if not rows or start >= total:
+                break
+
+        with self._lock:
+            for sender, state in found.items():
+                existing = self._by_sender.get(sender)
+                # local state written since the search started is newer
+                if existing is None or existing.last_activity < state.last_activity:
+                    self._write(sender, state)
+            self._db.commit()
+
+        ticket_logger.info(
+            f"Ticket state rebuilt from GLPI: {len(found)} open ticket(s) "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return len(found)
+
+    # ------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------
+    def stats(self):
+        with self._lock:
+            states = list(self._by_sender.values())
+        return {
+            "senders": len(states),
+            "open": sum(1 for s in states if s.status == OPEN),
+            "closed": sum(1 for s in states if s.status == CLOSED),
+            "provisional": sum(1 for s in states if s.ref.startswith(PROVISIONAL_PREFIX)),
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
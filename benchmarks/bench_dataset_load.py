@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+import pandas as pd
+
+from app.s3_loader import DATASET_KEYS, LocalSource, SnapshotCache, load_datasets
+from benchmarks.synthetic import make_datasets
+
+
+# -----------------------------------------------------------
+# BASELINE (pre-streaming path: sequential full pd.read_excel)
+# -----------------------------------------------------------
+
+def baseline_load(source):
+    frames = {}
+    for name, key in DATASET_KEYS.items():
+        _, data = source.fetch(key)
+        frames[name] = pd.read_excel(BytesIO(data))
+    return frames
+
+
+def _measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    frames = fn()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    frame_bytes = sum(df.memory_usage(deep=True).sum() for df in frames.values())
+    return {
+        "seconds": round(seconds, 3),
+        "peak_mb": round(peak / 2**20, 1),
+        "frames_mb": round(frame_bytes / 2**20, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dataset load time and peak memory")
+    parser.add_argument("--customers", type=int, default=20_000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench-datasets-")
+    for name, df in zip(("customers", "fees", "loans"), make_datasets(args.customers)):
+        path = os.path.join(root, DATASET_KEYS[name])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_excel(path, index=False)
+
+    source = LocalSource(root)
+    cache = SnapshotCache(os.path.join(root, "snapshots"))
+
+    print(json.dumps({
+        "customers": args.customers,
+        "baseline": _measure(lambda: baseline_load(source)),
+        "streaming": _measure(lambda: load_datasets(source, cache)[0]),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
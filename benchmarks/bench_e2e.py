@@ -0,0 +1,328 @@
+"""
+End-to-end benchmark: the real fetch → pipeline → SMTP / GLPI path, run
+against in-process stand-ins (fake IMAP mailbox, SMTP sink, Bedrock stub,
+GLPI mock server) and synthetic datasets. Prints a JSON report.
+
+    python -m benchmarks.bench_e2e --customers 20000 --messages 500
+    python -m benchmarks.bench_e2e --baseline last.json --max-regression 0.2
+    python -m benchmarks.bench_e2e --shards 4     # multi-process sharded mode
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+# app modules read STATE_DIR and open logs/ticket.log at import time
+os.environ.setdefault("STATE_DIR", tempfile.mkdtemp(prefix="bench-e2e-"))
+os.makedirs("logs", exist_ok=True)
+
+import app.bedrock_gen as bedrock_gen  # noqa: E402
+from app.bedrock_hedge import HedgedInvoker  # noqa: E402
+from app.bedrock_invoker import BedrockInvoker  # noqa: E402
+from app.dataset_refresher import DatasetSnapshot  # noqa: E402
+from app.email_utils import body_extractor, extract_email_body  # noqa: E402
+from app.glpi_client import GlpiClient  # noqa: E402
+from app.glpi_handler import ticket_queue, ticket_states  # noqa: E402
+from app.imap_session import ImapSession  # noqa: E402
+from app.mail_fetcher import IncrementalFetcher, message_key  # noqa: E402
+from app.message_journal import MessageJournal  # noqa: E402
+from app.metrics import metrics  # noqa: E402
+from app.pipeline import DEFAULT_CONCURRENCY, MailPipeline  # noqa: E402
+from app.s3_loader import DATASET_KEYS, SnapshotCache  # noqa: E402
+from app.sharding import ShardDispatcher, SnapshotFiles  # noqa: E402
+from app.smtp_sender import SmtpSender  # noqa: E402
+from benchmarks.standins import BedrockStub, FakeImapMailbox, GlpiMockServer, SmtpSink  # noqa: E402
+from benchmarks.synthetic import make_corpus, make_datasets  # noqa: E402
+
+
+def _rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _children_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+
+
+def install_standins(shard, bedrock, glpi_url):
+    """Point this process's Bedrock and GLPI clients at the stand-ins (also runs in shard workers)."""
+    stub = BedrockStub(**dict(bedrock["stub"], seed=bedrock["stub"]["seed"] + shard))
+    bedrock_gen.bedrock_invoker = BedrockInvoker(stub, **bedrock["invoker"])
+    if bedrock.get("fallback"):
+        # second route with its own stub, quota and (healthy) latency profile
+        fallback = BedrockStub(**dict(bedrock["fallback"], seed=bedrock["stub"]["seed"] + 1000 + shard))
+        bedrock_gen.hedged_invoker = HedgedInvoker(
+            bedrock_gen.bedrock_invoker, BedrockInvoker(fallback, **bedrock["invoker"]),
+            initial_hedge_after=bedrock["hedge_after"],
+        )
+    ticket_queue.client = GlpiClient(api_url=glpi_url)
+    return stub
+
+
+# -----------------------------------------------------------
+# RUN
+# -----------------------------------------------------------
+
+def run(args):
+    state_dir = os.environ["STATE_DIR"]
+    report = {"config": vars(args).copy()}
+    report["config"].pop("baseline", None)
+    rss_start = _rss_mb()
+
+    # Datasets + corpus
+    started = time.perf_counter()
+    customers, fees, loans = make_datasets(args.customers)
+    snapshot = DatasetSnapshot.build(
+        {"customers": customers, "fees": fees, "loans": loans}, {}, version=1
+    )
+    datasets = SimpleNamespace(current=snapshot)
+    dataset_seconds = time.perf_counter() - started
+
+    corpus = make_corpus(customers, args.messages, seed=args.seed, repeat_share=args.repeat_share)
+    mailbox = FakeImapMailbox(corpus)
+
+    # Stand-ins
+    sink = SmtpSink().start()
+    glpi_mock = GlpiMockServer(latency=args.glpi_latency).start()
+    shards = max(1, args.shards)
+    bedrock = {
+        "stub": {
+            "latency": args.bedrock_latency, "jitter": args.bedrock_jitter,
+            "throttle_rate": args.throttle_rate, "seed": args.seed,
+            "slow_rate": args.slow_rate, "slow_latency": args.slow_latency,
+            "fail_rate": args.fail_rate,
+        },
+        "fallback": {
+            "latency": args.bedrock_latency, "jitter": args.bedrock_jitter,
+        } if args.hedge else None,
+        "hedge_after": args.hedge_after,
+        # the account quota is shared, so shards split it
+        "invoker": {
+            "rpm": max(1, args.bedrock_rpm // shards), "tpm": max(1, args.bedrock_tpm // shards),
+            "max_concurrency": max(1, args.bedrock_concurrency // shards),
+            "deadline": args.bedrock_deadline,
+        },
+    }
+    concurrency = dict(DEFAULT_CONCURRENCY, generate=args.generate_workers, send=args.send_workers)
+    smtp_settings = {
+        "host": "127.0.0.1", "port": sink.port, "from_addr": "support@bank.example",
+        "starttls": False, "pool_size": concurrency["send"],
+    }
+    scheduler = {"max_in_flight": args.max_in_flight, "overload_threshold": args.overload_threshold}
+    fetcher = IncrementalFetcher(os.path.join(state_dir, "imap_uid.json"), batch_size=args.fetch_batch)
+
+    stub = smtp = pipeline = dispatcher = None
+    if shards > 1:
+        # workers map Feather snapshots written here, as in production
+        cache = SnapshotCache(os.path.join(state_dir, "snapshots"))
+        frames = {"customers": customers, "fees": fees, "loans": loans}
+        for name, df in frames.items():
+            cache.write(DATASET_KEYS[name], "bench", df)
+        files = SnapshotFiles.builder(cache)(frames, {name: "bench" for name in frames}, 1)
+        dispatcher = ShardDispatcher(
+            shards, state_dir, smtp=smtp_settings, concurrency=concurrency,
+            coalesce_window=args.coalesce_window, scheduler=scheduler,
+            initializer=install_standins, initargs=(bedrock, glpi_mock.api_url),
+        )
+        dispatcher.start(files)
+        process_batch = dispatcher.process_batch
+    else:
+        stub = install_standins(0, bedrock, glpi_mock.api_url)
+        ticket_states.rebuild_from_glpi(ticket_queue.client)
+        smtp = SmtpSender(**smtp_settings, outbox_path=os.path.join(state_dir, "smtp_outbox.db"))
+        journal = MessageJournal(os.path.join(state_dir, "answered_message_ids.log"))
+        pipeline = MailPipeline(
+            datasets, send=smtp.send, extract_body=extract_email_body,
+            concurrency=concurrency, journal=journal,
+            coalesce_window=args.coalesce_window, **scheduler,
+        )
+        ticket_queue.start()
+        process_batch = pipeline.process_batch
+
+    # Same loop shape as main(): search → fetch → pipeline → complete
+    started = time.perf_counter()
+    processed = handled_total = 0
+    with ImapSession("fake-imap", "bench", "bench", connect=mailbox.connect) as session:
+        while True:
+            uids = session.call(fetcher.new_uids)
+            if not uids:
+                break
+            fetched = session.call(fetcher.fetch, uids)
+            validity = fetcher.state.uidvalidity
+            results = process_batch([
+                (uid, msg, message_key(msg, validity, uid)) for uid, msg in fetched
+            ])
+            handled = [r.message_id for r in results if r.sent or r.skipped]
+            session.call(fetcher.complete, handled, uids)
+            processed += len(results)
+            handled_total += len(handled)
+            if not handled:
+                break
+    pipeline_seconds = time.perf_counter() - started
+
+    # Let the write-behind queue(s) finish talking to GLPI
+    drain_started = time.perf_counter()
+    if dispatcher:
+        shard_stats = dispatcher.collect_stats()
+        while time.perf_counter() - drain_started < args.drain_timeout:
+            if not sum(st["ticket_queue_pending"] for st in shard_stats.values()):
+                break
+            time.sleep(0.2)
+            shard_stats = dispatcher.collect_stats()
+    else:
+        while ticket_queue.pending() and time.perf_counter() - drain_started < args.drain_timeout:
+            time.sleep(0.05)
+    drain_seconds = time.perf_counter() - drain_started
+
+    report.update({
+        "messages": processed,
+        "handled": handled_total,
+        "unseen_left": mailbox.unseen(),
+        "seconds": round(pipeline_seconds, 3),
+        "throughput_msgs_per_s": round(processed / pipeline_seconds, 2) if pipeline_seconds else 0,
+        "dataset_build_seconds": round(dataset_seconds, 3),
+        "glpi_drain_seconds": round(drain_seconds, 3),
+        "smtp": {"delivered": sink.delivered, "connections": sink.connections},
+        "glpi": {
+            "tickets": glpi_mock.tickets,
+            "followups": glpi_mock.followups,
+            "requests": glpi_mock.requests,
+        },
+    })
+
+    if dispatcher:
+        report.update({
+            "shards": dispatcher.stats(),
+            "shard_workers": {
+                shard: {
+                    "message_latency": st["metrics"].get("message_seconds", {}).get("all", {}),
+                    "results": st["metrics"].get("messages_total", {}),
+                    "reply_sources": st["metrics"].get("replies_total", {}),
+                    "overload_acks": st["metrics"].get("overload_acks_total", {}).get("total", 0),
+                    "customers": st["datasets"],
+                    "bedrock": st["bedrock"],
+                }
+                for shard, st in sorted(shard_stats.items())
+            },
+        })
+        dispatcher.stop()
+        # RUSAGE_CHILDREN covers workers once they have exited
+        report["memory"] = {
+            "rss_start_mb": rss_start, "peak_rss_mb": _rss_mb(),
+            "peak_worker_rss_mb": _children_rss_mb(),
+        }
+    else:
+        ticket_queue.stop()
+        pipeline.close()
+        smtp.close()
+        snapshot_metrics = metrics.snapshot()
+        report.update({
+            "stage_latency": snapshot_metrics.get("stage_seconds", {}),
+            "message_latency": snapshot_metrics.get("message_seconds", {}).get("all", {}),
+            "results": snapshot_metrics.get("messages_total", {}),
+            "reply_sources": snapshot_metrics.get("replies_total", {}),
+            "schedule_wait": snapshot_metrics.get("schedule_wait_seconds", {}),
+            "overload_acks": snapshot_metrics.get("overload_acks_total", {}).get("total", 0),
+            "bedrock": {
+                "stub_calls": stub.calls,
+                "stub_throttled": stub.throttled,
+                "stub_slow": stub.slow,
+                "stub_failed": stub.failed,
+                "invoker": bedrock_gen.bedrock_invoker.stats(),
+                "hedging": bedrock_gen.hedged_invoker.stats() if bedrock_gen.hedged_invoker else None,
+            },
+            "bedrock_latency": snapshot_metrics.get("bedrock_seconds", {}).get("all", {}),
+            "reply_cache": bedrock_gen.reply_cache.stats(),
+            "pending_glpi_ops": ticket_queue.pending(),
+            "body_extraction": body_extractor.stats(),
+            "memory": {"rss_start_mb": rss_start, "peak_rss_mb": _rss_mb()},
+        })
+        report["smtp"].update(smtp.stats)
+
+    sink.shutdown()
+    glpi_mock.shutdown()
+    return report
+
+
+# -----------------------------------------------------------
+# REGRESSION CHECK
+# -----------------------------------------------------------
+
+def compare(report, baseline, max_regression):
+    """Return a list of regressions beyond max_regression (a fraction)."""
+    problems = []
+
+    def check(name, new, old, higher_is_better):
+        if not old or new is None:
+            return
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        if worse > max_regression:
+            problems.append(f"{name}: {old} → {new} ({change:+.1%})")
+
+    check("throughput_msgs_per_s", report["throughput_msgs_per_s"],
+          baseline.get("throughput_msgs_per_s"), True)
+    check("message p95", report["message_latency"].get("p95"),
+          baseline.get("message_latency", {}).get("p95"), False)
+    check("peak_rss_mb", report["memory"]["peak_rss_mb"],
+          baseline.get("memory", {}).get("peak_rss_mb"), False)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end bot benchmark")
+    parser.add_argument("--customers", type=int, default=20_000)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--fetch-batch", type=int, default=50)
+    parser.add_argument("--generate-workers", type=int, default=DEFAULT_CONCURRENCY["generate"])
+    parser.add_argument("--send-workers", type=int, default=DEFAULT_CONCURRENCY["send"])
+    parser.add_argument("--shards", type=int, default=1, help="worker processes (sharded mode)")
+    parser.add_argument("--max-in-flight", type=int, default=16)
+    parser.add_argument("--overload-threshold", type=int, default=0)
+    parser.add_argument("--coalesce-window", type=int, default=120)
+    parser.add_argument("--repeat-share", type=float, default=0.0,
+                        help="share of messages re-asking an earlier question (reply cache workload)")
+    parser.add_argument("--bedrock-latency", type=float, default=0.8)
+    parser.add_argument("--bedrock-jitter", type=float, default=0.3)
+    parser.add_argument("--throttle-rate", type=float, default=0.05)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of primary calls in the slow tail")
+    parser.add_argument("--slow-latency", type=float, default=10.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of primary calls that error")
+    parser.add_argument("--hedge", action="store_true", help="add a healthy fallback route and hedge to it")
+    parser.add_argument("--hedge-after", type=float, default=2.0, help="hedge delay until p95 is known")
+    parser.add_argument("--bedrock-rpm", type=int, default=600)
+    parser.add_argument("--bedrock-tpm", type=int, default=1_000_000)
+    parser.add_argument("--bedrock-concurrency", type=int, default=8)
+    parser.add_argument("--bedrock-deadline", type=float, default=60)
+    parser.add_argument("--glpi-latency", type=float, default=0.02)
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--out", help="also write the JSON report here")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("ticket_logger").setLevel(logging.WARNING)
+    report = run(args)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.max_regression)
+
+    text = json.dumps(report, indent=2, default=str, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
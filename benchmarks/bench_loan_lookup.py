@@ -0,0 +1,61 @@
+import argparse
+import json
+import random
+import time
+
+from app.loan_store import LoanStore
+from benchmarks.synthetic import make_datasets
+
+
+# -----------------------------------------------------------
+# BASELINE (pre-LoanStore path, per-call pandas filtering)
+# -----------------------------------------------------------
+
+def pandas_find_loan_details(customer_id, fees_df, loans_df):
+    loan_row = loans_df[loans_df["customer_id"] == customer_id]
+    if loan_row.empty:
+        return None
+
+    loan_row = loan_row.iloc[0].to_dict()
+
+    fee_row = fees_df[fees_df["loan_id"] == loan_row["loan_id"]]
+    loan_row["fees"] = fee_row.iloc[0].to_dict() if not fee_row.empty else {}
+
+    return loan_row
+
+
+def _time_per_call(fn, ids):
+    started = time.perf_counter()
+    for cid in ids:
+        fn(cid)
+    return (time.perf_counter() - started) / len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LoanStore vs pandas lookup")
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    customers, fees, loans = make_datasets(args.customers)
+    ids = [random.randint(1, args.customers) for _ in range(args.lookups)]
+
+    started = time.perf_counter()
+    store = LoanStore.from_dataframes(loans, fees)
+    build_seconds = time.perf_counter() - started
+
+    pandas_s = _time_per_call(lambda c: pandas_find_loan_details(c, fees, loans), ids)
+    store_s = _time_per_call(store.lookup, ids * 100)
+
+    print(json.dumps({
+        "customers": args.customers,
+        "loans": len(loans),
+        "store_build_seconds": round(build_seconds, 4),
+        "pandas_us_per_lookup": round(pandas_s * 1e6, 2),
+        "store_us_per_lookup": round(store_s * 1e6, 3),
+        "speedup": round(pandas_s / store_s, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,473 @@
+import io
+import itertools
+import json
+import random
+import re
+import socket
+import socketserver
+import threading
+import time
+from email import policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from botocore.exceptions import ClientError
+
+
+# -----------------------------------------------------------
+# FAKE IMAP MAILBOX
+# -----------------------------------------------------------
+
+def _bodystructure(part):
+    """BODYSTRUCTURE text for an email.message.Message (enough for our corpus)."""
+    if part.is_multipart():
+        children = "".join(_bodystructure(p) for p in part.get_payload())
+        boundary = part.get_boundary() or "b"
+        return f'({children} "{part.get_content_subtype().upper()}" ("BOUNDARY" "{boundary}") NIL NIL)'
+
+    maintype = part.get_content_maintype().upper()
+    subtype = part.get_content_subtype().upper()
+    charset = part.get_content_charset()
+    params = f'("CHARSET" "{charset}")' if charset else "NIL"
+    encoding = (part.get("Content-Transfer-Encoding") or "7BIT").upper()
+    body = part.get_payload().encode() if isinstance(part.get_payload(), str) else b""
+    disposition = "NIL"
+    if part.get_content_disposition() == "attachment":
+        disposition = f'("ATTACHMENT" ("FILENAME" "{part.get_filename() or "file"}"))'
+
+    if maintype == "TEXT":
+        lines = body.count(b"\n") + 1
+        return (f'("TEXT" "{subtype}" {params} NIL NIL "{encoding}" {len(body)} {lines} '
+                f'NIL {disposition} NIL)')
+    return f'("{maintype}" "{subtype}" {params} NIL NIL "{encoding}" {len(body)} NIL {disposition} NIL)'
+
+
+def _split(raw):
+    header, _, body = raw.partition(b"\r\n\r\n")
+    return header + b"\r\n\r\n", body
+
+
+class _StoredMessage:
+    """One mailbox entry with its IMAP sections precomputed."""
+
+    def __init__(self, uid, msg):
+        self.uid = uid
+        self.seen = False
+        self.structure = _bodystructure(msg).encode()
+        self.sections = {}
+
+        header, text = _split(msg.as_bytes(policy=policy.SMTP))
+        self.sections["HEADER"] = header
+        self.sections["TEXT"] = text
+        if msg.is_multipart():
+            self._index(msg, "")
+
+    def _index(self, part, prefix):
+        for i, child in enumerate(part.get_payload(), 1):
+            path = f"{prefix}{i}"
+            mime, body = _split(child.as_bytes(policy=policy.SMTP))
+            self.sections[f"{path}.MIME"] = mime
+            self.sections[path] = body
+            if child.is_multipart():
+                self._index(child, path + ".")
+
+
+class FakeImapMailbox:
+    """In-memory INBOX shared by every FakeImapConnection."""
+
+    def __init__(self, messages=(), uidvalidity=1, idle=False):
+        self.uidvalidity = uidvalidity
+        self.idle = idle
+        self._messages = {}
+        self._next_uid = 1
+        self._idlers = set()   # connections inside IDLE
+        self._lock = threading.Lock()
+        for msg in messages:
+            self.append(msg)
+
+    def append(self, msg):
+        with self._lock:
+            uid = self._next_uid
+            self._next_uid += 1
+            self._messages[uid] = _StoredMessage(uid, msg)
+            for conn in self._idlers:
+                conn.push(b"* %d EXISTS" % len(self._messages))
+        return uid
+
+    def unseen(self):
+        with self._lock:
+            return sum(1 for m in self._messages.values() if not m.seen)
+
+    def connect(self, server=None):
+        """ImapSession(connect=mailbox.connect) hands out connections."""
+        return FakeImapConnection(self, idle=self.idle)
+
+
+class FakeImapConnection:
+    """
+    The subset of imaplib.IMAP4 the bot uses. FETCH data comes back in
+    imaplib's [(prefix, literal), ..., b")"] shape so the real parser
+    runs. Without idle, ImapSession falls back to NOOP polling; with it,
+    the raw IDLE exchange (send / readline on .file / select on .sock)
+    runs over a socketpair and the mailbox pushes "* n EXISTS" on
+    append. Mail that arrived outside IDLE is announced in the same
+    write as the "+ idling" continuation, as real servers do.
+    """
+
+    def __init__(self, mailbox, idle=False):
+        self.mailbox = mailbox
+        self.commands = 0
+        self.capabilities = ("IMAP4REV1", "IDLE") if idle else ("IMAP4REV1",)
+        self.sock = self._server = self.file = None
+        self._tags = itertools.count(1)
+        self._idle_tag = None
+        self._announced = 0   # message count the client has been told about
+        if idle:
+            self.sock, self._server = socket.socketpair()
+            self.file = self.sock.makefile("rb")
+
+    def login(self, user, password):
+        return "OK", [b"LOGIN completed"]
+
+    def select(self, mailbox="INBOX"):
+        self._announced = len(self.mailbox._messages)
+        return "OK", [str(self._announced).encode()]
+
+    def response(self, code):
+        if code == "UIDVALIDITY":
+            return code, [str(self.mailbox.uidvalidity).encode()]
+        return code, [None]
+
+    def noop(self):
+        return "OK", [b"NOOP completed"]
+
+    def close(self):
+        return "OK", [b""]
+
+    def logout(self):
+        return "BYE", [b""]
+
+    def shutdown(self):
+        if self.sock is not None:
+            self.file.close()
+            self.sock.close()
+
+    # raw IDLE exchange, as imaplib exposes it
+    def _new_tag(self):
+        return b"A%03d" % next(self._tags)
+
+    def send(self, data):
+        line = data.strip()
+        with self.mailbox._lock:
+            if line.endswith(b" IDLE"):
+                self._idle_tag = line.split()[0]
+                self.mailbox._idlers.add(self)
+                count = len(self.mailbox._messages)
+                if count > self._announced:
+                    self._announced = count
+                    self.push(b"+ idling\r\n* %d EXISTS" % count)
+                else:
+                    self.push(b"+ idling")
+            elif line == b"DONE" and self._idle_tag:
+                self.mailbox._idlers.discard(self)
+                self.push(self._idle_tag + b" OK IDLE terminated")
+                self._idle_tag = None
+
+    def readline(self):
+        return self.file.readline()
+
+    def push(self, line):
+        """Server → client line(s) (untagged data or a tagged response)."""
+        if line.startswith(b"* ") and line.endswith(b"EXISTS"):
+            self._announced = int(line.split()[1])
+        try:
+            self._server.sendall(line + b"\r\n")
+        except OSError:
+            pass
+
+    def drop(self, bye=True):
+        """Server side hangs up, optionally saying BYE first."""
+        with self.mailbox._lock:
+            self.mailbox._idlers.discard(self)
+        if bye:
+            self.push(b"* BYE server shutting down")
+        self._server.close()
+
+    def uid(self, command, *args):
+        self.commands += 1
+        command = command.upper()
+        with self.mailbox._lock:
+            if command == "SEARCH":
+                return self._search(args[-1])
+            if command == "FETCH":
+                return self._fetch(args[0], args[1])
+            if command == "STORE":
+                for uid in map(int, args[0].split(",")):
+                    self.mailbox._messages[uid].seen = True
+                return "OK", [b""]
+        return "NO", [b"unsupported"]
+
+    def _search(self, criteria):
+        # "UID <set>" with comma-separated numbers and n:m / n:* ranges
+        ranges = [(1, float("inf"))]
+        m = re.search(r"UID ([\d,:*]+)", criteria)
+        if m:
+            ranges = []
+            for part in m.group(1).split(","):
+                low, _, high = part.partition(":")
+                ranges.append((int(low), float("inf") if high == "*" else int(high or low)))
+        uids = [
+            u for u, msg in self.mailbox._messages.items()
+            if not msg.seen and any(lo <= u <= hi for lo, hi in ranges)
+        ]
+        return "OK", [" ".join(map(str, uids)).encode()]
+
+    def _fetch(self, uid_set, spec):
+        uids = [int(u) for u in uid_set.split(",")]
+        sections = re.findall(r"BODY\.PEEK\[([^\]]+)\]", spec)
+        data = []
+        for seq, uid in enumerate(uids, 1):
+            stored = self.mailbox._messages.get(uid)
+            if stored is None:
+                continue
+            if not sections:
+                data.append(b"%d (UID %d BODYSTRUCTURE %s)" % (seq, uid, stored.structure))
+                continue
+            for i, name in enumerate(sections):
+                literal = stored.sections.get(name, b"")
+                lead = b"%d (UID %d " % (seq, uid) if i == 0 else b" "
+                data.append((lead + b"BODY[%s] {%d}" % (name.encode(), len(literal)), literal))
+            data.append(b")")
+        return "OK", data
+
+
+# -----------------------------------------------------------
+# SMTP SINK
+# -----------------------------------------------------------
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self._reply("220 sink ESMTP ready")
+        mail_from, rcpts = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode(errors="replace").strip()
+            verb = cmd.split(" ", 1)[0].upper()
+
+            if verb in ("EHLO", "HELO"):
+                self._reply("250 sink")
+            elif verb == "MAIL":
+                mail_from, rcpts = cmd, []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                rcpts.append(cmd)
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk == b".\r\n":
+                        break
+                    size += len(chunk)
+                self.server.record(mail_from, rcpts, size)
+                self._reply("250 OK queued")
+            elif verb in ("RSET", "NOOP"):
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Plain-text SMTP server on 127.0.0.1 that counts delivered messages."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _SmtpHandler)
+        self.delivered = 0
+        self.bytes = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def get_request(self):
+        with self._lock:
+            self.connections += 1
+        return super().get_request()
+
+    def record(self, mail_from, rcpts, size):
+        with self._lock:
+            self.delivered += 1
+            self.bytes += size
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True).start()
+        return self
+
+
+# -----------------------------------------------------------
+# BEDROCK STUB
+# -----------------------------------------------------------
+
+class BedrockStub:
+    """
+    invoke_model() stand-in: sleeps latency ± jitter and raises a
+    ThrottlingException with probability throttle_rate. A slow_rate
+    share of calls take slow_latency instead (the tail), and fail_rate
+    of calls fail with fail_code (by default a 503, i.e. an unhealthy
+    route; a ValidationException models a rejected request instead).
+    """
+
+    def __init__(self, latency=0.8, jitter=0.3, throttle_rate=0.0, output_tokens=180, seed=11,
+                 slow_rate=0.0, slow_latency=10.0, fail_rate=0.0,
+                 fail_code="ServiceUnavailableException"):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.fail_rate = fail_rate
+        self.fail_code = fail_code
+        self.output_tokens = output_tokens
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.slow = 0
+        self.failed = 0
+
+    def invoke_model(self, modelId, body, **kwargs):
+        with self._lock:
+            self.calls += 1
+            roll = self._rng.random()
+            throttle = roll < self.throttle_rate
+            fail = not throttle and roll < self.throttle_rate + self.fail_rate
+            slow = self._rng.random() < self.slow_rate
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            if slow:
+                delay = self.slow_latency
+            self.throttled += throttle
+            self.failed += fail
+            self.slow += slow and not (throttle or fail)
+
+        if throttle or fail:
+            time.sleep(0.02)
+            code = "ThrottlingException" if throttle else self.fail_code
+            raise ClientError({"Error": {"Code": code, "Message": "stub error"}}, "InvokeModel")
+        time.sleep(delay)
+
+        request = json.loads(body)
+        prompt_chars = len(request.get("system", "")) + sum(
+            len(m["content"]) for m in request.get("messages", [])
+        )
+        text = (
+            "Dear Customer,\n\nThank you for reaching out. Here is the information "
+            "you asked for based on your loan records.\n\nRegards,\nBank Support Team"
+        )
+        out = {
+            "content": [{"type": "text", "text": text}],
+            "usage": {"input_tokens": prompt_chars // 4, "output_tokens": self.output_tokens},
+        }
+        return {"body": io.BytesIO(json.dumps(out).encode())}
+
+
+# -----------------------------------------------------------
+# GLPI MOCK SERVER
+# -----------------------------------------------------------
+
+class _GlpiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like real GLPI behind Apache
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _route(self, method):
+        server = self.server
+        path = self.path.split("?", 1)[0].strip("/")
+        payload = self._read_body()
+        server.count(method, path)
+        time.sleep(server.latency)
+
+        if path == "initSession":
+            return self._send(200, {"session_token": "bench-token"})
+        if path == "killSession":
+            return self._send(200, {})
+        if path == "search/Ticket":
+            return self._send(200, {"totalcount": 0, "count": 0, "data": []})
+        if method == "POST" and path == "Ticket":
+            return self._send(201, {"id": server.new_ticket(payload)})
+        if method == "POST" and re.fullmatch(r"Ticket/\d+/ITILFollowup", path):
+            return self._send(201, {"id": server.new_followup()})
+        if method == "PUT" and re.fullmatch(r"Ticket/\d+", path):
+            return self._send(200, [{path.split("/")[1]: True}])
+        return self._send(404, ["ERROR_RESOURCE_NOT_FOUND_NOR_COMMONDBTM", ""])
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class GlpiMockServer(ThreadingHTTPServer):
+    """Minimal GLPI REST API (session, tickets, follow-ups, close, search)."""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.02):
+        super().__init__((host, port), _GlpiHandler)
+        self.latency = latency
+        self.requests = {}
+        self.tickets = 0
+        self.followups = 0
+        self._lock = threading.Lock()
+
+    def count(self, method, path):
+        key = method + " " + re.sub(r"/\d+", "/<id>", path)
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def new_ticket(self, payload):
+        with self._lock:
+            self.tickets += 1
+            return 1000 + self.tickets
+
+    def new_followup(self):
+        with self._lock:
+            self.followups += 1
+            return self.followups
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="glpi-mock", daemon=True).start()
+        return self
@@ -0,0 +1,141 @@
+import random
+import time
+
+import pandas as pd
+
+STATUSES = ["Paid", "Pending", "Overdue"]
+
+
+# -----------------------------------------------------------
+# SYNTHETIC DATASETS
+# -----------------------------------------------------------
+
+def make_datasets(n_customers=10_000, loans_per_customer=1.2, seed=7):
+    """
+    Build customers / fees / loans frames shaped like the S3 sheets.
+
+    loans_per_customer > 1 gives a share of customers several loans.
+    """
+    rng = random.Random(seed)
+
+    customers = pd.DataFrame({
+        "customer_id": range(1, n_customers + 1),
+        "name": [f"Customer {i}" for i in range(1, n_customers + 1)],
+        "email": [f"customer{i}@example.com" for i in range(1, n_customers + 1)],
+    })
+
+    loan_rows = []
+    loan_id = 100_000
+    extra_share = max(loans_per_customer - 1, 0)
+    for cid in range(1, n_customers + 1):
+        count = 1 + (1 if rng.random() < extra_share else 0)
+        for _ in range(count):
+            loan_id += 1
+            loan_rows.append({
+                "loan_id": loan_id,
+                "customer_id": cid,
+                "emi_due_date": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                "emi_amount": rng.randint(2_000, 60_000),
+                "emi_status": rng.choice(STATUSES),
+                "last_payment_date": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            })
+    loans = pd.DataFrame(loan_rows)
+
+    fees = pd.DataFrame({
+        "loan_id": loans["loan_id"],
+        "late_fee": [rng.choice([0, 250, 500]) for _ in range(len(loans))],
+        "processing_fee": [rng.choice([999, 1499]) for _ in range(len(loans))],
+        "penalty": [rng.choice([0, 0, 100]) for _ in range(len(loans))],
+    })
+
+    return customers, fees, loans
+
+
+# -----------------------------------------------------------
+# SYNTHETIC MAIL CORPUS
+# -----------------------------------------------------------
+
+STRUCTURED_QUESTIONS = [
+    "When is my next EMI due?",
+    "What is my EMI amount?",
+    "Can you share the fee details for my loan?",
+    "Has my last EMI payment been received? What is the status?",
+]
+FREEFORM_QUESTIONS = [
+    "I was charged a penalty even though I paid on time. Why is that?",
+    "Can I extend my loan tenure? My income has changed recently.",
+    "I want to know the foreclosure charges if I close the loan early.",
+    "The EMI amount debited this month looks wrong, please check.",
+]
+CLOSE_MESSAGES = ["Thanks, the issue is resolved. You can close the ticket."]
+
+QUOTED_THREAD = (
+    "\n\nOn Mon, 12 Oct 2026 at 10:00, Bank Support <support@bank.example> wrote:\n"
+    + "> Dear Customer,\n> Thank you for contacting us about your loan.\n" * 20
+)
+SIGNATURE = "\n\nRegards,\n{name}\nSent from my iPhone"
+
+
+def make_corpus(customers, n_messages=500, seed=7, unknown_share=0.05,
+                html_share=0.2, threaded_share=0.3, freeform_share=0.4, close_share=0.03,
+                burst_share=0.1, spacing=5, repeat_share=0.0):
+    """
+    Inbound customer emails for the end-to-end benchmark.
+
+    Mixes template-answerable and free-form questions, HTML-only mail,
+    replies carrying a quoted thread, close requests and unknown senders.
+    A burst_share of messages repeat the previous sender (rapid follow-ups),
+    a repeat_share re-send an earlier customer's question verbatim later on
+    ("did you get my mail?"); Date headers are `spacing` seconds apart.
+    """
+    from email.message import EmailMessage
+    from email.utils import formatdate, make_msgid
+
+    rng = random.Random(seed)
+    rows = customers[["name", "email"]].itertuples(index=False, name=None)
+    people = list(rows)
+
+    base = time.time() - n_messages * spacing
+    messages = []
+    asked = []   # (name, addr, question) sent so far
+    name = addr = None
+    for i in range(n_messages):
+        if repeat_share and asked and rng.random() < repeat_share:
+            name, addr, question = rng.choice(asked)
+        else:
+            if addr is None or rng.random() >= burst_share:
+                if rng.random() < unknown_share:
+                    name, addr = "Stranger", f"stranger{i}@unknown.example"
+                else:
+                    name, addr = rng.choice(people)
+
+            roll = rng.random()
+            if roll < close_share:
+                question = rng.choice(CLOSE_MESSAGES)
+            elif roll < close_share + freeform_share:
+                question = rng.choice(FREEFORM_QUESTIONS)
+            else:
+                question = rng.choice(STRUCTURED_QUESTIONS)
+            if repeat_share and question not in CLOSE_MESSAGES:
+                asked.append((name, addr, question))
+
+        text = f"Hello,\n\n{question}" + SIGNATURE.format(name=name)
+        if rng.random() < threaded_share:
+            text += QUOTED_THREAD
+
+        msg = EmailMessage()
+        msg["From"] = f"{name} <{addr}>"
+        msg["To"] = "support@bank.example"
+        msg["Subject"] = "Loan query"
+        msg["Date"] = formatdate(base + i * spacing)
+        msg["Message-ID"] = make_msgid(domain="bench.example")
+        if rng.random() < html_share:
+            html = "<html><body>" + "".join(
+                f"<p>{line}</p>" for line in text.split("\n") if line
+            ) + "</body></html>"
+            msg.set_content(html, subtype="html")
+        else:
+            msg.set_content(text)
+        messages.append(msg)
+
+    return messages
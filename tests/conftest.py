@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# app modules read STATE_DIR and open logs/ticket.log at import time
+os.environ.setdefault("STATE_DIR", tempfile.mkdtemp(prefix="bankbot-tests-"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.makedirs("logs", exist_ok=True)
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+from app import bedrock_invoker as invoker_module
+from app.bedrock_hedge import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, HedgedInvoker
+from app.bedrock_invoker import BedrockInvoker, BedrockUnavailable
+from benchmarks.standins import BedrockStub
+
+BODY = {"max_tokens": 10, "messages": [{"role": "user", "content": "hi"}]}
+
+
+class Route:
+    """invoke() stand-in: returns `reply`, raises `error`, or blocks on `gate`."""
+
+    def __init__(self, reply=None, error=None, gate=None):
+        self.reply = reply or {"route": "ok"}
+        self.error = error
+        self.gate = gate
+        self.calls = 0
+
+    def invoke(self, model_id, body, deadline=None):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)   # bounded, so a regression fails instead of hanging
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(invoker_module, "BACKOFF_BASE", 0.001)
+
+
+def test_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, cooldown=0.05)
+    for ok in (True, False, True, False):
+        breaker.record(ok)
+    assert breaker.state == OPEN and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()        # one probe at a time
+    breaker.record(True)
+    assert breaker.state == CLOSED
+
+
+def test_breaker_ignores_outcomes_without_verdict():
+    breaker = CircuitBreaker(window=10, min_calls=2, error_rate=0.5, cooldown=0.0)
+    for _ in range(5):
+        breaker.record(None)
+    assert breaker.state == CLOSED and breaker.stats()["error_rate"] == 0.0
+
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    breaker.record(None)              # probe released, no decision
+    assert breaker.state == HALF_OPEN and breaker.allow()
+
+
+def test_rejected_request_is_raised_without_hedging():
+    stub = BedrockStub(latency=0.0, jitter=0.0, fail_rate=1.0, fail_code="ValidationException")
+    fallback = Route()
+    hedged = HedgedInvoker(BedrockInvoker(stub), fallback, initial_hedge_after=1.0)
+
+    for _ in range(12):
+        with pytest.raises(BedrockUnavailable) as info:
+            hedged.invoke("model", BODY)
+        assert info.value.code == "ValidationException"
+
+    assert fallback.calls == 0
+    assert stub.calls == 12            # not retried either
+    stats = hedged.stats()
+    assert stats["rejected"] == 12 and stats["hedged"] == 0
+    assert stats["breaker"] == {"state": CLOSED, "opens": 0, "error_rate": 0.0}
+
+
+def test_unavailable_primary_falls_back_and_trips_breaker():
+    primary = Route(error=BedrockUnavailable("503", code="ServiceUnavailableException"))
+    fallback = Route(reply={"route": "fallback"})
+    hedged = HedgedInvoker(primary, fallback, breaker=CircuitBreaker(min_calls=3), initial_hedge_after=1.0)
+
+    for _ in range(3):
+        assert hedged.invoke("model", BODY) == {"route": "fallback"}
+    assert hedged.breaker.state == OPEN
+
+    assert hedged.invoke("model", BODY) == {"route": "fallback"}
+    assert primary.calls == 3
+    assert hedged.stats()["breaker_fallbacks"] == 1
+
+
+def test_timed_out_primary_counts_against_the_breaker():
+    primary = Route(error=BedrockUnavailable("deadline exceeded"))
+    hedged = HedgedInvoker(primary, Route(), breaker=CircuitBreaker(min_calls=2), initial_hedge_after=1.0)
+    hedged.invoke("model", BODY)
+    hedged.invoke("model", BODY)
+    assert hedged.breaker.state == OPEN
+
+
+def test_hung_primaries_do_not_starve_the_fallback():
+    gate = threading.Event()
+    primary = Route(gate=gate)
+    fallback = Route(reply={"route": "fallback"})
+    hedged = HedgedInvoker(primary, fallback, initial_hedge_after=0.05, max_workers=1)
+
+    try:
+        started = time.monotonic()
+        for _ in range(3):
+            assert hedged.invoke("model", BODY) == {"route": "fallback"}
+        assert time.monotonic() - started < 2.0
+    finally:
+        gate.set()
@@ -0,0 +1,77 @@
+import io
+import json
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+from app import bedrock_invoker as invoker_module
+from app.bedrock_invoker import BedrockInvoker, BedrockUnavailable, TokenBucket, error_code
+
+BODY = {"max_tokens": 10, "messages": [{"role": "user", "content": "hi"}]}
+
+
+class ScriptedClient:
+    """invoke_model() raising the scripted errors in order, then succeeding."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        out = {"content": [{"text": "ok"}], "usage": {"input_tokens": 3, "output_tokens": 2}}
+        return {"body": io.BytesIO(json.dumps(out).encode())}
+
+
+def _client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": "x"}}, "InvokeModel")
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(invoker_module, "BACKOFF_BASE", 0.001)
+
+
+def test_error_code_for_errors_without_response():
+    assert error_code(_client_error("ThrottlingException")) == "ThrottlingException"
+    assert error_code(ReadTimeoutError(endpoint_url="https://bedrock")) == "ReadTimeoutError"
+    assert error_code(EndpointConnectionError(endpoint_url="https://bedrock")) == "EndpointConnectionError"
+
+    class NoneResponse(Exception):
+        response = None
+
+    assert error_code(NoneResponse()) == "NoneResponse"
+
+
+def test_read_timeout_raises_bedrock_unavailable():
+    invoker = BedrockInvoker(ScriptedClient(ReadTimeoutError(endpoint_url="https://bedrock")))
+    with pytest.raises(BedrockUnavailable):
+        invoker.invoke("model", BODY)
+    assert invoker.stats()["failed"] == 1
+    assert invoker.limiter.in_flight == 0
+
+
+def test_throttling_is_retried_and_halves_concurrency():
+    client = ScriptedClient(_client_error("ThrottlingException"))
+    invoker = BedrockInvoker(client, max_concurrency=8)
+    assert invoker.invoke("model", BODY)["content"][0]["text"] == "ok"
+
+    stats = invoker.stats()
+    assert client.calls == 2
+    assert stats["throttled"] == 1 and stats["retries"] == 1 and stats["succeeded"] == 1
+    assert stats["concurrency_limit"] < 8
+
+
+def test_validation_error_is_not_retried():
+    client = ScriptedClient(_client_error("ValidationException"))
+    with pytest.raises(BedrockUnavailable):
+        BedrockInvoker(client).invoke("model", BODY)
+    assert client.calls == 1
+
+
+def test_token_bucket_refuses_past_deadline():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.take(60, deadline=0)
+    assert not bucket.take(30, deadline=0)
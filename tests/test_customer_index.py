@@ -0,0 +1,51 @@
+import subprocess
+import sys
+
+import pandas as pd
+
+from app.customer_index import CustomerIndex, canonical_email
+
+
+def _index(rows):
+    return CustomerIndex.from_dataframe(pd.DataFrame(rows))
+
+
+def test_plus_tag_stripped_only_on_subaddressing_providers():
+    assert canonical_email("alice+loans@gmail.com") == "alice@gmail.com"
+    assert canonical_email("a.lice@googlemail.com") == "alice@gmail.com"
+    assert canonical_email("alice+loans@outlook.com") == "alice@outlook.com"
+    assert canonical_email("alice+anything@corp.example") == "alice+anything@corp.example"
+
+
+def test_lookup_exact_and_display_name():
+    index = _index([
+        {"customer_id": 1, "name": "Alice", "email": "Alice@Corp.example"},
+        {"customer_id": 2, "name": "Bob", "email": "bob@corp.example"},
+    ])
+    assert index.lookup("Alice <alice@corp.example>")["customer_id"] == 1
+    assert index.lookup("bob@corp.example")["customer_id"] == 2
+    assert index.lookup("nobody@corp.example") is None
+
+
+def test_plus_tag_on_corporate_domain_is_a_different_mailbox():
+    index = _index([{"customer_id": 1, "name": "Alice", "email": "alice@corp.example"}])
+    assert index.lookup("alice+anything@corp.example") is None
+
+
+def test_gmail_aliases_resolve_when_unambiguous():
+    index = _index([{"customer_id": 1, "name": "Alice", "email": "alice.smith@gmail.com"}])
+    assert index.lookup("alicesmith+bank@gmail.com")["customer_id"] == 1
+
+
+def test_first_duplicate_row_wins():
+    index = _index([
+        {"customer_id": 1, "name": "A", "email": "dup@corp.example"},
+        {"customer_id": 2, "name": "B", "email": "dup@corp.example"},
+    ])
+    assert index.lookup("dup@corp.example")["customer_id"] == 1
+
+
+def test_loading_index_does_not_import_bedrock():
+    code = "import sys, app.customer_index; print('app.bedrock_gen' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "False"
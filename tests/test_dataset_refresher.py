@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+from app import dataset_refresher as refresher_module
+from app.dataset_refresher import DatasetRefresher
+from app.metrics import Counter, Histogram
+
+
+class Source:
+    def __init__(self):
+        self.etag = "v1"
+        self.down = False
+
+    def head(self, key):
+        if self.down:
+            raise OSError("bucket unreachable")
+        return self.etag
+
+
+def test_reloads_and_failures_are_exported(monkeypatch):
+    seconds = Histogram("dataset_reload_seconds", "")
+    failures = Counter("dataset_reload_failures_total", "")
+    monkeypatch.setattr(refresher_module, "reload_seconds", seconds)
+    monkeypatch.setattr(refresher_module, "reload_failures", failures)
+    monkeypatch.setattr(refresher_module, "load_datasets", lambda source, cache: ({}, {}))
+
+    source = Source()
+    refresher = DatasetRefresher(
+        source=source, cache=object(),
+        build=lambda frames, etags, version: SimpleNamespace(version=version, etags=etags),
+    )
+    refresher.load_initial()
+    source.etag = "v2"
+    assert refresher.refresh_now()
+    source.down = True
+    assert not refresher.refresh_now()
+
+    assert seconds.snapshot()["all"]["count"] == 2
+    assert failures.snapshot() == {"total": 1}
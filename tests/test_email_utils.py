@@ -0,0 +1,97 @@
+from email.message import EmailMessage
+
+from app.email_utils import (
+    NO_BODY, BodyExtractor, html_to_text, normalize_email, strip_quoted, strip_signature,
+)
+
+
+def _extract(text=None, html=None, max_chars=4000):
+    msg = EmailMessage()
+    msg["From"] = "alice@example.com"
+    if text is not None:
+        msg.set_content(text)
+        if html:
+            msg.add_alternative(html, subtype="html")
+    elif html is not None:
+        msg.set_content(html, subtype="html")
+    return BodyExtractor(max_chars=max_chars).extract(msg)
+
+
+def test_normalize_email():
+    assert normalize_email("Alice <Alice@Example.COM>") == "alice@example.com"
+    assert normalize_email("  bob@example.com ") == "bob@example.com"
+    assert normalize_email("no address") is None
+    assert normalize_email(None) is None
+
+
+# -----------------------------------------------------------
+# Signatures
+# -----------------------------------------------------------
+
+def test_opening_thanks_keeps_the_question():
+    assert strip_signature("Hi,\nThanks\nWhat is my late fee?").strip().endswith("What is my late fee?")
+    assert _extract("Hi,\nThanks\nWhat is my late fee?") == "Hi,\nThanks\nWhat is my late fee?"
+
+
+def test_thanks_before_a_request_sentence_is_kept():
+    text = "Hi,\nThank you\nPlease check my account and send the statement."
+    assert strip_signature(text) == text
+
+
+def test_trailing_sign_off_and_name_block_removed():
+    text = (
+        "Hi,\nWhat is my late fee?\n\nThanks,\nAlice Smith\n"
+        "Senior Manager, Acme Corp\n+91 98765 43210"
+    )
+    assert strip_signature(text).strip() == "Hi,\nWhat is my late fee?"
+
+
+def test_sign_off_without_content_above_is_kept():
+    assert strip_signature("Thanks\nAlice") == "Thanks\nAlice"
+
+
+def test_mobile_footer_and_disclaimer_removed():
+    text = (
+        "When is my EMI due?\n\nSent from my iPhone\n\n"
+        "This email is confidential and intended solely for the addressee."
+    )
+    assert strip_signature(text).strip() == "When is my EMI due?"
+
+
+# -----------------------------------------------------------
+# Quoted replies and HTML
+# -----------------------------------------------------------
+
+def test_quoted_thread_removed():
+    text = (
+        "Is my payment received?\n\nOn Mon, 12 Oct 2026 at 10:00, Bank Support "
+        "<support@bank.example> wrote:\n> Dear Customer,\n> Thank you."
+    )
+    assert strip_quoted(text).strip() == "Is my payment received?"
+
+
+def test_outlook_header_block_removed():
+    text = "Fee details please\n\nFrom: Bank Support\nSent: Monday\nTo: Alice\nSubject: Re: Loan"
+    assert strip_quoted(text).strip() == "Fee details please"
+
+
+def test_html_quote_and_tags_removed():
+    html = (
+        "<html><head><style>p{}</style></head><body><p>What&#39;s my EMI?</p>"
+        '<div class="gmail_quote">On Mon ... wrote: old text</div></body></html>'
+    )
+    assert html_to_text(html).strip() == "What's my EMI?"
+
+
+def test_plain_part_preferred_over_html():
+    assert _extract("plain text", html="<p>html text</p>") == "plain text"
+
+
+def test_html_only_mail():
+    assert _extract(html="<p>Line one</p><p>Line two</p>") == "Line one\nLine two"
+
+
+def test_quote_only_reply_keeps_original_and_truncation():
+    assert _extract("> only quoted") == "> only quoted"
+    assert _extract("x" * 50, max_chars=10) == "x" * 10 + " …"
+    assert _extract("") == NO_BODY
@@ -0,0 +1,31 @@
+import json
+
+from app import glpi_handler
+from app.glpi_handler import process_ticketing, ticket_queue, ticket_states
+
+
+def _ops():
+    return [
+        (op, json.loads(payload))
+        for op, payload in ticket_queue._db.execute("SELECT op, payload FROM ops ORDER BY id")
+    ]
+
+
+def test_new_ticket_carries_the_reference_given_to_the_customer():
+    ref, reply = process_ticketing("new@x.example", "What is my fee?", "Your fee is 500.", ["fee_query"])
+
+    assert ref.startswith("P-")
+    assert f"#{ref} (provisional)" in reply
+    op, payload = [o for o in _ops() if o[0] == "create"][-1]
+    assert f"Reference: {ref}" in payload["description"]
+    assert payload["title"] == glpi_handler.title_for("new@x.example")
+
+
+def test_followup_and_close_use_the_open_ticket():
+    ref, _ = process_ticketing("open@x.example", "When is my EMI due?", "On the 5th.", ["emi_due"])
+    again, reply = process_ticketing("open@x.example", "And the amount?", "2000.", ["emi_amount"])
+    assert again == ref and "follow-up" in reply
+
+    closed, reply = process_ticketing("open@x.example", "Thanks, issue resolved", "", [])
+    assert closed == ref and "has been closed" in reply
+    assert ticket_states.open_ticket("open@x.example") is None
@@ -0,0 +1,96 @@
+import threading
+import time
+from email.message import Message
+
+import pytest
+
+from app import imap_session as session_module
+from app.imap_session import ImapSession
+from benchmarks.standins import FakeImapMailbox
+
+
+def make_msg(n):
+    msg = Message()
+    msg["From"] = f"customer{n}@example.com"
+    msg["Subject"] = "Question"
+    msg["Message-ID"] = f"<m{n}@example.com>"
+    msg.set_payload("When is my EMI due?")
+    return msg
+
+
+def later(seconds, fn, *args):
+    timer = threading.Timer(seconds, fn, args)
+    timer.start()
+    return timer
+
+
+@pytest.fixture
+def mailbox():
+    return FakeImapMailbox(idle=True)
+
+
+def test_idle_wakes_up_on_new_mail(mailbox):
+    with ImapSession("imap", "bot", "pw", connect=mailbox.connect) as session:
+        later(0.1, mailbox.append, make_msg(1))
+        assert session.wait_for_mail(timeout=5) is True
+
+        # IDLE was ended with DONE and its tagged reply consumed
+        assert not mailbox._idlers
+        assert session.reconnects == 0
+        assert session.call(lambda conn: conn.uid("SEARCH", None, "UNSEEN"))[1] == [b"1"]
+
+
+def test_idle_times_out_without_mail(mailbox):
+    with ImapSession("imap", "bot", "pw", connect=mailbox.connect) as session:
+        assert session.wait_for_mail(timeout=0.2) is False
+        assert not mailbox._idlers
+
+        # the connection is still usable for the next IDLE
+        later(0.1, mailbox.append, make_msg(1))
+        assert session.wait_for_mail(timeout=5) is True
+
+
+@pytest.mark.parametrize("bye", [True, False])
+def test_server_hangup_during_idle_reconnects(mailbox, bye):
+    with ImapSession("imap", "bot", "pw", connect=mailbox.connect) as session:
+        first = session.conn
+        later(0.1, first.drop, bye)
+        assert session.wait_for_mail(timeout=5) is True   # fetch anyway, mail may be waiting
+        assert session.reconnects == 1
+        assert session.conn is not first
+
+
+def test_call_retries_once_on_a_dropped_link(mailbox):
+    calls = []
+
+    def flaky(conn):
+        calls.append(conn)
+        if len(calls) == 1:
+            raise OSError("connection reset")
+        return "ok"
+
+    with ImapSession("imap", "bot", "pw", connect=mailbox.connect) as session:
+        assert session.call(flaky) == "ok"
+        assert session.reconnects == 1
+        assert calls[0] is not calls[1]
+
+
+def test_polls_with_noop_without_idle(monkeypatch):
+    monkeypatch.setattr(session_module.time, "sleep", lambda s: None)
+    mailbox = FakeImapMailbox()
+    with ImapSession("imap", "bot", "pw", connect=mailbox.connect, poll_interval=10) as session:
+        assert session.wait_for_mail(timeout=0.1) is True
+        assert "IDLE" not in session.conn.capabilities
+
+
+def test_exists_sent_with_the_idle_continuation(mailbox):
+    # mail that lands between the last fetch and IDLE is announced in the
+    # same packet as "+ idling"; it sits in imaplib's buffer, not the socket
+    with ImapSession("imap", "bot", "pw", connect=mailbox.connect) as session:
+        session.conn
+        mailbox.append(make_msg(1))
+
+        started = time.monotonic()
+        assert session.wait_for_mail(timeout=3) is True
+        assert time.monotonic() - started < 1.0
+        assert not mailbox._idlers
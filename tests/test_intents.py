@@ -0,0 +1,41 @@
+import json
+
+from app.intents import IntentEngine, tokenize
+
+
+def _engine():
+    return IntentEngine.from_config()
+
+
+def test_whole_words_only():
+    assert _engine().classify("I pay a premium every month") == ["general_query"]
+
+
+def test_multi_word_phrases_and_config_order():
+    assert _engine().classify("What is the late fee and my EMI amount?") == [
+        "emi_due_date", "emi_amount", "fee_details",
+    ]
+
+
+def test_possessives_and_contractions():
+    engine = _engine()
+    assert tokenize("What's my EMI’s amount") == ["what", "my", "emi", "amount"]
+    assert engine.classify("When is my EMI's payment due") == ["emi_due_date"]
+    assert engine.classify("what's my emi's amount") == ["emi_due_date", "emi_amount"]
+    assert engine.classify("the loan's statement") == ["loan_statement"]
+
+
+def test_fallback_and_batch_dedupe():
+    engine = _engine()
+    out = engine.classify_batch(["hello", "fees?", "hello"])
+    assert out == [["general_query"], ["fee_details"], ["general_query"]]
+    out[0].append("mutated")
+    assert engine.classify_batch(["hello"]) == [["general_query"]]
+
+
+def test_custom_config(tmp_path):
+    path = tmp_path / "intents.json"
+    path.write_text(json.dumps({"fallback": "other", "intents": {"close": ["close my loan"]}}))
+    engine = IntentEngine.from_config(str(path))
+    assert engine.classify("Please close my loan") == ["close"]
+    assert engine.classify("close my account") == ["other"]
@@ -0,0 +1,149 @@
+from email.message import EmailMessage
+
+from app.email_utils import extract_email_body
+from app.mail_fetcher import IncrementalFetcher, choose_sections, message_key, parse_fetch
+from benchmarks.standins import FakeImapMailbox
+
+
+def _mail(text, sender="alice@example.com", html=None, attachment=None):
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["Subject"] = "Loan query"
+    msg["Message-ID"] = f"<{abs(hash(text))}@test>"
+    msg.set_content(text)
+    if html:
+        msg.add_alternative(html, subtype="html")
+    if attachment:
+        msg.add_attachment(attachment, maintype="application", subtype="pdf", filename="s.pdf")
+    return msg
+
+
+def _fetcher(tmp_path, mailbox, **kwargs):
+    return IncrementalFetcher(str(tmp_path / "uid.json"), **kwargs), mailbox.connect()
+
+
+# -----------------------------------------------------------
+# Parser
+# -----------------------------------------------------------
+
+def test_parse_fetch_literals_quoted_and_nil():
+    data = [
+        (b'1 (UID 7 BODY[HEADER] {9}', b"From: a\r\n"),
+        b' FLAGS (\\Seen) X-NAME "a \\"b\\"" X-NIL NIL)',
+    ]
+    items = parse_fetch(data)[7]
+    assert items["BODY[HEADER]"] == b"From: a\r\n"
+    assert items["FLAGS"] == [b"\\Seen"]
+    assert items["X-NAME"] == b'a "b"'
+    assert items["X-NIL"] is None
+
+
+def test_parse_fetch_bodystructure_nesting():
+    data = [
+        b'1 (UID 3 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+        b'("TEXT" "HTML" NIL NIL NIL "7BIT" 20 1 NIL NIL NIL) "ALTERNATIVE" NIL NIL NIL))'
+    ]
+    structure = parse_fetch(data)[3]["BODYSTRUCTURE"]
+    assert choose_sections(structure) == "1"
+
+
+def test_choose_sections_skips_attachments_and_prefers_plain():
+    attachment = [b"TEXT", b"PLAIN", None, None, None, b"7BIT", b"5", b"1", None,
+                  [b"ATTACHMENT", [b"FILENAME", b"a.txt"]], None]
+    html = [b"TEXT", b"HTML", None, None, None, b"7BIT", b"5", b"1", None, None, None]
+    assert choose_sections([attachment, html, b"MIXED"]) == "2"
+    assert choose_sections([[b"IMAGE", b"PNG"], b"MIXED"]) is None
+
+
+# -----------------------------------------------------------
+# Fetch
+# -----------------------------------------------------------
+
+def test_fetch_text_part_without_attachment_bytes(tmp_path):
+    mailbox = FakeImapMailbox([
+        _mail("When is my EMI due?"),
+        _mail("Fee details please", html="<p>Fee details please</p>", attachment=b"x" * 5000),
+    ])
+    fetcher, conn = _fetcher(tmp_path, mailbox)
+    uids = fetcher.new_uids(conn)
+    assert uids == [1, 2]
+
+    fetched = fetcher.fetch(conn, uids)
+    assert [uid for uid, _ in fetched] == [1, 2]
+    assert extract_email_body(fetched[0][1]) == "When is my EMI due?"
+    assert extract_email_body(fetched[1][1]) == "Fee details please"
+    assert b"x" * 100 not in fetched[1][1].as_bytes()
+
+
+def test_message_key_falls_back_to_uid():
+    msg = EmailMessage()
+    assert message_key(msg, 9, 4) == "<uid-9-4>"
+    msg["Message-ID"] = "<abc@x>"
+    assert message_key(msg, 9, 4) == "<abc@x>"
+
+
+# -----------------------------------------------------------
+# High-water mark and retries
+# -----------------------------------------------------------
+
+def test_high_water_mark_skips_handled_mail(tmp_path):
+    mailbox = FakeImapMailbox([_mail("one"), _mail("two")])
+    fetcher, conn = _fetcher(tmp_path, mailbox)
+    fetcher.complete(conn, [1, 2], fetcher.new_uids(conn))
+
+    mailbox.append(_mail("three"))
+    assert fetcher.new_uids(conn) == [3]
+    assert IncrementalFetcher(str(tmp_path / "uid.json")).state.last_uid == 2
+
+
+def test_failed_uid_is_fetched_again(tmp_path):
+    mailbox = FakeImapMailbox([_mail("one"), _mail("two"), _mail("three")])
+    fetcher, conn = _fetcher(tmp_path, mailbox, retry_delay=0)
+    fetcher.complete(conn, [1, 3], fetcher.new_uids(conn))
+
+    assert fetcher.state.last_uid == 3
+    assert fetcher.new_uids(conn) == [2]
+
+    # persisted across restarts
+    restarted, _ = _fetcher(tmp_path, mailbox, retry_delay=0)
+    assert restarted.new_uids(conn) == [2]
+
+    fetcher.complete(conn, [2], [2])
+    assert fetcher.new_uids(conn) == []
+    assert fetcher.state.retry == {}
+
+
+def test_retry_waits_for_backoff(tmp_path):
+    mailbox = FakeImapMailbox([_mail("one")])
+    fetcher, conn = _fetcher(tmp_path, mailbox, retry_delay=60)
+    fetcher.complete(conn, [], fetcher.new_uids(conn))
+    assert fetcher.new_uids(conn) == []
+    assert 1 in fetcher.state.retry
+
+
+def test_retry_gives_up_after_limit(tmp_path):
+    mailbox = FakeImapMailbox([_mail("one")])
+    fetcher, conn = _fetcher(tmp_path, mailbox, retries=2, retry_delay=0)
+    for _ in range(3):
+        assert fetcher.new_uids(conn) == [1]
+        fetcher.complete(conn, [], [1])
+    assert fetcher.new_uids(conn) == []
+    assert mailbox.unseen() == 1   # left for manual follow-up
+
+
+def test_retry_dropped_when_read_elsewhere(tmp_path):
+    mailbox = FakeImapMailbox([_mail("one")])
+    fetcher, conn = _fetcher(tmp_path, mailbox, retry_delay=0)
+    fetcher.complete(conn, [], fetcher.new_uids(conn))
+    conn.uid("STORE", "1", "+FLAGS", "(\\Seen)")
+    assert fetcher.new_uids(conn) == []
+    assert fetcher.state.retry == {}
+
+
+def test_uidvalidity_change_resets_state(tmp_path):
+    mailbox = FakeImapMailbox([_mail("one"), _mail("two")])
+    fetcher, conn = _fetcher(tmp_path, mailbox)
+    fetcher.complete(conn, [2], fetcher.new_uids(conn))
+    mailbox.uidvalidity = 2
+    assert fetcher.new_uids(conn) == [1]
+    assert fetcher.state.retry == {}
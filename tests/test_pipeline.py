@@ -0,0 +1,169 @@
+import time
+from email.message import Message
+from email.utils import formatdate
+from types import SimpleNamespace
+
+from app import pipeline as pipeline_module
+from app.bedrock_invoker import BedrockUnavailable
+from app.message_journal import MessageJournal
+from app.pipeline import MailPipeline
+from app.scheduler import ACK_REPLY, PRIORITY_GENERAL, PRIORITY_STRUCTURED
+
+
+def make_msg(sender, body, date=None, subject="Question"):
+    msg = Message()
+    msg["From"] = sender
+    msg["Subject"] = subject
+    msg["Message-ID"] = f"<{abs(hash((sender, body, date)))}@example.com>"
+    msg["Date"] = formatdate(date if date is not None else time.time())
+    msg.set_payload(body)
+    return msg
+
+
+class RecordingPipeline(MailPipeline):
+    """Pipeline whose per-message work only records what it was given."""
+
+    def __init__(self, **kwargs):
+        self.sent = []
+        self.processed = []
+        super().__init__(datasets=None, send=self._send, extract_body=lambda m: m.get_payload(),
+                         **kwargs)
+
+    def _send(self, to_addr, body, original=None):
+        self.sent.append((to_addr, body))
+        return True
+
+    async def _process_message(self, item):
+        self.processed.append(item)
+        item.sent = True
+
+
+def run(pipeline, msgs):
+    return pipeline.process_batch([(n, m, m["Message-ID"]) for n, m in enumerate(msgs)])
+
+
+def test_backdated_date_header_does_not_jump_the_queue():
+    pipeline = RecordingPipeline(max_in_flight=1, overload_threshold=1)
+    structured = make_msg("fresh@example.com", "When is my next EMI due?")
+    backdated = make_msg("old@example.com", "Tell me about your branches", date=86400)
+
+    items = run(pipeline, [structured, backdated])
+    pipeline.close()
+
+    by_sender = {i.from_addr: i for i in items}
+    assert by_sender["fresh@example.com"].priority == PRIORITY_STRUCTURED
+    assert by_sender["old@example.com"].priority == PRIORITY_GENERAL
+    # the general question is the one acknowledged, not the EMI lookup
+    assert pipeline.sent == [("old@example.com", ACK_REPLY)]
+    assert by_sender["old@example.com"].acked
+
+
+# -----------------------------------------------------------
+# Coalescing
+# -----------------------------------------------------------
+
+def test_burst_from_one_sender_becomes_one_request():
+    pipeline = RecordingPipeline(coalesce_window=120)
+    t = time.time() - 60
+    msgs = [
+        make_msg("a@example.com", "When is my next EMI due?", date=t, subject="EMI"),
+        make_msg("a@example.com", "Also what are the late fee charges?", date=t + 30),
+        make_msg("b@example.com", "Tell me about your branches", date=t + 40),
+        make_msg("a@example.com", "And my payment status please", date=t + 50),
+    ]
+    items = run(pipeline, msgs)
+    pipeline.close()
+
+    lead = next(i for i in pipeline.processed if i.from_addr == "a@example.com")
+    assert len(pipeline.processed) == 2
+    assert lead is items[3] and [m.seq for m in lead.merged] == [0, 1]
+    assert lead.body.startswith("[Message 1 of 3: EMI]\nWhen is my next EMI due?")
+    assert set(lead.intents) == {"emi_due_date", "fee_details", "emi_status"}
+
+
+def test_window_and_max_split_runs():
+    pipeline = RecordingPipeline(coalesce_window=60, coalesce_max=2)
+    t = time.time() - 1000
+    msgs = [
+        make_msg("a@example.com", f"question {n}", date=t + d)
+        for n, d in enumerate((0, 10, 20, 500))
+    ]
+    run(pipeline, msgs)
+    pipeline.close()
+
+    # [0, 1] hits coalesce_max, [2] starts a new run, [3] is outside the window
+    runs = [[m.seq for m in (i.merged or [])] + [i.seq] for i in pipeline.processed]
+    assert runs == [[0, 1], [2], [3]]
+
+
+def test_close_request_is_never_merged():
+    pipeline = RecordingPipeline(coalesce_window=120)
+    t = time.time() - 60
+    msgs = [
+        make_msg("a@example.com", "When is my EMI due?", date=t),
+        make_msg("a@example.com", "Thanks, issue resolved", date=t + 5),
+        make_msg("a@example.com", "One more question about fees", date=t + 10),
+    ]
+    run(pipeline, msgs)
+    pipeline.close()
+
+    assert [(i.seq, i.merged) for i in pipeline.processed] == [(0, None), (1, None), (2, None)]
+
+
+def test_coalescing_off_keeps_every_message():
+    pipeline = RecordingPipeline()
+    msgs = [make_msg("a@example.com", f"question {n}") for n in range(3)]
+    run(pipeline, msgs)
+    pipeline.close()
+    assert [i.seq for i in pipeline.processed] == [0, 1, 2]
+
+
+# -----------------------------------------------------------
+# Stages
+# -----------------------------------------------------------
+
+def test_close_request_skips_the_model(monkeypatch):
+    generated, ticketed = [], []
+    monkeypatch.setattr(pipeline_module, "lookup_customer", lambda *a: ({"name": "A"}, [], None))
+    monkeypatch.setattr(pipeline_module, "compose_reply", lambda *a: generated.append(a[1]) or "AI reply")
+    monkeypatch.setattr(
+        pipeline_module, "process_ticketing",
+        lambda **kw: ticketed.append(kw["ai_reply"]) or ("7", kw["ai_reply"] or "Ticket closed"),
+    )
+    sent = []
+    pipeline = MailPipeline(
+        SimpleNamespace(current=SimpleNamespace(customer_index=None, loan_store=None)),
+        send=lambda to, body, original=None: sent.append(body) or True,
+        extract_body=lambda m: m.get_payload(),
+    )
+    run(pipeline, [
+        make_msg("a@example.com", "Thanks, issue resolved"),
+        make_msg("b@example.com", "When is my EMI due?"),
+    ])
+    pipeline.close()
+
+    assert generated == ["When is my EMI due?"]
+    assert ticketed.count(None) == 1 and ticketed.count("AI reply") == 1
+    assert sorted(sent) == ["AI reply", "Ticket closed"]
+
+
+def test_bedrock_outage_leaves_the_message_unanswered(monkeypatch, tmp_path):
+    def unavailable(*a):
+        raise BedrockUnavailable("deadline exceeded")
+
+    monkeypatch.setattr(pipeline_module, "lookup_customer", lambda *a: ({"name": "A"}, [], None))
+    monkeypatch.setattr(pipeline_module, "compose_reply", unavailable)
+    journal = MessageJournal(str(tmp_path / "answered.log"))
+    sent = []
+    pipeline = MailPipeline(
+        SimpleNamespace(current=SimpleNamespace(customer_index=None, loan_store=None)),
+        send=lambda to, body, original=None: sent.append(body) or True,
+        extract_body=lambda m: m.get_payload(),
+        journal=journal,
+    )
+    [item] = run(pipeline, [make_msg("a@example.com", "Tell me about your branches")])
+    pipeline.close()
+
+    # not sent, not journaled: poll_mailbox leaves the UID for a retry
+    assert item.error and not item.sent and not item.skipped
+    assert sent == [] and len(journal) == 0
@@ -0,0 +1,77 @@
+import time
+
+from app.loan_store import LoanRecord
+from app.reply_cache import ReplyCache, cacheable
+
+CUSTOMER = {"customer_id": 1, "name": "Alice"}
+
+
+def _loans(amount=2000):
+    return [LoanRecord(10, 1, "2026-05-01", amount, "Paid", "2026-04-01", fees={"late_fee": 0})]
+
+
+class _Store:
+    def __init__(self, loans):
+        self.loans = loans
+
+    def lookup(self, customer_id):
+        return self.loans
+
+
+def test_only_structured_requests_are_cacheable():
+    assert cacheable(["emi_amount", "fee_details"])
+    assert not cacheable(["general_query"])
+    assert not cacheable(["emi_amount", "general_query"])
+    assert not cacheable([])
+
+
+def test_repeat_question_hits_regardless_of_wording_noise():
+    cache = ReplyCache()
+    key, data_hash = ReplyCache.make_key(CUSTOMER, "Why is my EMI amount wrong?", ["emi_amount"], _loans())
+    cache.put(key, "reply", 1, data_hash)
+
+    again, _ = ReplyCache.make_key(CUSTOMER, "  why is my emi amount WRONG ", ["emi_amount"], _loans())
+    assert cache.get(again) == "reply"
+    assert cache.stats()["hits"] == 1
+
+
+def test_key_changes_with_loan_data_and_customer():
+    key, _ = ReplyCache.make_key(CUSTOMER, "fees?", ["fee_details"], _loans())
+    assert key != ReplyCache.make_key(CUSTOMER, "fees?", ["fee_details"], _loans(amount=3000))[0]
+    assert key != ReplyCache.make_key({"customer_id": 2, "name": "Bob"}, "fees?", ["fee_details"], _loans())[0]
+
+
+def test_lru_eviction_and_ttl():
+    cache = ReplyCache(max_entries=2, ttl=60)
+    cache.put("a", "A", 1, "h")
+    cache.put("b", "B", 1, "h")
+    cache.get("a")
+    cache.put("c", "C", 1, "h")
+    assert cache.get("b") is None and cache.get("a") == "A"
+    assert cache.evictions == 1
+
+    cache.ttl = -1
+    cache.put("d", "D", 1, "h")
+    assert cache.get("d") is None
+
+
+def test_invalidate_stale_drops_changed_customers():
+    cache = ReplyCache()
+    key, data_hash = ReplyCache.make_key(CUSTOMER, "fees?", ["fee_details"], _loans())
+    cache.put(key, "reply", 1, data_hash)
+
+    assert cache.invalidate_stale(_Store(_loans())) == 0
+    assert cache.invalidate_stale(_Store(_loans(amount=9999))) == 1
+    assert cache.get(key) is None
+
+
+def test_persisted_entries_reload(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = ReplyCache(path=path)
+    cache.put("k", "reply", 1, "h")
+    cache.save()
+    assert ReplyCache(path=path).get("k") == "reply"
+
+    cache._entries["k"] = ("reply", 1, "h", time.time() - 1, 10)
+    cache.save()
+    assert ReplyCache(path=path).get("k") is None
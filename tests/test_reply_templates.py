@@ -0,0 +1,22 @@
+from app import reply_templates as templates_module
+from app.metrics import Counter
+from app.reply_templates import TemplateFastPath
+
+CUSTOMER = {"name": "Asha"}
+LOAN = {"loan_id": "L1", "emi_due_date": "05 Nov 2026", "emi_amount": 12000.0,
+        "emi_status": "Paid", "last_payment_date": None, "fees": {}}
+
+
+def test_decisions_are_exported_per_intent(monkeypatch):
+    counter = Counter("fast_path_total", "")
+    monkeypatch.setattr(templates_module, "fast_path_total", counter)
+    fast_path = TemplateFastPath()
+
+    assert fast_path.render(CUSTOMER, [LOAN], "When is my EMI due?", ["emi_due_date"])
+    assert fast_path.render(CUSTOMER, [LOAN], "Why is my EMI wrong?", ["emi_amount"]) is None
+
+    assert counter.snapshot() == {
+        '{intent="emi_due_date",result="fast_path"}': 1,
+        '{intent="emi_amount",result="fallback"}': 1,
+    }
+    assert fast_path.stats()["emi_amount"]["fallback"] == 1
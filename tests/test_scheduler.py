@@ -0,0 +1,60 @@
+import asyncio
+
+from app.scheduler import (
+    PRIORITY_CLOSE, PRIORITY_GENERAL, PRIORITY_STRUCTURED, PriorityScheduler, classify_priority,
+)
+
+
+def admission_order(scheduler, waiters):
+    """Hold the only slot, queue waiters [(name, priority)], return release order."""
+    async def scenario():
+        order = []
+        await scheduler.admit(PRIORITY_GENERAL)
+
+        async def wait(name, priority):
+            await scheduler.admit(priority)
+            order.append(name)
+            scheduler.release()
+
+        tasks = [asyncio.create_task(wait(*w)) for w in waiters]
+        await asyncio.sleep(0)
+        assert scheduler.waiting() == len(waiters)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    return asyncio.run(scenario())
+
+
+def test_classify_priority():
+    assert classify_priority("Thanks, issue resolved", ["general_query"]) == PRIORITY_CLOSE
+    assert classify_priority("When is my EMI due?", ["emi_due_date"]) == PRIORITY_STRUCTURED
+    assert classify_priority("EMI due? Also, branches?", ["emi_due_date", "general_query"]) == PRIORITY_GENERAL
+
+
+def test_higher_priority_classes_go_first():
+    scheduler = PriorityScheduler(max_in_flight=1)
+    order = admission_order(scheduler, [
+        ("general", PRIORITY_GENERAL),
+        ("structured", PRIORITY_STRUCTURED),
+        ("close", PRIORITY_CLOSE),
+        ("structured-2", PRIORITY_STRUCTURED),
+    ])
+    assert order == ["close", "structured", "structured-2", "general"]
+    assert scheduler.in_flight == 0
+
+
+def test_first_come_first_served_within_a_class():
+    scheduler = PriorityScheduler(max_in_flight=1)
+    order = admission_order(scheduler, [(f"general-{n}", PRIORITY_GENERAL) for n in range(4)])
+    assert order == ["general-0", "general-1", "general-2", "general-3"]
+
+
+def test_free_slots_admit_immediately():
+    async def scenario():
+        scheduler = PriorityScheduler(max_in_flight=2)
+        await scheduler.admit(PRIORITY_GENERAL)
+        await scheduler.admit(PRIORITY_GENERAL)
+        return scheduler.in_flight, scheduler.waiting()
+
+    assert asyncio.run(scenario()) == (2, 0)
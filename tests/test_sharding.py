@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from app.history_store import SqliteHistoryStore
+from app.message_journal import MessageJournal
+from app.sharding import LAYOUT_FILE, migrate_state, shard_for, state_dirs
+from app.smtp_sender import OutgoingEmail, SmtpSender
+from app.ticket_queue import TicketQueue
+from app.ticket_state import TicketStateStore
+
+SENDERS = [f"customer{n}@example.com" for n in range(12)]
+
+
+class Glpi:
+    def __init__(self, up=True):
+        self.up = up
+        self.creates = []
+
+    def create_ticket(self, title, description):
+        if not self.up:
+            return None
+        self.creates.append(title)
+        return 500 + len(self.creates)
+
+    def add_followup(self, ticket_id, message):
+        return self.up
+
+    def close_ticket(self, ticket_id):
+        return self.up
+
+
+def seed(path, senders):
+    """Ticket state, history, outbox and journal for senders in one state dir."""
+    states = TicketStateStore(os.path.join(path, "ticket_state.db"))
+    history = SqliteHistoryStore(os.path.join(path, "history.db"))
+    outbox = SmtpSender("localhost", 25, outbox_path=os.path.join(path, "smtp_outbox.db"))
+    journal = MessageJournal(os.path.join(path, "answered_message_ids.log"))
+    for n, sender in enumerate(senders):
+        states.set_open(sender, 100 + n)
+        history.add(sender, "user", f"question from {sender}")
+        outbox._save(OutgoingEmail(sender, "reply"), 0)
+        journal.record(f"<{sender}-msg>")
+    for store in (states, history, journal):
+        store.close()
+    outbox._db.close()
+
+
+def senders_in(path):
+    db = sqlite3.connect(os.path.join(path, "ticket_state.db"))
+    try:
+        return {row[0] for row in db.execute("SELECT sender FROM tickets")}
+    finally:
+        db.close()
+
+
+def column(path, name, table, col):
+    db = sqlite3.connect(os.path.join(path, name))
+    try:
+        return {row[0] for row in db.execute(f"SELECT {col} FROM {table}")}
+    finally:
+        db.close()
+
+
+def test_single_to_sharded_moves_every_sender_to_its_shard(tmp_path):
+    root = str(tmp_path)
+    seed(root, SENDERS)
+
+    migrate_state(root, 4, client=Glpi())
+
+    for n, path in enumerate(state_dirs(root, 4)):
+        owned = {s for s in SENDERS if shard_for(s, 4) == n}
+        assert senders_in(path) == owned
+        assert column(path, "history.db", "messages", "sender") == owned
+        assert column(path, "smtp_outbox.db", "outbox", "to_addr") == owned
+        assert len(MessageJournal(os.path.join(path, "answered_message_ids.log"))) == len(SENDERS)
+    assert senders_in(root) == set()
+    with open(os.path.join(root, LAYOUT_FILE)) as f:
+        assert json.load(f) == {"workers": 4}
+
+
+def test_resharding_and_back_keeps_every_sender_once(tmp_path):
+    root = str(tmp_path)
+    seed(root, SENDERS)
+    migrate_state(root, 4, client=Glpi())
+    migrate_state(root, 2, client=Glpi())
+
+    for n, path in enumerate(state_dirs(root, 2)):
+        assert senders_in(path) == {s for s in SENDERS if shard_for(s, 2) == n}
+    for path in state_dirs(root, 4)[2:]:
+        assert senders_in(path) == set()
+
+    migrate_state(root, 1, client=Glpi())
+    assert senders_in(root) == set(SENDERS)
+    assert column(root, "history.db", "messages", "sender") == set(SENDERS)
+
+
+def test_queued_glpi_ops_are_applied_before_the_split(tmp_path):
+    root = str(tmp_path)
+    seed(root, [])
+    glpi = Glpi()
+    queue = TicketQueue(os.path.join(root, "ticket_queue.db"), client=glpi)
+    states = TicketStateStore(os.path.join(root, "ticket_state.db"))
+    queue.add_listener(states.resolve_ref)
+    ref = queue.new_ref()
+    queue.enqueue_create(ref, "Loan Support Request - a@example.com", "desc")
+    states.set_open("a@example.com", ref)
+
+    migrate_state(root, 2, root_queue=queue, root_states=states, client=glpi)
+
+    assert queue.pending() == 0
+    assert glpi.creates == ["Loan Support Request - a@example.com"]
+    shard = state_dirs(root, 2)[shard_for("a@example.com", 2)]
+    moved = TicketStateStore(os.path.join(shard, "ticket_state.db"))
+    assert moved.open_ticket("a@example.com") == "501"
+    assert states.get("a@example.com") is None
+
+
+def test_refuses_to_split_while_glpi_ops_are_stuck(tmp_path):
+    root = str(tmp_path)
+    seed(root, SENDERS[:3])
+    queue = TicketQueue(os.path.join(root, "ticket_queue.db"), client=Glpi(up=False))
+    queue.enqueue_followup("101", "hello")
+    queue.close()
+
+    with pytest.raises(RuntimeError, match="still queued"):
+        migrate_state(root, 2, client=Glpi(up=False), drain_timeout=0.2)
+
+    assert senders_in(root) == set(SENDERS[:3])
+    assert not os.path.exists(os.path.join(root, LAYOUT_FILE))
+
+
+def test_unchanged_layout_is_left_alone(tmp_path):
+    root = str(tmp_path)
+    migrate_state(root, 2, client=Glpi())
+    queue = TicketQueue(os.path.join(root, "shard-0", "ticket_queue.db"), client=Glpi(up=False))
+    queue.enqueue_followup("101", "hello")
+
+    migrate_state(root, 2, client=Glpi(up=False), drain_timeout=0.2)
+    assert queue.pending() == 1
+
+
+def test_first_recorded_run_in_place_does_not_drain(tmp_path):
+    # single-process state from before layouts were recorded, GLPI down
+    root = str(tmp_path)
+    seed(root, SENDERS[:3])
+    queue = TicketQueue(os.path.join(root, "ticket_queue.db"), client=Glpi(up=False))
+    queue.enqueue_followup("101", "hello")
+
+    migrate_state(root, 1, root_queue=queue, client=Glpi(up=False), drain_timeout=5)
+
+    assert queue.pending() == 1
+    assert senders_in(root) == set(SENDERS[:3])
+    with open(os.path.join(root, LAYOUT_FILE)) as f:
+        assert json.load(f) == {"workers": 1}
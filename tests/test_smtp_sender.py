@@ -0,0 +1,153 @@
+import smtplib
+import time
+
+import pytest
+
+from app import smtp_sender as smtp_module
+from app.smtp_sender import OutgoingEmail, SmtpSender
+
+
+class FakeSmtp:
+    """smtplib.SMTP stand-in; `rules` maps a recipient to the exception it raises."""
+
+    rules = {}
+    delivered = []
+    opened = 0
+
+    def __init__(self, host, port, timeout=None):
+        FakeSmtp.opened += 1
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, text):
+        error = self.rules.get(to_addrs[0])
+        if error is not None:
+            raise error
+        self.delivered.append(to_addrs[0])
+
+    def quit(self):
+        pass
+
+    close = quit
+
+
+@pytest.fixture(autouse=True)
+def fake_smtp(monkeypatch):
+    FakeSmtp.rules, FakeSmtp.delivered, FakeSmtp.opened = {}, [], 0
+    monkeypatch.setattr(smtp_module, "RETRY_BASE_DELAY", 0.05)
+    return FakeSmtp
+
+
+def _sender(tmp_path=None):
+    path = str(tmp_path / "outbox.db") if tmp_path else None
+    return SmtpSender("localhost", 25, starttls=False, smtp_factory=FakeSmtp, outbox_path=path)
+
+
+def _wait(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_session_is_reused():
+    sender = _sender()
+    assert sender.send("a@x.example", "hi") and sender.send("b@x.example", "hi")
+    assert FakeSmtp.opened == 1
+    assert FakeSmtp.delivered == ["a@x.example", "b@x.example"]
+
+
+def test_reply_threads_under_original():
+    original = {"Subject": "Loan query", "Message-ID": "<m1@x>", "References": "<m0@x>"}
+    out = OutgoingEmail.reply_to("a@x.example", "hi", original)
+    assert out.subject == "Re: Loan query"
+    assert out.in_reply_to == "<m1@x>"
+    assert out.references == "<m0@x> <m1@x>"
+
+
+def test_permanent_rejection_only_fails_that_reply():
+    FakeSmtp.rules["bad@x.example"] = smtplib.SMTPRecipientsRefused(
+        {"bad@x.example": (550, b"no such user")}
+    )
+    sender = _sender()
+    batch = [OutgoingEmail(addr, "hi") for addr in ("a@x.example", "bad@x.example", "c@x.example")]
+
+    assert sender.send_many(batch) == 2
+    assert FakeSmtp.delivered == ["a@x.example", "c@x.example"]
+    assert sender.stats["failed"] == 1
+    assert sender.pending_retries() == 0
+    assert sender.failed_replies()[0][0] == "bad@x.example"
+
+
+def test_transient_rejection_defers_only_that_reply():
+    FakeSmtp.rules["busy@x.example"] = smtplib.SMTPRecipientsRefused(
+        {"busy@x.example": (450, b"mailbox busy")}
+    )
+    sender = _sender()
+    batch = [OutgoingEmail(addr, "hi") for addr in ("busy@x.example", "b@x.example")]
+
+    assert sender.send_many(batch) == 1
+    assert FakeSmtp.delivered == ["b@x.example"]
+
+    del FakeSmtp.rules["busy@x.example"]
+    _wait(lambda: "busy@x.example" in FakeSmtp.delivered)
+    _wait(lambda: sender.pending_retries() == 0)
+
+
+def test_lost_session_reconnects_once():
+    class DropOnce(FakeSmtp):
+        dropped = False
+
+        def sendmail(self, from_addr, to_addrs, text):
+            if not DropOnce.dropped:
+                DropOnce.dropped = True
+                raise smtplib.SMTPServerDisconnected("gone")
+            super().sendmail(from_addr, to_addrs, text)
+
+    sender = SmtpSender("localhost", 25, starttls=False, smtp_factory=DropOnce)
+    assert sender.send("a@x.example", "hi")
+    assert sender.stats["reconnects"] == 1
+
+
+def test_retries_run_in_due_order(monkeypatch):
+    sender = _sender()
+    monkeypatch.setattr(sender, "send_many", lambda batch: FakeSmtp.delivered.extend(o.to_addr for o in batch))
+    now = time.time()
+    sender._schedule(now + 0.4, OutgoingEmail("late@x.example", "hi"))
+    sender._schedule(now + 0.1, OutgoingEmail("early@x.example", "hi"))
+
+    _wait(lambda: len(FakeSmtp.delivered) == 2)
+    assert FakeSmtp.delivered == ["early@x.example", "late@x.example"]
+
+
+def test_outbox_survives_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(smtp_module, "RETRY_BASE_DELAY", 60)
+    FakeSmtp.rules["a@x.example"] = ConnectionRefusedError("down")
+    sender = _sender(tmp_path)
+    original = {"Subject": "Loan query", "Message-ID": "<m1@x>"}
+    assert not sender.send("a@x.example", "queued reply", original)
+    assert sender.pending_retries() == 1
+
+    # a new process picks the deferred reply up from the outbox
+    del FakeSmtp.rules["a@x.example"]
+    sender._db.execute("UPDATE outbox SET due_at = 0")
+    sender._db.commit()
+    restarted = _sender(tmp_path)
+    _wait(lambda: FakeSmtp.delivered == ["a@x.example"])
+    _wait(lambda: restarted._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0] == 0)
+    assert restarted.failed_replies() == []
+
+
+def test_gives_up_after_retry_attempts(monkeypatch):
+    monkeypatch.setattr(smtp_module, "RETRY_ATTEMPTS", 2)
+    monkeypatch.setattr(smtp_module, "RETRY_BASE_DELAY", 0.01)
+    FakeSmtp.rules["a@x.example"] = smtplib.SMTPResponseException(451, b"try later")
+    sender = _sender()
+    assert not sender.send("a@x.example", "hi")
+    _wait(lambda: sender.stats["failed"] == 1)
+    assert sender.pending_retries() == 0
+    assert [r[0] for r in sender.failed_replies()] == ["a@x.example"]
@@ -0,0 +1,119 @@
+import pytest
+
+from app.ticket_queue import TicketQueue
+
+
+class FakeGlpi:
+    """Records GLPI calls; `fail` holds call kinds that should fail once."""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = set()
+        self.next_id = 100
+
+    def _ok(self, kind):
+        if kind in self.fail:
+            self.fail.discard(kind)
+            return False
+        return True
+
+    def create_ticket(self, title, description):
+        if not self._ok("create"):
+            return None
+        self.next_id += 1
+        self.calls.append(("create", self.next_id, title, description))
+        return self.next_id
+
+    def add_followup(self, ticket_id, message):
+        if not self._ok("followup"):
+            return False
+        self.calls.append(("followup", ticket_id, message))
+        return True
+
+    def close_ticket(self, ticket_id):
+        if not self._ok("close"):
+            return False
+        self.calls.append(("close", ticket_id))
+        return True
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return TicketQueue(str(tmp_path / "ticket_queue.db"), client=FakeGlpi())
+
+
+def _due_now(queue):
+    queue._db.execute("UPDATE ops SET next_at = 0")
+    queue._db.commit()
+
+
+def test_create_resolves_ref_and_merges_followups(queue):
+    resolved = []
+    queue.add_listener(lambda ref, tid: resolved.append((ref, tid)))
+    ref = queue.new_ref()
+    queue.enqueue_create(ref, "title", f"Reference: {ref}", followup="AI reply")
+    queue.enqueue_followup(ref, "second")
+
+    assert queue.display_ref(ref) == f"#{ref} (provisional)"
+    assert queue.flush_once() == 2
+    assert resolved == [(ref, 101)]
+    assert queue.display_ref(ref) == "#101"
+    assert [c[0] for c in queue.client.calls] == ["create", "followup"]
+    assert "AI reply" in queue.client.calls[1][2] and "second" in queue.client.calls[1][2]
+    assert queue.pending() == 0
+
+
+def test_failed_create_is_retried_in_order(queue):
+    queue.client.fail.add("create")
+    ref = queue.new_ref()
+    queue.enqueue_create(ref, "title", "desc")
+    queue.enqueue_close(ref)
+
+    assert queue.flush_once() == 0
+    assert queue.flush_once() == 0   # backing off
+    _due_now(queue)
+    assert queue.flush_once() == 2
+    assert [c[0] for c in queue.client.calls] == ["create", "close"]
+
+
+def test_pending_ops_move_to_ticket_id_on_resolve(queue):
+    ref = queue.new_ref()
+    queue.enqueue_create(ref, "title", "desc")
+    queue.enqueue_followup(ref, "later")
+    queue.client.fail.add("followup")
+    queue.flush_once()
+
+    refs = {row[0] for row in queue._db.execute("SELECT ref FROM ops")}
+    assert refs == {"101"}
+
+
+def test_failed_create_followup_stays_ahead_of_close(queue):
+    ref = queue.new_ref()
+    queue.enqueue_create(ref, "title", "desc", followup="AI reply")
+    queue.client.fail.add("followup")
+    queue.flush_once()   # ticket created, its follow-up failed
+
+    # the sender's state now points at the real id; the close goes there
+    queue.enqueue_close(queue.resolve(ref))
+    assert queue.flush_once() == 0   # close waits behind the follow-up
+    _due_now(queue)
+    queue.flush_once()
+
+    assert [c[0] for c in queue.client.calls] == ["create", "followup", "close"]
+    assert queue.pending() == 0
+
+
+def test_other_tickets_are_not_blocked(queue):
+    queue.client.fail.add("close")
+    queue.enqueue_close(7)
+    queue.enqueue_followup(8, "hello")
+    assert queue.flush_once() == 1
+    assert queue.client.calls == [("followup", 8, "hello")]
+
+
+def test_ops_survive_restart(tmp_path):
+    path = str(tmp_path / "ticket_queue.db")
+    TicketQueue(path, client=FakeGlpi()).enqueue_followup(5, "hello")
+    restarted = TicketQueue(path, client=FakeGlpi())
+    assert restarted.pending() == 1
+    assert restarted.flush_once() == 1